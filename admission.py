@@ -0,0 +1,150 @@
+"""Admission control in front of SharePoint.
+
+Every SharePoint operation first takes a token from a global bucket and,
+when it runs on behalf of a supplier, from that supplier's bucket. Calls
+that find the buckets empty wait for a token up to a deadline and are
+rejected with ``Throttled`` beyond it, so a burst of users or one runaway
+client cannot exhaust the Microsoft 365 throttling budget for everybody.
+``coalesce`` lets identical fetches that overlap share one call.
+
+Counters per operation (admitted, delayed, rejected, coalesced, waiting
+time) are kept for the admin dashboard.
+"""
+import threading
+import time
+
+
+class Throttled(Exception):
+    """Raised when an operation cannot be admitted before its deadline"""
+
+
+class TokenBucket:
+    """``rate`` tokens per second, at most ``burst`` saved up.
+
+    Tokens may go negative: a caller that is admitted with a wait reserves
+    its token right away, so later callers queue behind it.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is now)"""
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0) * self.rate)
+        self.updated = max(now, self.updated)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AdmissionController:
+    """Global and per-supplier token buckets with deadlines and metrics"""
+
+    def __init__(self, rate=2.0, burst=10, supplier_rate=0.1, supplier_burst=5, max_wait=10.0):
+        self.max_wait = max_wait
+        self.supplier_rate = supplier_rate
+        self.supplier_burst = supplier_burst
+        self._global = TokenBucket(rate, burst)
+        self._suppliers = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Build from a ``[limites]`` secrets section.
+
+        ``por_segundo`` and ``rafaga`` (global), ``por_proveedor_por_minuto``
+        and ``rafaga_proveedor`` (each supplier) and ``espera_maxima``
+        (seconds) are all optional.
+        """
+        mapping = mapping or {}
+        return cls(
+            rate=float(mapping.get('por_segundo', 2.0)),
+            burst=float(mapping.get('rafaga', 10)),
+            supplier_rate=float(mapping.get('por_proveedor_por_minuto', 6)) / 60,
+            supplier_burst=float(mapping.get('rafaga_proveedor', 5)),
+            max_wait=float(mapping.get('espera_maxima', 10.0)),
+        )
+
+    def _count(self, operation, field, amount=1):
+        counters = self._metrics.setdefault(operation, {
+            'admitidas': 0, 'demoradas': 0, 'rechazadas': 0, 'agrupadas': 0,
+            'espera_total_s': 0.0, 'espera_max_s': 0.0,
+        })
+        counters[field] += amount
+        return counters
+
+    def admit(self, operation, supplier=None, timeout=None):
+        """Block until ``operation`` may run; raise ``Throttled`` past ``timeout``"""
+        timeout = self.max_wait if timeout is None else timeout
+        with self._lock:
+            now = time.monotonic()
+            buckets = [self._global]
+            if supplier:
+                bucket = self._suppliers.get(supplier)
+                if bucket is None:
+                    bucket = self._suppliers[supplier] = TokenBucket(self.supplier_rate, self.supplier_burst)
+                buckets.append(bucket)
+            wait = max(b.wait_time(now) for b in buckets)
+            if wait > timeout:
+                # Nothing is taken: a rejected call does not delay the others
+                self._count(operation, 'rechazadas')
+                raise Throttled(f"{operation}: se necesitarían {wait:.1f} s de espera (máximo {timeout:.1f} s)")
+            for bucket in buckets:
+                bucket.take()
+            counters = self._count(operation, 'admitidas')
+            if wait > 0:
+                counters['demoradas'] += 1
+                counters['espera_total_s'] += wait
+                counters['espera_max_s'] = max(counters['espera_max_s'], wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def coalesce(self, key, fn, operation=None, timeout=None):
+        """Run ``fn()``, or wait for the identical call already in flight.
+
+        Callers that join a flight share its result or its exception.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._count(operation or key, 'agrupadas')
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise Throttled(f"{operation or key}: la operación en curso no terminó a tiempo")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def metrics(self):
+        """Counters per operation, as a list of dicts"""
+        with self._lock:
+            return [
+                {'operacion': operation, **{k: round(v, 2) for k, v in counters.items()}}
+                for operation, counters in sorted(self._metrics.items())
+            ]
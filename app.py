@@ -1,15 +1,27 @@
-import io
 import os
+import copy
+import logging
+import threading
 import streamlit as st
-import pandas as pd
+from streamlit import runtime
+from contextlib import contextmanager
 from datetime import datetime, timedelta, time
-from office365.sharepoint.client_context import ClientContext
-from office365.runtime.auth.user_credential import UserCredential
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+from capacity import CapacityConfig, DaySchedule
+from kpis import KpiEngine, DIMENSIONS, GESTION_COLUMNS
+from sizing import SizingTable
+from checkin import EVENTS, GestionWriteBehind, booking_row, gestion_key, is_stamped, stamp
+from workbook_io import CHUNK_BYTES, GESTION_SHEET, patch_frame, patch_sheet, read_workbook, spooled, stream_size, write_workbook
+from events import ChangeFeed
+from admission import AdmissionController, Throttled
+from integrity import ISSUES, IntegrityMonitor
+from reservas_schema import format_minute, format_time_range, parse_minute
+from warehouses import load_all, load_registry
+from profiling import Profile, load_profiles, mark
+
+# pandas, office365, openpyxl and the email stack are imported inside the
+# functions that need them so the first render does not pay for them.
+
+logger = logging.getLogger(__name__)
 
 st.set_page_config(page_title="Dismac: Reserva de Entrega de Mercadería", layout="wide")
 
@@ -18,7 +30,6 @@ st.set_page_config(page_title="Dismac: Reserva de Entrega de Mercadería", layou
 # ─────────────────────────────────────────────────────────────
 try:
     SITE_URL = os.getenv("SP_SITE_URL") or st.secrets["SP_SITE_URL"]
-    FILE_ID = os.getenv("SP_FILE_ID") or st.secrets["SP_FILE_ID"]
     USERNAME = os.getenv("SP_USERNAME") or st.secrets["SP_USERNAME"]
     PASSWORD = os.getenv("SP_PASSWORD") or st.secrets["SP_PASSWORD"]
     
@@ -32,158 +43,512 @@ except KeyError as e:
     st.error(f"🔒 Falta configuración: {e}")
     st.stop()
 
+def _optional_secret(name, default=None):
+    """Optional secrets section; missing secrets.toml counts as not set"""
+    try:
+        return st.secrets.get(name, default)
+    except FileNotFoundError:
+        return default
+
+# Docks, opening hours, holidays and booking lengths ([capacidad] in secrets);
+# the default for warehouses that do not declare their own
+try:
+    CAPACITY = CapacityConfig.from_mapping(_optional_secret("capacidad"))
+except ValueError as e:
+    st.error(f"🔒 Configuración de capacidad inválida: {e}")
+    st.stop()
+
+# Receiving locations ([almacenes.<clave>] in secrets), or the single SP_FILE_ID workbook
+try:
+    WAREHOUSES = load_registry(
+        _optional_secret("almacenes"),
+        os.getenv("SP_FILE_ID") or _optional_secret("SP_FILE_ID"),
+        CAPACITY,
+    )
+except ValueError as e:
+    st.error(f"🔒 Configuración de almacenes inválida: {e}")
+    st.stop()
+if not WAREHOUSES:
+    st.error("🔒 Falta configuración: SP_FILE_ID o [almacenes]")
+    st.stop()
+
+def _user_list(name):
+    """Comma separated usuarios from env or secrets"""
+    value = os.getenv(name) or _optional_secret(name, "")
+    return {usuario.strip() for usuario in str(value).split(',') if usuario.strip()}
+
+# SharePoint request budget (optional [limites] section)
+LIMITS = _optional_secret("limites")
+
+# Users that also see the admin views; admins also get the reception console
+ADMIN_USERS = _user_list("ADMIN_USERS")
+STAFF_USERS = _user_list("STAFF_USERS") | ADMIN_USERS
+
+# Rerun profiles recorded from the admin sidebar
+PROFILES_DIR = os.getenv("PROFILES_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# ─────────────────────────────────────────────────────────────
+# 2. SharePoint Connection - LAZY CLIENT, SHARED AUTHENTICATED CONTEXTS
+# ─────────────────────────────────────────────────────────────
+def _sharepoint_client():
+    """Import the SharePoint client on first use (office365 is slow to import)"""
+    from office365.sharepoint.client_context import ClientContext
+    from office365.runtime.auth.user_credential import UserCredential
+    return ClientContext, UserCredential
+
+class SharePointContextPool:
+    """Authenticated SharePoint contexts reused across sessions.
+
+    A context is checked out by one caller at a time, so pending queries of
+    concurrent sessions never mix. Contexts are dropped after ``max_age``
+    seconds so the authentication cookies never go stale. Every checkout is
+    one operation for ``admission``, which may delay or reject it, unless
+    the caller already took its token (``admit=False``).
+    """
+
+    def __init__(self, admission=None, max_idle=4, max_age=1800):
+        self.admission = admission
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        ClientContext, UserCredential = _sharepoint_client()
+        ctx = ClientContext(SITE_URL).with_credentials(UserCredential(USERNAME, PASSWORD))
+        # Loading the web forces the authentication round trips now
+        ctx.load(ctx.web)
+        ctx.execute_query()
+        return ctx, datetime.now()
+
+    def prewarm(self, count=1):
+        """Authenticate ``count`` contexts ahead of the first request"""
+        for _ in range(count):
+            entry = self._connect()
+            with self._lock:
+                if len(self._idle) >= self.max_idle:
+                    return
+                self._idle.append(entry)
+
+    @contextmanager
+    def context(self, operation="sharepoint", supplier=None, timeout=None, admit=True):
+        if admit and self.admission is not None:
+            self.admission.admit(operation, supplier, timeout)
+        entry = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if (datetime.now() - candidate[1]).total_seconds() < self.max_age:
+                    entry = candidate
+                    break
+        if entry is None:
+            entry = self._connect()
+
+        yield entry[0]
+
+        # Only reached when the caller did not raise: a failed context may
+        # still hold a half-built query, so it is simply discarded.
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(entry)
+
+@st.cache_resource(show_spinner=False)
+def get_admission():
+    """Process-wide SharePoint request budget"""
+    return AdmissionController.from_mapping(LIMITS)
+
+@st.cache_resource(show_spinner=False)
+def get_sharepoint_pool():
+    """Process-wide pool of SharePoint contexts, shared by all warehouses"""
+    # Room for one context per warehouse, so parallel loads all return theirs
+    return SharePointContextPool(admission=get_admission(), max_idle=max(4, len(WAREHOUSES)))
+
+def _current_supplier():
+    """Supplier of the session running this code; None in background threads"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx() is None:
+        return None
+    return st.session_state.get('supplier_name')
+
+# Shown whenever the request budget rejects an interactive call
+THROTTLED_MESSAGE = "⏳ Hay muchas solicitudes en este momento. Intente nuevamente en unos segundos."
+
+@st.cache_resource(show_spinner=False)
+def get_commit_lock(key):
+    """Serializes commits to one warehouse's workbook within this server process"""
+    return threading.Lock()
+
+# Longest a commit waits for another one of the same warehouse
+COMMIT_LOCK_TIMEOUT = 30
+
+@contextmanager
+def commit_lock(key, operation):
+    """Hold the warehouse's commit lock; ``Throttled`` if it stays busy too long.
+
+    Take the SharePoint admission tokens before entering: a call waiting
+    on the request budget must not keep the other commits waiting too.
+    """
+    lock = get_commit_lock(key)
+    if not lock.acquire(timeout=COMMIT_LOCK_TIMEOUT):
+        raise Throttled(f"{operation}: {key} ocupado más de {COMMIT_LOCK_TIMEOUT} s")
+    try:
+        yield
+    finally:
+        lock.release()
+
 # ─────────────────────────────────────────────────────────────
-# 2. Excel Download Functions - UPDATED TO INCLUDE GESTION SHEET
+# 3. Excel Download Functions - UPDATED TO INCLUDE GESTION SHEET
 # ─────────────────────────────────────────────────────────────
-@st.cache_data(ttl=300, show_spinner=False)  # Add show_spinner=False
-def download_excel_to_memory():
-    """Download Excel file from SharePoint to memory - INCLUDES ALL SHEETS"""
+def _open_workbook_file(ctx, warehouse):
+    """Loaded SharePoint file object of a warehouse's reservations workbook"""
+    file = ctx.web.get_file_by_id(warehouse.file_id)
+    if file is None:
+        raise Exception(f"File object is None - file_id of {warehouse.key} may be incorrect")
+    ctx.load(file)
+    ctx.execute_query()
+    return file
+
+def _download_file(ctx, file):
+    """Stream a loaded SharePoint file into a spooled file, rewound.
+
+    The chunked download session comes first; the whole-response fallback
+    (one extra full copy) is only used by clients without it.
+    """
+    target = spooled()
+
+    def restart():
+        # A failed attempt may have written part of the file
+        target.seek(0)
+        target.truncate()
+
+    # Try multiple download methods
     try:
-        # Authenticate
-        user_credentials = UserCredential(USERNAME, PASSWORD)
-        ctx = ClientContext(SITE_URL).with_credentials(user_credentials)
-        
-        # Get file
-        file = ctx.web.get_file_by_id(FILE_ID)
-        if file is None:
-            raise Exception("File object is None - FILE_ID may be incorrect")
-            
-        ctx.load(file)
+        file.download_session(target, chunk_size=CHUNK_BYTES)
         ctx.execute_query()
-        
-        # Download to memory
-        file_content = io.BytesIO()
-        
-        # Try multiple download methods
+    except (AttributeError, TypeError) as e:
         try:
-            file.download(file_content)
+            restart()
+            file.download(target)
             ctx.execute_query()
-        except TypeError as e:
+        except TypeError as e2:
             try:
+                restart()
                 response = file.download()
                 if response is None:
                     raise Exception("Download response is None")
                 ctx.execute_query()
-                file_content = io.BytesIO(response.content)
-            except Exception as e2:
-                try:
-                    file.download_session(file_content)
-                    ctx.execute_query()
-                except Exception as e3:
-                    raise Exception(f"All download methods failed: {e}, {e2}, {e3}")
-        
-        file_content.seek(0)
-        
-        # Load all sheets - UPDATED
-        credentials_df = pd.read_excel(file_content, sheet_name="proveedor_credencial", dtype=str)
-        reservas_df = pd.read_excel(file_content, sheet_name="proveedor_reservas")
-        
-        # Try to load gestion sheet, create empty if doesn't exist - NEW
-        try:
-            gestion_df = pd.read_excel(file_content, sheet_name="proveedor_gestion")
-        except ValueError:
-            # Create empty gestion dataframe with required columns if sheet doesn't exist
-            gestion_df = pd.DataFrame(columns=[
-                'Orden_de_compra', 'Proveedor', 'Numero_de_bultos',
-                'Hora_llegada', 'Hora_inicio_atencion', 'Hora_fin_atencion',
-                'Tiempo_espera', 'Tiempo_atencion', 'Tiempo_total', 'Tiempo_retraso',
-                'numero_de_semana', 'hora_de_reserva'
-            ])
-        
-        return credentials_df, reservas_df, gestion_df
-        
+                target.write(response.content)
+            except Exception as e3:
+                target.close()
+                raise Exception(f"All download methods failed: {e}, {e2}, {e3}")
+
+    target.seek(0)
+    return target
+
+class WorkbookConflict(Exception):
+    """The workbook changed on SharePoint since it was read (If-Match failed)"""
+
+def _upload_workbook(ctx, file, stream, if_match=None):
+    """Overwrite the workbook on SharePoint with ``stream``; returns the new ETag if known.
+
+    With ``if_match`` (the ETag the data was read at) the write is one
+    conditional PUT: SharePoint refuses it when anyone (another server
+    process, a manual edit) saved in between, and ``WorkbookConflict`` is
+    raised instead of overwriting their change. The body is the stream
+    itself, so no in-memory copy holds the whole file.
+
+    Without it, anything larger than one chunk goes through an upload session.
+    """
+    if if_match:
+        return _put_if_match(ctx, file, stream, if_match)
+
+    file_name = file.properties['Name']
+    server_relative_url = file.properties['ServerRelativeUrl']
+    folder_url = server_relative_url.replace('/' + file_name, '')
+
+    folder = ctx.web.get_folder_by_server_relative_url(folder_url)
+    if stream_size(stream) <= CHUNK_BYTES:
+        uploaded = folder.files.add(file_name, stream.read(), True)
+    else:
+        uploaded = folder.files.create_upload_session(stream, CHUNK_BYTES, file_name=file_name)
+    ctx.execute_query()
+    return uploaded.properties.get('ETag')
+
+def _put_if_match(ctx, file, stream, etag):
+    from office365.runtime.http.http_method import HttpMethod
+    from office365.runtime.http.request_options import RequestOptions
+
+    url = file.properties['ServerRelativeUrl'].replace("'", "''")
+    request = RequestOptions(f"{ctx.service_root_url()}/web/GetFileByServerRelativeUrl('{url}')/$value")
+    request.method = HttpMethod.Post
+    request.set_header('X-HTTP-Method', 'PUT')
+    request.set_header('If-Match', etag)
+    # Small files as bytes; larger ones are streamed from the spooled file
+    request.data = stream.read() if stream_size(stream) <= CHUNK_BYTES else stream
+    response = ctx.pending_request().execute_request_direct(request)
+    if response.status_code == 412:
+        raise WorkbookConflict(f"{file.properties.get('Name', 'workbook')} cambió en SharePoint")
+    response.raise_for_status()
+    return response.headers.get('ETag')
+
+def _fetch_workbook(warehouse, admit=True):
+    """``(credentials_df, reservas, gestion_df, etag)`` freshly read from SharePoint.
+
+    ``etag`` is the revision the data was read at (None if SharePoint did
+    not report one), for a conditional write back. The download is charged
+    to the global budget only: the result is shared by every session.
+    """
+    with get_sharepoint_pool().context("descarga", admit=admit) as ctx:
+        file = _open_workbook_file(ctx, warehouse)
+        file_content = _download_file(ctx, file)
+        etag = file.properties.get('ETag')
+        version = etag or file.properties.get('TimeLastModified')
+
+    # Load all sheets from one open workbook
+    with file_content:
+        credentials_df, reservas, gestion_df = read_workbook(file_content)
+    reservas.version = version
+
+    return credentials_df, reservas, gestion_df, etag
+
+def _load_workbook(warehouse):
+    """Download a warehouse's Excel file from SharePoint to memory - INCLUDES ALL SHEETS.
+
+    Reservations are parsed once into a ``ReservationTable``. Raises on
+    failure so that errors are never cached.
+    """
+    return _fetch_workbook(warehouse)[:3]
+
+class WorkbookStore:
+    """Latest parsed workbook, shared by all sessions.
+
+    Commits made by this process replace the snapshot with the data they just
+    uploaded (and publish the dates they touched on the change feed), so it
+    stays current without polling. Bookings saved by other server processes
+    and edits made directly on SharePoint are only seen on a reload, so
+    ``max_age`` keeps the five minutes the cached download had. Callers must
+    not mutate the snapshot: it is the same object for every session.
+    """
+
+    def __init__(self, load, max_age=300):
+        self._load = load
+        self.max_age = max_age
+        self._snapshot = None
+        self._loaded_at = None
+        # Bumped by put/update so a slower load never overwrites newer data
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            snapshot, generation = self._snapshot, self._generation
+            if snapshot is not None and (datetime.now() - self._loaded_at).total_seconds() < self.max_age:
+                return snapshot
+        loaded = self._load()
+        with self._lock:
+            if self._generation == generation:
+                self._snapshot = loaded
+                self._loaded_at = datetime.now()
+        return loaded
+
+    def put(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = datetime.now()
+            self._generation += 1
+
+    def update(self, change):
+        """Replace the snapshot with ``change(snapshot)``, computed outside the lock.
+
+        ``change`` returns None when the snapshot cannot be brought up to
+        date, which drops it so the next ``get`` loads again. Nothing
+        happens while none is loaded or if a newer one was put meanwhile.
+        """
+        with self._lock:
+            snapshot, generation = self._snapshot, self._generation
+        if snapshot is None:
+            return
+        changed = change(snapshot)
+        with self._lock:
+            if self._generation == generation:
+                self._snapshot = changed
+                self._loaded_at = datetime.now()
+                self._generation += 1
+
+@st.cache_resource(show_spinner=False)
+def get_workbook_store(key):
+    """Process-wide snapshot of one warehouse's workbook; concurrent reloads share one download"""
+    warehouse = WAREHOUSES[key]
+    return WorkbookStore(lambda: get_admission().coalesce(
+        ("workbook", key), lambda: _load_workbook(warehouse), "descarga"))
+
+@st.cache_resource(show_spinner=False)
+def get_change_feed():
+    """Process-wide change notifications.
+
+    Topics are (warehouse key, date ordinal) for bookings and (warehouse key,
+    GESTION_SHEET) for reception stamps written to the workbook.
+    """
+    return ChangeFeed()
+
+def download_excel_to_memory(warehouse):
+    """Shared workbook snapshot of a warehouse; shows the error and returns Nones on failure"""
+    try:
+        return get_workbook_store(warehouse.key).get()
+    except Throttled:
+        st.warning(THROTTLED_MESSAGE)
+        return None, None, None
     except Exception as e:
         st.error(f"Error descargando Excel: {str(e)}")
         st.error(f"SITE_URL: {SITE_URL}")
-        st.error(f"FILE_ID: {FILE_ID}")
+        st.error(f"FILE_ID ({warehouse.nombre}): {warehouse.file_id}")
         st.error(f"Error type: {type(e).__name__}")
         return None, None, None
 
-def save_booking_to_excel(new_booking):
-    """Save new booking to Excel file - PRESERVES ALL SHEETS - SINGLE ROW FOR 1-HOUR SLOTS"""
-    try:
-        # Load current data
-        download_excel_to_memory.clear()
-        credentials_df, reservas_df, gestion_df = download_excel_to_memory()
-        
-        if reservas_df is None:
-            st.error("❌ No se pudo cargar el archivo Excel")
-            return False
+# Times a booking is re-allocated when the workbook changed during its save
+SAVE_ATTEMPTS = 3
 
-        # 🔒 ADD THIS: Final check INSIDE save function
-        fecha_reserva = new_booking['Fecha']
-        hora_reserva = new_booking['Hora']
-        
-        existing_booking = reservas_df[
-            (reservas_df['Fecha'] == fecha_reserva) & 
-            (reservas_df['Hora'] == hora_reserva)
-        ]
-        
-        if not existing_booking.empty:
-            st.error("❌ Otro proveedor acaba de reservar este horario")
-            download_excel_to_memory.clear()
-            return False
-        # 🔒 END ADDITION
-        
-        # Add new booking as single row
-        new_row = pd.DataFrame([new_booking])
-        reservas_df = pd.concat([reservas_df, new_row], ignore_index=True)
-        
-        # Authenticate and upload
-        user_credentials = UserCredential(USERNAME, PASSWORD)
-        ctx = ClientContext(SITE_URL).with_credentials(user_credentials)
-        
-        # Create Excel file - SAVE ALL SHEETS
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            credentials_df.to_excel(writer, sheet_name="proveedor_credencial", index=False)
-            reservas_df.to_excel(writer, sheet_name="proveedor_reservas", index=False)
-            gestion_df.to_excel(writer, sheet_name="proveedor_gestion", index=False)
-        
-        # Get the file info
-        file = ctx.web.get_file_by_id(FILE_ID)
-        ctx.load(file)
-        ctx.execute_query()
-        
-        file_name = file.properties['Name']
-        server_relative_url = file.properties['ServerRelativeUrl']
-        folder_url = server_relative_url.replace('/' + file_name, '')
-        
-        # Upload the updated file
-        folder = ctx.web.get_folder_by_server_relative_url(folder_url)
-        excel_buffer.seek(0)
-        folder.files.add(file_name, excel_buffer.getvalue(), True)
-        ctx.execute_query()
-        
-        # Clear cache only after successful save
-        download_excel_to_memory.clear()
-        
-        return True
+def save_booking_to_excel(warehouse, new_booking):
+    """Save new booking to the warehouse's Excel file - PRESERVES ALL SHEETS - ONE ROW PER BOOKING.
+
+    ``new_booking`` uses the canonical fields: ``Fecha`` (date), ``Inicio_min``,
+    ``Slots``, ``Proveedor``, ``Numero_de_bultos`` and ``Orden_de_compra`` (list).
+    The allocated dock is stored back in ``new_booking['Anden']``.
+    """
+    admission = get_admission()
+    supplier = _current_supplier()
+    try:
+        for _ in range(SAVE_ATTEMPTS):
+            # Tokens for the download and the upload first, outside the lock
+            admission.admit("descarga", supplier)
+            admission.admit("guardar", supplier)
+            # 🔒 One check-and-write at a time within this process, so its own
+            # sessions do not race each other into conflicts. Each warehouse
+            # has its own lock, so a busy location never holds up the others.
+            # Writers outside this process are caught by the conditional upload.
+            with commit_lock(warehouse.key, "guardar"):
+                saved = _try_save_booking(warehouse, new_booking)
+            if saved is not None:
+                return saved
+        st.error("❌ El archivo de reservas está siendo modificado. Intente nuevamente en unos segundos.")
+        return False
         
+    except Throttled:
+        st.warning(THROTTLED_MESSAGE)
+        return False
     except Exception as e:
         st.error(f"❌ Error guardando reserva: {str(e)}")
         return False
 
+def _try_save_booking(warehouse, new_booking):
+    """One read-allocate-write round; None when the workbook changed before the write.
+
+    Runs under the commit lock with its admission tokens already taken.
+    """
+    store = get_workbook_store(warehouse.key)
+    # Load current data into a private copy; the cached table is shared
+    credentials_df, reservas, gestion_df, etag = _fetch_workbook(warehouse, admit=False)
+    fecha = new_booking['Fecha'].toordinal()
+    topic = (warehouse.key, fecha)
+
+    # Final check INSIDE save function: allocate a dock on fresh data
+    schedule = get_day_schedule(warehouse, reservas, new_booking['Fecha'])
+    dock = schedule.occupy(new_booking['Inicio_min'], new_booking['Slots'])
+    if dock is None:
+        st.error("❌ Otro proveedor acaba de reservar este horario")
+        # The workbook changed behind our back: share what we just read
+        store.put((credentials_df, reservas, gestion_df))
+        get_change_feed().publish(topic)
+        return False
+    new_booking['Anden'] = dock
+    
+    # Add new booking as single row (+ its purchase orders)
+    reservas.append(
+        fecha,
+        new_booking['Inicio_min'],
+        new_booking['Slots'],
+        new_booking['Proveedor'],
+        new_booking['Numero_de_bultos'],
+        new_booking['Orden_de_compra'],
+        anden=dock,
+    )
+    
+    # Create Excel file - SAVE ALL SHEETS - straight into a spooled file
+    try:
+        with write_workbook(spooled(), credentials_df, reservas, gestion_df) as excel_file:
+            with get_sharepoint_pool().context("guardar", admit=False) as ctx:
+                # Upload the updated file, only over the revision we allocated on
+                file = _open_workbook_file(ctx, warehouse)
+                new_etag = _upload_workbook(ctx, file, excel_file, if_match=etag)
+    except WorkbookConflict as e:
+        logger.info("Booking save conflict, allocating again: %s", e)
+        return None
+    
+    # Only after a successful save: the uploaded data becomes the shared
+    # snapshot and sessions showing this date refresh their slot grid
+    reservas.version = new_etag or f"{reservas.version}+{reservas.reserva_id[-1]}"
+    store.put((credentials_df, reservas, gestion_df))
+    get_change_feed().publish(topic)
+    
+    return True
+
+def _flush_gestion_patches(warehouse, patches):
+    """Write a batch of gestion row patches into a warehouse's workbook.
+
+    Only the rows of proveedor_gestion that change are rewritten; the other
+    sheets are copied as they are. The upload is conditional on the revision
+    that was patched, so an edit made meanwhile is never overwritten: the
+    batch fails and the writer retries it on fresh data. Afterwards the
+    shared snapshot gets the same rows. Runs on the write-behind thread.
+    """
+    # Background work: it may wait longer for its token than a user would,
+    # but takes it before the lock so bookings are not held up meanwhile
+    get_admission().admit("recepcion", timeout=60)
+    with commit_lock(warehouse.key, "recepcion"):
+        with get_sharepoint_pool().context("recepcion", admit=False) as ctx:
+            file = _open_workbook_file(ctx, warehouse)
+            etag = file.properties.get('ETag')
+            with _download_file(ctx, file) as content:
+                patched = patch_sheet(content, GESTION_SHEET, GESTION_COLUMNS, gestion_key, patches)
+            with patched:
+                new_etag = _upload_workbook(ctx, file, patched, if_match=etag)
+
+    def refresh(snapshot):
+        credentials_df, reservas, gestion_df = snapshot
+        if etag is None or reservas.version != etag:
+            # The snapshot was behind the revision just patched: load it again
+            return None
+        reservas = copy.copy(reservas)
+        reservas.version = new_etag or f"{etag}+{datetime.now():%H%M%S%f}"
+        return credentials_df, reservas, patch_frame(gestion_df, GESTION_COLUMNS, gestion_key, patches)
+
+    get_workbook_store(warehouse.key).update(refresh)
+    get_change_feed().publish((warehouse.key, GESTION_SHEET))
+
+@st.cache_resource(show_spinner=False)
+def get_gestion_writer(key):
+    """Process-wide write-behind buffer for one warehouse's reception stamps"""
+    warehouse = WAREHOUSES[key]
+    return GestionWriteBehind(lambda patches: _flush_gestion_patches(warehouse, patches))
+
 # ─────────────────────────────────────────────────────────────
-# 3. Email Functions
+# 4. Email Functions
 # ─────────────────────────────────────────────────────────────
-def download_pdf_attachment():
-    """Download PDF attachment from SharePoint"""
-    try:
-        # Authenticate
-        user_credentials = UserCredential(USERNAME, PASSWORD)
-        ctx = ClientContext(SITE_URL).with_credentials(user_credentials)
-        
-        # Target filename and exact path
-        target_filename = "GUIA_DEL_SELLER_DISMAC_MARKETPLACE_Rev._1.pdf"
-        file_path = f"/personal/ljbyon_dismac_com_bo/Documents/{target_filename}"
-        
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_pdf_attachment():
+    """Download PDF attachment from SharePoint; raises so failures are not cached"""
+    # Target filename and exact path
+    target_filename = "GUIA_DEL_SELLER_DISMAC_MARKETPLACE_Rev._1.pdf"
+    file_path = f"/personal/ljbyon_dismac_com_bo/Documents/{target_filename}"
+
+    # Cached and coalesced for everybody: global budget only
+    with get_sharepoint_pool().context("guia_pdf") as ctx:
         try:
             # Try to get the file directly
             pdf_file = ctx.web.get_file_by_server_relative_url(file_path)
             ctx.load(pdf_file)
             ctx.execute_query()
-            
+
         except Exception as e:
             # Fallback: List files in Documents folder
             try:
@@ -191,23 +556,23 @@ def download_pdf_attachment():
                 files = folder.files
                 ctx.load(files)
                 ctx.execute_query()
-                
+
                 found_files = []
                 pdf_file = None
-                
+
                 for file in files:
                     filename = file.name
                     found_files.append(filename)
-                    
+
                     # Check if this is our target file
                     if filename == target_filename:
                         pdf_file = file
                         break
-                
+
                 # If still not found, try any PDF
                 if pdf_file is None:
                     pdf_files = [f for f in found_files if f.lower().endswith('.pdf')]
-                    
+
                     if pdf_files:
                         # Use the first PDF found
                         first_pdf = pdf_files[0]
@@ -217,95 +582,83 @@ def download_pdf_attachment():
                         ctx.execute_query()
                     else:
                         raise Exception(f"No se encontró {target_filename} ni otros PDFs en Documents")
-                        
+
             except Exception as e2:
                 raise Exception(f"No se pudo acceder a Documents: {str(e2)}")
-        
+
         if pdf_file is None:
             raise Exception("No se pudo cargar el archivo PDF")
-        
-        # Download PDF to memory
-        pdf_content = io.BytesIO()
-        
-        try:
-            pdf_file.download(pdf_content)
-            ctx.execute_query()
-        except TypeError:
-            try:
-                response = pdf_file.download()
-                ctx.execute_query()
-                pdf_content = io.BytesIO(response.content)
-            except:
-                pdf_file.download_session(pdf_content)
-                ctx.execute_query()
-        
-        pdf_content.seek(0)
-        pdf_data = pdf_content.getvalue()
-        
-        # Get filename
-        try:
-            filename = pdf_file.properties.get('Name', target_filename)
-        except:
-            filename = target_filename
-        
-        return pdf_data, filename
-        
+
+        # Download PDF; the bytes are needed once, for the attachment
+        with _download_file(ctx, pdf_file) as pdf_content:
+            pdf_data = pdf_content.read()
+
+    # Get filename
+    try:
+        filename = pdf_file.properties.get('Name', target_filename)
+    except:
+        filename = target_filename
+
+    return pdf_data, filename
+
+def download_pdf_attachment():
+    """Cached PDF attachment; warns and returns Nones on failure"""
+    try:
+        # Sessions confirming at the same time share one download
+        return get_admission().coalesce("pdf", _fetch_pdf_attachment, "guia_pdf")
     except Exception as e:
         # Only show error if PDF download fails
         st.warning(f"No se pudo descargar el archivo adjunto: {str(e)}")
         return None, None
 
-def send_booking_email(supplier_email, supplier_name, booking_details, cc_emails=None):
+def send_booking_email(warehouse, supplier_email, supplier_name, booking_details, cc_emails=None):
     """Send booking confirmation email with PDF attachment"""
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.base import MIMEBase
+    from email import encoders
+
     try:
-        # Use provided CC emails or default
+        # Use provided CC emails or the warehouse defaults
         if cc_emails is None or len(cc_emails) == 0:
-            cc_emails = ["ljbyon@dismac.com.bo"]
+            cc_emails = list(warehouse.cc)
         else:
-            # Add default email to the CC list if not already present
+            # Add the warehouse defaults to the CC list if not already present
             if "marketplace@dismac.com.bo" not in cc_emails:
-                cc_emails = cc_emails + ["ljbyon@dismac.com.bo"]
+                cc_emails = cc_emails + [email for email in warehouse.cc if email not in cc_emails]
         
         # Email content
         subject = "Confirmación de Reserva para Entrega de Mercadería"
         
         # Format dates for email display
-        display_fecha = booking_details['Fecha'].split(' ')[0]  # Remove time part for display
-        
-        # Handle combined hora format for 1-hour reservations
-        hora_field = booking_details['Hora']
-        if ',' in hora_field:
-            # Combined slots - show as range
-            slots = [slot.strip() for slot in hora_field.split(',')]
-            start_time = slots[0].rsplit(':', 1)[0]  # Remove seconds
-            end_time_parts = slots[1].split(':')
-            end_hour = int(end_time_parts[0])
-            end_minute = int(end_time_parts[1])
-            # Add 30 minutes to get actual end time
-            if end_minute == 30:
-                end_hour += 1
-                end_minute = 0
-            else:
-                end_minute = 30
-            end_time = f"{end_hour:02d}:{end_minute:02d}"
-            display_hora = f"{start_time} - {end_time}"
-            duration_info = " (Duración: 1 hora)"
+        display_fecha = booking_details['Fecha'].strftime('%Y-%m-%d')
+        
+        # Multi-slot reservations are shown as a range
+        if booking_details['Slots'] > 1:
+            display_hora = format_time_range(booking_details['Inicio_min'], booking_details['Slots'])
+            duration_info = f" (Duración: {format_duration(booking_details['Slots'])})"
         else:
-            # Single slot
-            display_hora = hora_field.rsplit(':', 1)[0]  # Remove seconds
+            display_hora = format_minute(booking_details['Inicio_min'])
             duration_info = ""
         
+        # Only worth mentioning when there is more than one warehouse / dock
+        warehouse_info = f"\n        🏭 Almacén: {warehouse.nombre}" if len(WAREHOUSES) > 1 else ""
+        dock_info = ""
+        if warehouse.capacity.docks > 1 and booking_details.get('Anden', -1) >= 0:
+            dock_info = f"\n        🚪 Andén: {booking_details['Anden'] + 1}"
+        
         body = f"""
         Hola {supplier_name},
         
         Su reserva de entrega ha sido confirmada exitosamente.
         
         DETALLES DE LA RESERVA:
-        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━{warehouse_info}
         📅 Fecha: {display_fecha}
         🕐 Horario: {display_hora}{duration_info}
-        📦 Número de bultos: {booking_details['Numero_de_bultos']}
-        📋 Orden de compra: {booking_details['Orden_de_compra']}
+        📦 Número de bultos: {booking_details['Numero_de_bultos']}{dock_info}
+        📋 Orden de compra: {', '.join(booking_details['Orden_de_compra'])}
         
         INSTRUCCIONES:
         ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -371,139 +724,47 @@ def send_booking_email(supplier_email, supplier_name, booking_details, cc_emails
         return False, []
 
 # ─────────────────────────────────────────────────────────────
-# 4. Time Slot Functions - UPDATED FOR CONTIGUOUS SLOT LOGIC
+# 5. Time Slot Functions - DOCK CAPACITY ENGINE
 # ─────────────────────────────────────────────────────────────
-def parse_booked_slots(booked_hours):
-    """Parse booked hours that may contain single or combined time slots"""
-    all_booked_slots = []
-    
-    for booked_hora in booked_hours:
-        hora_str = str(booked_hora).strip()
-        
-        # Skip empty or NaN values
-        if not hora_str or hora_str.lower() in ['nan', 'none', '']:
-            continue
-        
-        # Check if it contains comma (combined slots)
-        if ',' in hora_str:
-            # Split by comma and clean each slot
-            slots = [slot.strip() for slot in hora_str.split(',')]
-            for slot in slots:
-                formatted_slot = format_time_slot(slot)
-                if formatted_slot:
-                    all_booked_slots.append(formatted_slot)
-        else:
-            # Single slot
-            formatted_slot = format_time_slot(hora_str)
-            if formatted_slot:
-                all_booked_slots.append(formatted_slot)
-    
-    return all_booked_slots
+def get_day_schedule(warehouse, reservas, selected_date):
+    """Per-dock occupancy of a date at a warehouse, built from the reservation index"""
+    return DaySchedule.from_table(warehouse.capacity, reservas, selected_date)
 
-def format_time_slot(time_str):
-    """Format time string to HH:MM format, handling various input formats"""
-    try:
-        time_str = str(time_str).strip()
-        
-        # Handle different time formats that might come from Excel
-        if ':' in time_str:
-            parts = time_str.split(':')
-            if len(parts) >= 2:
-                hour = int(parts[0])
-                minute = int(parts[1])
-                return f"{hour:02d}:{minute:02d}"
-        
-        # Handle time objects or datetime objects
-        if hasattr(time_str, 'hour') and hasattr(time_str, 'minute'):
-            return f"{time_str.hour:02d}:{time_str.minute:02d}"
-        
-        return None
-        
-    except (ValueError, AttributeError, TypeError):
-        return None
+DIAS_PLURAL = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábados', 'domingos']
 
-def generate_all_30min_slots():
-    """Generate all possible 30-minute slots"""
-    weekday_slots = []
-    saturday_slots = []
-    
-    # Weekday slots (9:00-16:00)
-    for hour in range(9, 16):
-        for minute in [0, 30]:
-            start_time = f"{hour:02d}:{minute:02d}"
-            weekday_slots.append(start_time)
-    
-    # Saturday slots (9:00-12:00)
-    for hour in range(9, 12):
-        for minute in [0, 30]:
-            start_time = f"{hour:02d}:{minute:02d}"
-            saturday_slots.append(start_time)
-    
-    return weekday_slots, saturday_slots
-
-def get_next_slot(slot_time):
-    """Get the next 30-minute slot"""
-    hour, minute = map(int, slot_time.split(':'))
-    if minute == 0:
-        next_slot = f"{hour:02d}:30"
-    else:
-        next_hour = hour + 1
-        next_slot = f"{next_hour:02d}:00"
-    return next_slot
+def format_duration(slots):
+    """Human readable duration of ``slots`` 30-minute slots"""
+    hours, minutes = divmod(slots * 30, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hora" + ("s" if hours > 1 else ""))
+    if minutes:
+        parts.append(f"{minutes} minutos")
+    return " ".join(parts)
 
-def find_contiguous_hour_slots(all_slots, booked_slots):
-    """Find available contiguous 1-hour slots from available 30-minute slots"""
-    available_hour_slots = []
-    
-    for i in range(len(all_slots) - 1):
-        current_slot = all_slots[i]
-        next_slot = get_next_slot(current_slot)
-        
-        # Check if this is indeed the next slot in our list
-        if i + 1 < len(all_slots) and all_slots[i + 1] == next_slot:
-            # Both slots are available
-            if current_slot not in booked_slots and next_slot not in booked_slots:
-                available_hour_slots.append(current_slot)
-    
-    return available_hour_slots
+def format_duration_short(slots):
+    """Compact duration for slot buttons: 30m, 1h, 1h30"""
+    hours, minutes = divmod(slots * 30, 60)
+    if not hours:
+        return f"{minutes}m"
+    return f"{hours}h{minutes:02d}" if minutes else f"{hours}h"
 
-def get_available_slots(selected_date, reservas_df, numero_bultos):
-    """Get available slots for a date based on bultos count"""
-    weekday_slots, saturday_slots = generate_all_30min_slots()
-    
-    # Sunday = 6, no work
-    if selected_date.weekday() == 6:
-        return []
-    
-    # Saturday = 5
-    if selected_date.weekday() == 5:
-        all_30min_slots = saturday_slots
-    else:
-        all_30min_slots = weekday_slots
-    
-    # Get booked slots for this date - IMPROVED DATE MATCHING
-    target_date = selected_date.strftime('%Y-%m-%d')
-    
-    # Filter reservations for the selected date (handle different date formats)
-    date_mask = reservas_df['Fecha'].astype(str).str.contains(target_date, na=False)
-    booked_hours = reservas_df[date_mask]['Hora'].tolist()
-    
-    # Parse booked slots (handles combined slots)
-    booked_slots = parse_booked_slots(booked_hours)
-    
-    if numero_bultos >= 5:
-        # For 5+ bultos, find contiguous 1-hour slots
-        return find_contiguous_hour_slots(all_30min_slots, booked_slots)
-    else:
-        # For 1-4 bultos, return available 30-minute slots
-        return [slot for slot in all_30min_slots if slot not in booked_slots]
+@st.cache_resource(show_spinner=False, max_entries=2 * len(WAREHOUSES), ttl=3600)
+def get_sizing_table(key, version, _gestion_df):
+    """Slot lookup table learned from gestion history, built once per warehouse and workbook version"""
+    return SizingTable.build(_gestion_df, WAREHOUSES[key].capacity.slots_for_bultos, version)
+
+def get_available_slots(warehouse, selected_date, reservas, slots):
+    """Start times (HH:MM) where a booking of ``slots`` 30-minute slots fits on some dock"""
+    schedule = get_day_schedule(warehouse, reservas, selected_date)
+    return [format_minute(start) for start, is_available in schedule.availability(slots) if is_available]
 
 # ─────────────────────────────────────────────────────────────
-# 5. Authentication Function - UPDATED TO USE ALL SHEETS
+# 6. Authentication Function - UPDATED TO USE ALL SHEETS
 # ─────────────────────────────────────────────────────────────
-def authenticate_user(usuario, password):
-    """Authenticate user against Excel data and get email + CC emails"""
-    credentials_df, _, _ = download_excel_to_memory()  # UPDATED - Now returns 3 values
+def authenticate_user(warehouse, usuario, password):
+    """Authenticate user against the warehouse's Excel data and get email + CC emails"""
+    credentials_df, _, _ = download_excel_to_memory(warehouse)  # UPDATED - Now returns 3 values
     
     if credentials_df is None:
         return False, "Error al cargar credenciales", None, None
@@ -548,58 +809,343 @@ def authenticate_user(usuario, password):
     return False, "Contraseña incorrecta", None, None
 
 # ─────────────────────────────────────────────────────────────
-# 6. Fresh slot validation function - UPDATED FOR COMBINED SLOT PARSING
+# 7. Fresh slot validation function - UPDATED FOR COMBINED SLOT PARSING
 # ─────────────────────────────────────────────────────────────
-def check_slot_availability(selected_date, slot_time, numero_bultos):
-    """Check if a specific slot is still available with fresh data - handles combined slots"""
+def check_slot_availability(warehouse, selected_date, slot_time, slots):
+    """Check if some dock is still free for the booking.
+
+    The shared snapshot is replaced on every commit of this process, so no
+    download is needed here; the save path re-checks against SharePoint
+    under the commit lock before writing.
+    """
     try:
-        # Force fresh download
-        download_excel_to_memory.clear()
-        _, fresh_reservas_df, _ = download_excel_to_memory()
+        _, fresh_reservas, _ = download_excel_to_memory(warehouse)
         
-        if fresh_reservas_df is None:
+        if fresh_reservas is None:
             return False, "Error al verificar disponibilidad"
         
-        # Get booked slots for this date - IMPROVED DATE MATCHING
-        target_date = selected_date.strftime('%Y-%m-%d')
-        date_mask = fresh_reservas_df['Fecha'].astype(str).str.contains(target_date, na=False)
-        booked_hours = fresh_reservas_df[date_mask]['Hora'].tolist()
-        
-        # Parse booked slots (handles combined slots)
-        booked_slots = parse_booked_slots(booked_hours)
-        
-        if numero_bultos >= 5:
-            # For 5+ bultos, check both current and next slot
-            next_slot = get_next_slot(slot_time)
-            if slot_time in booked_slots:
-                return False, "Otro proveedor acaba de reservar este horario. Por favor, elija otro."
-            if next_slot in booked_slots:
-                return False, "El horario siguiente necesario para su reserva de 1 hora ya está ocupado. Por favor, elija otro."
-        else:
-            # For 1-4 bultos, check only current slot
-            if slot_time in booked_slots:
-                return False, "Otro proveedor acaba de reservar este horario. Por favor, elija otro."
+        schedule = get_day_schedule(warehouse, fresh_reservas, selected_date)
+        start = parse_minute(slot_time)
+        
+        if schedule.free_dock(start, slots) is None:
+            if slots > 1 and schedule.free_dock(start, 1) is not None:
+                return False, f"El horario siguiente necesario para su reserva de {format_duration(slots)} ya está ocupado. Por favor, elija otro."
+            return False, "Otro proveedor acaba de reservar este horario. Por favor, elija otro."
         
         return True, "Horario disponible"
         
     except Exception as e:
         return False, f"Error verificando disponibilidad: {str(e)}"
+
+@st.experimental_fragment(run_every=3)
+def watch_changes(topics, seen):
+    """Rerun the page as soon as any of the change feed ``topics`` it displays changes.
+
+    Re-executes on its own every few seconds; the check is an in-memory
+    lookup on the change feed, not a download.
+    """
+    feed = get_change_feed()
+    if any(feed.changed_since(topic, seen) for topic in topics):
+        st.rerun()
         
         
 # ─────────────────────────────────────────────────────────────
-# 7. Main App - UPDATED WORKFLOW: BULTOS FIRST, THEN DATE/TIME
+# 8. Admin: KPI Dashboard
 # ─────────────────────────────────────────────────────────────
-def main():
-    st.title("🚚 Dismac: Reserva de Entrega de Mercadería")
+KPI_LABELS = {
+    'espera': "Tiempo de espera",
+    'atencion': "Tiempo de atención",
+    'retraso': "Retraso vs. hora reservada",
+}
+
+@st.cache_resource(show_spinner=False)
+def get_kpi_engine(key):
+    """Process-wide KPI aggregates of one warehouse, updated incrementally per workbook version"""
+    return KpiEngine()
+
+def render_kpi_dashboard(warehouse, gestion_df, version):
+    """Wait, service and delay indicators per supplier, week and slot"""
+    st.subheader("📊 Indicadores de atención")
     
-    # Download Excel when app starts - ONLY INITIAL LOAD
-    with st.spinner("Cargando datos..."):
-        credentials_df, reservas_df, gestion_df = download_excel_to_memory()
+    engine = get_kpi_engine(warehouse.key)
+    with st.spinner("Actualizando indicadores..."):
+        engine.update(gestion_df, version)
     
-    if credentials_df is None:
-        st.error("❌ Error al cargar archivo")
+    metric = st.selectbox("Indicador (minutos)", list(KPI_LABELS), format_func=KPI_LABELS.get)
+    
+    tabs = st.tabs(["Por proveedor", "Por semana", "Por horario"])
+    for tab, dimension in zip(tabs, DIMENSIONS):
+        with tab:
+            summary = engine.summary(dimension, metric)
+            if dimension == 'horario':
+                summary['horario'] = summary['horario'].map(lambda m: format_minute(m) if m >= 0 else "-")
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+    
+    # Distribution over all suppliers, without the empty tails
+    histogram = engine.histogram(metric)
+    filled = histogram.to_numpy().nonzero()[0]
+    if len(filled):
+        st.caption(f"Distribución: {KPI_LABELS[metric].lower()} (percentiles con resolución de 5 minutos)")
+        st.bar_chart(histogram.iloc[filled[0]:filled[-1] + 1])
+    
+    with st.expander("🔌 Uso de SharePoint (desde el inicio del servidor)"):
+        metrics = get_admission().metrics()
+        if metrics:
+            st.dataframe(metrics, use_container_width=True, hide_index=True)
+        else:
+            st.caption("Sin operaciones registradas")
+
+# ─────────────────────────────────────────────────────────────
+# 9. Staff: Reception Console
+# ─────────────────────────────────────────────────────────────
+CHECKIN_BUTTONS = [
+    ('llegada', "🚚 Llegó"),
+    ('inicio', "▶️ Inicio"),
+    ('fin', "✅ Fin"),
+]
+
+@st.cache_resource(show_spinner=False, max_entries=2 * len(WAREHOUSES), ttl=3600)
+def get_gestion_index(key, version, _gestion_df):
+    """gestion rows by (supplier, orders, reserved time), built once per warehouse and workbook version"""
+    return {gestion_key(row): row for row in _gestion_df.to_dict('records')}
+
+def render_checkin_console(warehouse, reservas, gestion_df):
+    """Today's bookings with arrival / start / finish buttons"""
+    st.subheader("🏭 Recepción de hoy")
+    
+    writer = get_gestion_writer(warehouse.key)
+    today = datetime.now().date()
+    writer.forget_before(today)
+    index = get_gestion_index(warehouse.key, reservas.version, gestion_df)
+    
+    rows = sorted(reservas.rows_for_date(today), key=lambda r: reservas.inicio[r])
+    if not rows:
+        st.info("No hay reservas para hoy")
+        return
+    
+    for row in rows:
+        record = reservas.record(row)
+        base = booking_row(record)
+        key = gestion_key(base)
+        # Clicks not yet written to the workbook are shown right away
+        current = {**index.get(key, {}), **writer.view(key)}
+        
+        col_info, *col_buttons = st.columns([4, 1, 1, 1])
+        with col_info:
+            dock = f" · Andén {record['Anden'] + 1}" if record['Anden'] >= 0 and warehouse.capacity.docks > 1 else ""
+            st.markdown(
+                f"**{format_time_range(record['Inicio_min'], record['Slots'])}** · {record['Proveedor']}{dock}  \n"
+                f"📦 {record['Numero_de_bultos']} bultos · 📋 {', '.join(record['Orden_de_compra'])}"
+            )
+        for (event, label), col in zip(CHECKIN_BUTTONS, col_buttons):
+            with col:
+                done = is_stamped(current, event)
+                # Start needs an arrival, finish needs a start
+                blocked = (event == 'inicio' and not is_stamped(current, 'llegada')) or \
+                          (event == 'fin' and not is_stamped(current, 'inicio'))
+                text = f"{label} {current[EVENTS[event]]:%H:%M}" if done and hasattr(current[EVENTS[event]], 'strftime') else label
+                if st.button(text, key=f"{event}_{record['Reserva_id']}", disabled=done or blocked, use_container_width=True):
+                    fields = stamp({**base, **current}, event, datetime.now().replace(microsecond=0))
+                    writer.submit(key, {**base, **fields})
+                    st.rerun()
+    
+    st.markdown("---")
+    if writer.pending:
+        st.caption(f"⏳ {writer.pending} registro(s) pendientes de guardar")
+    elif writer.last_flush:
+        st.caption(f"💾 Guardado {writer.last_flush:%H:%M:%S}")
+    if writer.last_error:
+        st.warning(f"⚠️ Error guardando registros, se reintentará: {writer.last_error}")
+
+# ─────────────────────────────────────────────────────────────
+# 10. Supplier: Booking History
+# ─────────────────────────────────────────────────────────────
+BOOKINGS_PAGE_SIZE = 20
+
+def render_my_bookings(warehouse, reservas, supplier_name):
+    """Paginated list of one supplier's reservations, newest first.
+
+    Served from the table's per-supplier index: only the rows of the page
+    shown are materialized, whatever the size of the history.
+    """
+    st.subheader("📅 Mis reservas")
+    
+    today = datetime.now().date()
+    rango = st.date_input(
+        "Período",
+        value=(today - timedelta(days=30), today + timedelta(days=60)),
+        format="DD/MM/YYYY",
+    )
+    # While the user is still picking, the range has a single date
+    desde, hasta = (rango[0], rango[-1]) if isinstance(rango, (tuple, list)) and rango else (None, None)
+    
+    rows = reservas.supplier_rows(supplier_name, desde, hasta)[::-1]
+    total = len(rows)
+    if not total:
+        st.info("No tiene reservas en este período")
+        return
+    
+    pages = -(-total // BOOKINGS_PAGE_SIZE)
+    page = st.number_input(f"Página (de {pages})", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+    start = (page - 1) * BOOKINGS_PAGE_SIZE
+    
+    records = [reservas.record(row) for row in rows[start:start + BOOKINGS_PAGE_SIZE].tolist()]
+    table = [
+        {
+            'Fecha': r['Fecha'].strftime('%d/%m/%Y'),
+            'Horario': format_time_range(r['Inicio_min'], r['Slots']),
+            'Bultos': r['Numero_de_bultos'],
+            'Órdenes de compra': ', '.join(r['Orden_de_compra']),
+            **({'Andén': r['Anden'] + 1 if r['Anden'] >= 0 else ''} if warehouse.capacity.docks > 1 else {}),
+            'Estado': "Próxima" if r['Fecha'] >= today else "Realizada",
+        }
+        for r in records
+    ]
+    st.dataframe(table, hide_index=True, use_container_width=True)
+    st.caption(f"{start + 1}–{start + len(records)} de {total} reservas")
+
+# ─────────────────────────────────────────────────────────────
+# 11. Admin: Integrity Check
+# ─────────────────────────────────────────────────────────────
+@st.cache_resource(show_spinner=False)
+def get_integrity_monitor(key):
+    """Background scan of one warehouse's reservations for double bookings and bad rows"""
+    store = get_workbook_store(key)
+    return IntegrityMonitor(lambda: store.get()[1], WAREHOUSES[key].capacity).start()
+
+def render_integrity_report(warehouse):
+    """Latest background scan, with a button to re-run it"""
+    st.subheader("🩺 Integridad de reservas")
+    
+    monitor = get_integrity_monitor(warehouse.key)
+    if st.button("🔄 Volver a revisar"):
+        monitor.run_now()
+        st.toast("Revisión en curso, actualice en unos segundos")
+    if monitor.last_error:
+        st.warning(f"⚠️ La última revisión falló: {monitor.last_error}")
+    
+    report = monitor.report
+    if report is None:
+        st.info("La primera revisión todavía está en curso")
+        return
+    
+    st.caption(f"{report.scanned} reservas revisadas en {report.elapsed:.2f} s · {report.finished:%d/%m/%Y %H:%M}")
+    counts = report.counts
+    for col, kind in zip(st.columns(len(ISSUES)), ISSUES):
+        col.metric(ISSUES[kind], counts[kind])
+    if report.ok:
+        st.success("✅ Sin problemas")
+    else:
+        st.dataframe(report.to_frame(), use_container_width=True, hide_index=True)
+
+# ─────────────────────────────────────────────────────────────
+# 12. Admin: Rerun Profiling
+# ─────────────────────────────────────────────────────────────
+MAX_PROFILED_RUNS = 20
+
+def render_profiler_controls():
+    """Sidebar switch that profiles the next reruns of this session"""
+    with st.sidebar.expander("⏱️ Perfilado"):
+        pending = st.session_state.get('profile_runs', 0)
+        if pending:
+            st.caption(f"Se perfilarán las próximas {pending} ejecuciones")
+            if st.button("Detener"):
+                st.session_state.profile_runs = 0
+        else:
+            runs = st.number_input("Ejecuciones a perfilar", min_value=1, max_value=MAX_PROFILED_RUNS, value=1, step=1)
+            if st.button("Perfilar"):
+                # Takes effect from the next rerun: the one the admin triggers next
+                st.session_state.profile_runs = runs
+
+def render_profiles():
+    """Saved rerun profiles: summary, top functions side by side and flame graph files"""
+    st.subheader("⏱️ Perfiles de ejecución")
+    
+    profiles = load_profiles(PROFILES_DIR)
+    if not profiles:
+        st.info("No hay perfiles guardados. Active el perfilado en la barra lateral.")
+        return
+    
+    st.dataframe(
+        [{'Inicio': p['inicio'], 'Interacción': p['interaccion'], 'Usuario': p['usuario'],
+          'Duración (s)': p['duracion_s'], 'Muestras': p['muestras']} for p in profiles],
+        use_container_width=True, hide_index=True,
+    )
+    
+    by_name = {p['archivo']: p for p in profiles}
+    chosen = st.multiselect(
+        "Comparar", list(by_name), default=list(by_name)[:1], max_selections=2,
+        format_func=lambda name: f"{by_name[name]['inicio']} · {by_name[name]['interaccion']}",
+    )
+    for col, name in zip(st.columns(max(len(chosen), 1)), chosen):
+        profile = by_name[name]
+        with col:
+            st.caption(f"{profile['interaccion']} · {profile['duracion_s']} s · {profile['muestras']} muestras")
+            st.dataframe(profile['top'], use_container_width=True, hide_index=True)
+            folded = os.path.join(PROFILES_DIR, name + '.folded')
+            if os.path.exists(folded):
+                with open(folded, 'rb') as f:
+                    st.download_button("🔥 Flame graph (.folded)", f.read(), file_name=name + '.folded', key=f"folded_{name}")
+    st.caption("Los archivos .folded se abren en speedscope.app o con flamegraph.pl")
+
+def run():
+    """main(), under the sampling profiler while the session has profiled reruns left"""
+    runs = st.session_state.get('profile_runs', 0)
+    if not runs:
+        main()
         return
     
+    st.session_state.profile_runs = runs - 1
+    # A rerun that logs out still belongs to the user who started it
+    usuario = st.session_state.get('supplier_name')
+    profile = Profile().start()
+    try:
+        main()
+    finally:
+        # Also reached through st.rerun() / st.stop(), which end most interactions
+        profile.stop()
+        try:
+            profile.save(PROFILES_DIR, st.session_state.get('supplier_name') or usuario)
+        except OSError as e:
+            logger.warning("Could not save profile: %s", e)
+
+# ─────────────────────────────────────────────────────────────
+# 13. Background Warm-up
+# ─────────────────────────────────────────────────────────────
+@st.cache_resource(show_spinner=False)
+def start_background_warmup():
+    """Prefetch every warehouse's workbook and the PDF once per server process.
+
+    The workbooks load in parallel, each on its own pooled (and thereby
+    pre-authenticated) context, so warm-up takes about as long as the
+    slowest warehouse.
+    """
+    def _warmup():
+        loaded = load_all(WAREHOUSES.values(), lambda warehouse: get_workbook_store(warehouse.key).get())
+        for key, result in loaded.items():
+            if isinstance(result, Exception):
+                logger.warning("Warm-up of %s failed: %s", key, result)
+        try:
+            _fetch_pdf_attachment()
+        except Exception as e:
+            logger.warning("Warm-up failed: %s", e)
+
+    thread = threading.Thread(target=_warmup, name="almacen-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# Only under a running server: plain imports (tools, tests) stay offline
+if runtime.exists():
+    start_background_warmup()
+    for key in WAREHOUSES:
+        get_integrity_monitor(key)
+
+# ─────────────────────────────────────────────────────────────
+# 14. Main App - UPDATED WORKFLOW: BULTOS FIRST, THEN DATE/TIME
+# ─────────────────────────────────────────────────────────────
+def main():
+    st.title("🚚 Dismac: Reserva de Entrega de Mercadería")
+    
     # Session state
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
@@ -609,6 +1155,8 @@ def main():
         st.session_state.supplier_email = None
     if 'supplier_cc_emails' not in st.session_state:
         st.session_state.supplier_cc_emails = []
+    if 'almacen' not in st.session_state:
+        st.session_state.almacen = None
     if 'slot_error_message' not in st.session_state:
         st.session_state.slot_error_message = None
     if 'orden_compra_list' not in st.session_state:
@@ -619,16 +1167,23 @@ def main():
         st.subheader("🔐 Iniciar Sesión")
         
         with st.form("login_form"):
+            # Each warehouse has its own workbook, with its own credentials
+            if len(WAREHOUSES) > 1:
+                almacen = st.selectbox("Almacén", list(WAREHOUSES), format_func=lambda key: WAREHOUSES[key].nombre)
+            else:
+                almacen = next(iter(WAREHOUSES))
             usuario = st.text_input("Usuario")
             password = st.text_input("Contraseña", type="password")
             submitted = st.form_submit_button("Iniciar Sesión")
             
             if submitted:
+                mark("login")
                 if usuario and password:
-                    is_valid, message, email, cc_emails = authenticate_user(usuario, password)
+                    is_valid, message, email, cc_emails = authenticate_user(WAREHOUSES[almacen], usuario, password)
                     
                     if is_valid:
                         st.session_state.authenticated = True
+                        st.session_state.almacen = almacen
                         st.session_state.supplier_name = usuario
                         st.session_state.supplier_email = email
                         st.session_state.supplier_cc_emails = cc_emails
@@ -647,12 +1202,35 @@ def main():
     
     # Main interface after authentication
     else:
+        # A warehouse removed from the configuration signs its sessions out
+        warehouse = WAREHOUSES.get(st.session_state.almacen)
+        if warehouse is None:
+            st.session_state.authenticated = False
+            st.session_state.profile_runs = 0
+            st.rerun()
+        
+        # The login form renders without the workbook; the warm-up thread
+        # has usually fetched it by the time the supplier signs in
+        # Taken before reading: a commit racing with the read triggers a refresh
+        seen = get_change_feed().current()
+        with st.spinner("Cargando datos..."):
+            credentials_df, reservas, gestion_df = download_excel_to_memory(warehouse)
+        
+        if credentials_df is None:
+            st.error("❌ Error al cargar archivo")
+            return
+        
         col1, col2 = st.columns([3, 1])
         with col1:
             st.subheader(f"Bienvenido, {st.session_state.supplier_name}")
+            if len(WAREHOUSES) > 1:
+                st.caption(f"🏭 {warehouse.nombre}")
         with col2:
             if st.button("Cerrar Sesión"):
                 st.session_state.authenticated = False
+                # Profiling belongs to the admin who asked for it, not to the next login
+                st.session_state.profile_runs = 0
+                st.session_state.almacen = None
                 st.session_state.supplier_name = None
                 st.session_state.supplier_email = None
                 st.session_state.supplier_cc_emails = []
@@ -666,11 +1244,42 @@ def main():
         
         st.markdown("---")
         
+        # Supplier / staff / admin views
+        vistas = ["Reservar entrega", "Mis reservas"]
+        if st.session_state.supplier_name in STAFF_USERS:
+            vistas.append("Recepción")
+        if st.session_state.supplier_name in ADMIN_USERS:
+            vistas.append("Indicadores")
+            vistas.append("Integridad")
+            vistas.append("Perfiles")
+        vista = st.sidebar.radio("Vista", vistas)
+        if st.session_state.supplier_name in ADMIN_USERS:
+            render_profiler_controls()
+        if vista != "Reservar entrega":
+            mark(vista)
+        if vista == "Mis reservas":
+            render_my_bookings(warehouse, reservas, st.session_state.supplier_name)
+            return
+        if vista == "Recepción":
+            # Today's bookings, and stamps written from other reception devices
+            watch_changes([(warehouse.key, datetime.now().date().toordinal()), (warehouse.key, GESTION_SHEET)], seen)
+            render_checkin_console(warehouse, reservas, gestion_df)
+            return
+        if vista == "Indicadores":
+            render_kpi_dashboard(warehouse, gestion_df, reservas.version)
+            return
+        if vista == "Integridad":
+            render_integrity_report(warehouse)
+            return
+        if vista == "Perfiles":
+            render_profiles()
+            return
+        
         # STEP 1: Delivery Information (MOVED TO FIRST)
         st.subheader("📦 Información de Entrega")
         st.markdown('<p style="color: red; font-size: 14px; margin-top: -10px;">Esta aplicación permite programar entregas <strong>exclusivamente de pedidos Marketplace</strong>.<br>Las compras locales o corporativas deben coordinarse directamente con el almacén.</p>', unsafe_allow_html=True)        
         # Show permanent information about time slot durations
-        st.info("ℹ️ **La duración del horario de reserva dependerá de la cantidad de bultos:** 1-4 bultos = 30 minutos y 5+ bultos = 1 hora")
+        st.info("ℹ️ **La duración del horario de reserva (30, 60 o 90 minutos) se calcula según la cantidad de bultos y el tiempo de descarga de sus entregas anteriores.**")
         
         # Number of bultos (MANDATORY, NO DEFAULT)
         numero_bultos = st.number_input(
@@ -736,6 +1345,11 @@ def main():
             st.warning("⚠️ Complete el número de bultos y al menos una orden de compra para continuar.")
             return
         
+        # Booking length in 30-minute slots, from bultos and the supplier's history
+        sizing = get_sizing_table(warehouse.key, reservas.version, gestion_df)
+        slots_needed = sizing.slots_for(st.session_state.supplier_name, numero_bultos)
+        st.info(f"🕐 Duración de su reserva: {format_duration(slots_needed)}")
+        
         st.markdown("---")
         
         # STEP 2: Date selection (ONLY SHOWN AFTER BULTOS/ORDERS)
@@ -751,9 +1365,12 @@ def main():
             value=today
         )
         
-        # Check if Sunday
-        if selected_date.weekday() == 6:
-            st.warning("⚠️ No trabajamos los domingos")
+        # Closed weekday (Sundays unless configured) / holiday, from the warehouse grid
+        if not warehouse.capacity.is_open(selected_date):
+            if selected_date.weekday() not in warehouse.capacity.hours:
+                st.warning(f"⚠️ No trabajamos los {DIAS_PLURAL[selected_date.weekday()]}")
+            else:
+                st.warning("⚠️ El almacén no atiende en esta fecha")
             return
         
         # STEP 3: Time slot selection (CONDITIONED ON BULTOS)
@@ -763,35 +1380,13 @@ def main():
         if st.session_state.slot_error_message:
             st.error(f"❌ {st.session_state.slot_error_message}")
         
-        # Get ALL possible slots and determine availability
-        weekday_slots, saturday_slots = generate_all_30min_slots()
-        
-        if selected_date.weekday() == 5:  # Saturday
-            all_30min_slots = saturday_slots
-        else:  # Monday-Friday
-            all_30min_slots = weekday_slots
-        
-        # Get booked slots for this date
-        target_date = selected_date.strftime('%Y-%m-%d')
-        date_mask = reservas_df['Fecha'].astype(str).str.contains(target_date, na=False)
-        booked_hours = reservas_df[date_mask]['Hora'].tolist()
-        booked_slots = parse_booked_slots(booked_hours)
-        
-        # Generate display slots based on bultos
-        if numero_bultos >= 5:
-            # For 5+ bultos, show all possible 1-hour slots with availability
-            display_slots = []
-            for i in range(len(all_30min_slots) - 1):
-                current_slot = all_30min_slots[i]
-                next_slot = get_next_slot(current_slot)
-                
-                # Check if this is indeed the next slot in our list
-                if i + 1 < len(all_30min_slots) and all_30min_slots[i + 1] == next_slot:
-                    is_available = current_slot not in booked_slots and next_slot not in booked_slots
-                    display_slots.append((current_slot, is_available))
-        else:
-            # For 1-4 bultos, show all 30-minute slots with availability
-            display_slots = [(slot, slot not in booked_slots) for slot in all_30min_slots]
+        # Get ALL possible start times and whether some dock is free for the whole booking
+        schedule = get_day_schedule(warehouse, reservas, selected_date)
+        watch_changes([(warehouse.key, selected_date.toordinal())], seen)
+        display_slots = [
+            (format_minute(start), is_available)
+            for start, is_available in schedule.availability(slots_needed)
+        ]
         
         
         if not display_slots:
@@ -808,8 +1403,8 @@ def main():
             slot1, is_available1 = display_slots[i]
             
             # Button text based on bultos and availability
-            if numero_bultos >= 5:
-                button_text1 = f"✅ {slot1} (1h)" if is_available1 else f"🚫 {slot1} (Ocupado)"
+            if slots_needed > 1:
+                button_text1 = f"✅ {slot1} ({format_duration_short(slots_needed)})" if is_available1 else f"🚫 {slot1} (Ocupado)"
             else:
                 button_text1 = f"✅ {slot1}" if is_available1 else f"🚫 {slot1} (Ocupado)"
             
@@ -819,8 +1414,9 @@ def main():
                 else:
                     if st.button(button_text1, key=f"slot_{i}", use_container_width=True):
                         # FRESH CHECK ON CLICK
+                        mark("horario")
                         with st.spinner("Verificando disponibilidad..."):
-                            is_available, message = check_slot_availability(selected_date, slot1, numero_bultos)
+                            is_available, message = check_slot_availability(warehouse, selected_date, slot1, slots_needed)
                         
                         if is_available:
                             selected_slot = slot1
@@ -834,8 +1430,8 @@ def main():
                 slot2, is_available2 = display_slots[i + 1]
                 
                 # Button text based on bultos and availability
-                if numero_bultos >= 5:
-                    button_text2 = f"✅ {slot2} (1h)" if is_available2 else f"🚫 {slot2} (Ocupado)"
+                if slots_needed > 1:
+                    button_text2 = f"✅ {slot2} ({format_duration_short(slots_needed)})" if is_available2 else f"🚫 {slot2} (Ocupado)"
                 else:
                     button_text2 = f"✅ {slot2}" if is_available2 else f"🚫 {slot2} (Ocupado)"
                 
@@ -845,8 +1441,9 @@ def main():
                     else:
                         if st.button(button_text2, key=f"slot_{i+1}", use_container_width=True):
                             # FRESH CHECK ON CLICK
+                            mark("horario")
                             with st.spinner("Verificando disponibilidad..."):
-                                is_available, message = check_slot_availability(selected_date, slot2, numero_bultos)
+                                is_available, message = check_slot_availability(warehouse, selected_date, slot2, slots_needed)
                             
                             if is_available:
                                 selected_slot = slot2
@@ -864,7 +1461,7 @@ def main():
             st.subheader("✅ Confirmar Reserva")
             
             # Show summary
-            duration_text = " (1 hora)" if numero_bultos >= 5 else ""
+            duration_text = f" ({format_duration(slots_needed)})" if slots_needed > 1 else ""
             st.info(f"📅 Fecha: {selected_date}")
             st.info(f"🕐 Horario: {st.session_state.selected_slot}{duration_text}")
             st.info(f"📦 Número de bultos: {numero_bultos}")
@@ -872,8 +1469,9 @@ def main():
             
             # Confirm button
             if st.button("✅ Confirmar Reserva", use_container_width=True):
+                mark("confirmar")
                 with st.spinner("Verificando disponibilidad final..."):
-                    is_still_available, availability_message = check_slot_availability(selected_date, st.session_state.selected_slot, numero_bultos)
+                    is_still_available, availability_message = check_slot_availability(warehouse, selected_date, st.session_state.selected_slot, slots_needed)
                 
                 if not is_still_available:
                     st.error(f"❌ {availability_message}")
@@ -883,28 +1481,18 @@ def main():
                     st.rerun()
                     return
                 
-                # Join multiple orders with comma
-                orden_compra_combined = ', '.join(valid_orders)
-                
-                # Create booking - SINGLE ROW WITH COMBINED SLOTS FOR 5+ BULTOS
-                if numero_bultos >= 5:
-                    # For 1-hour reservation, combine both slots in hora field
-                    next_slot = get_next_slot(st.session_state.selected_slot)
-                    combined_hora = f"{st.session_state.selected_slot}:00, {next_slot}:00"
-                else:
-                    # For 30-minute reservation, single slot
-                    combined_hora = f"{st.session_state.selected_slot}:00"
-                
+                # Create booking - SINGLE ROW, LENGTH FROM SIZING TABLE; the dock is assigned on save
                 booking_to_save = {
-                    'Fecha': selected_date.strftime('%Y-%m-%d') + ' 00:00:00',
-                    'Hora': combined_hora,
+                    'Fecha': selected_date,
+                    'Inicio_min': parse_minute(st.session_state.selected_slot),
+                    'Slots': slots_needed,
                     'Proveedor': st.session_state.supplier_name,
                     'Numero_de_bultos': numero_bultos,
-                    'Orden_de_compra': orden_compra_combined
+                    'Orden_de_compra': valid_orders
                 }
                 
                 with st.spinner("Guardando reserva..."):
-                    success = save_booking_to_excel(booking_to_save)
+                    success = save_booking_to_excel(warehouse, booking_to_save)
                 
                 if success:
                     st.success("✅ Reserva confirmada!")
@@ -913,6 +1501,7 @@ def main():
                     if st.session_state.supplier_email:
                         with st.spinner("Enviando confirmación por email..."):
                             email_sent, actual_cc_emails = send_booking_email(
+                                warehouse,
                                 st.session_state.supplier_email,
                                 st.session_state.supplier_name,
                                 booking_to_save,
@@ -935,6 +1524,8 @@ def main():
                         del st.session_state.numero_bultos_input
                     st.info("Cerrando sesión automáticamente...")
                     st.session_state.authenticated = False
+                    st.session_state.profile_runs = 0
+                    st.session_state.almacen = None
                     st.session_state.supplier_name = None
                     st.session_state.supplier_email = None
                     st.session_state.supplier_cc_emails = []
@@ -949,4 +1540,4 @@ def main():
                     st.error("❌ Error al guardar reserva")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""Dock capacity: opening hours, holidays and per-slot dock allocation.
+
+A warehouse has ``docks`` receiving docks working on a grid of 30-minute
+slots. ``CapacityConfig`` describes the grid (hours per weekday, holidays,
+booking length by bultos) and ``DaySchedule`` tracks which docks are busy in
+each slot of one day.
+
+Occupancy is kept as one bitset of free docks per slot, so finding a dock
+that is free for a whole booking is an AND over the booking's slots followed
+by a lowest-set-bit lookup; the cost does not grow with the number of
+bookings or (up to machine-word sized dock counts) with the number of docks.
+"""
+from datetime import datetime
+
+SLOT_MINUTES = 30
+
+DIAS = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+
+# Current Dismac grid: weekdays 9:00-16:00, Saturdays 9:00-12:00, closed Sundays
+DEFAULT_HOURS = {0: (540, 960), 1: (540, 960), 2: (540, 960), 3: (540, 960), 4: (540, 960), 5: (540, 720)}
+
+# (minimum bultos, minutes): 5+ bultos book one hour, anything else 30 minutes
+DEFAULT_DURATIONS = ((5, 60),)
+
+
+def _parse_hhmm(text):
+    hour, minute = str(text).strip().split(':')[:2]
+    return int(hour) * 60 + int(minute)
+
+
+def day_index(name):
+    """Weekday number of a Spanish day name; accents and a plural are accepted
+    (``"miércoles"``, ``"sabado"``, ``"sábados"``)"""
+    import unicodedata
+
+    plain = ''.join(c for c in unicodedata.normalize('NFKD', str(name).strip().lower()) if not unicodedata.combining(c))
+    for candidate in (plain, plain[:-1] if plain.endswith('s') else None):
+        if candidate in DIAS:
+            return DIAS.index(candidate)
+    raise ValueError(f"capacidad.horarios: día desconocido {name!r} (use {', '.join(DIAS)})")
+
+
+class CapacityConfig:
+    """Docks, opening hours, holidays and booking durations of one warehouse"""
+
+    def __init__(self, docks=1, hours=None, holidays=(), durations=DEFAULT_DURATIONS):
+        if docks < 1:
+            raise ValueError("docks must be >= 1")
+        self.docks = docks
+        self.hours = dict(DEFAULT_HOURS if hours is None else hours)
+        self.holidays = {d if isinstance(d, int) else d.toordinal() for d in holidays}
+        self.durations = tuple(sorted(durations))
+        self.all_docks = (1 << docks) - 1
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Build from a ``[capacidad]`` secrets section.
+
+        ``andenes`` (int), ``horarios`` (``{"lunes": "09:00-16:00", ...}``; days
+        left out are closed), ``feriados`` (``["2025-05-01", ...]``) and
+        ``duracion_por_bultos`` (``[[5, 60], ...]``) are all optional. Day
+        names may carry accents (``"miércoles"``, ``"sábado"``).
+
+        Errors are ``ValueError`` naming the offending key.
+        """
+        mapping = mapping or {}
+        hours = None
+        if 'horarios' in mapping:
+            hours = {}
+            for dia, rango in mapping['horarios'].items():
+                day = day_index(dia)
+                try:
+                    opening, closing = (_parse_hhmm(t) for t in str(rango).split('-'))
+                except ValueError:
+                    raise ValueError(f"capacidad.horarios.{dia}: horario no válido {rango!r} (use \"09:00-16:00\")")
+                if not opening < closing:
+                    raise ValueError(f"capacidad.horarios.{dia}: el cierre debe ser posterior a la apertura ({rango!r})")
+                hours[day] = (opening, closing)
+        holidays = []
+        for feriado in mapping.get('feriados', []):
+            try:
+                holidays.append(datetime.strptime(str(feriado)[:10], '%Y-%m-%d').date())
+            except ValueError:
+                raise ValueError(f"capacidad.feriados: fecha no válida {feriado!r} (use \"2025-05-01\")")
+        try:
+            durations = [tuple(map(int, rule)) for rule in mapping.get('duracion_por_bultos', DEFAULT_DURATIONS)]
+            if any(len(rule) != 2 for rule in durations):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError("capacidad.duracion_por_bultos: use pares [bultos mínimos, minutos], p. ej. [[5, 60]]")
+        try:
+            docks = int(mapping.get('andenes', 1))
+        except (TypeError, ValueError):
+            docks = 0
+        if docks < 1:
+            raise ValueError(f"capacidad.andenes: debe ser un entero >= 1 ({mapping.get('andenes')!r})")
+        return cls(
+            docks=docks,
+            hours=hours,
+            holidays=holidays,
+            durations=durations,
+        )
+
+    def is_open(self, day):
+        return day.weekday() in self.hours and day.toordinal() not in self.holidays
+
+    def grid(self, day):
+        """Start minutes of every 30-minute slot offered on ``day``"""
+        if not self.is_open(day):
+            return []
+        opening, closing = self.hours[day.weekday()]
+        return list(range(opening, closing, SLOT_MINUTES))
+
+    def slots_for_bultos(self, bultos):
+        """Number of 30-minute slots a delivery of ``bultos`` needs"""
+        minutes = SLOT_MINUTES
+        for minimum, rule_minutes in self.durations:
+            if bultos >= minimum:
+                minutes = rule_minutes
+        return max(1, -(-minutes // SLOT_MINUTES))
+
+
+class DaySchedule:
+    """Free-dock bitsets for every slot of one day.
+
+    Bit ``d`` of ``free[i]`` is set when dock ``d`` is free during slot ``i``.
+    Existing bookings that cannot be placed (more overlapping bookings than
+    docks, or times outside the grid) are collected in ``conflicts``.
+    """
+
+    def __init__(self, config, day):
+        self.config = config
+        self.day = day
+        self.starts = config.grid(day)
+        self._index = {start: i for i, start in enumerate(self.starts)}
+        self.free = [config.all_docks] * len(self.starts)
+        self.conflicts = []
+
+    @classmethod
+    def from_table(cls, config, reservas, day):
+        """Schedule of ``day`` with the reservations already in ``reservas``.
+
+        Bookings that carry a dock keep it; older ones without a dock are
+        placed on the lowest free dock in start order.
+        """
+        schedule = cls(config, day)
+        rows = sorted(reservas.rows_for_date(day), key=lambda r: (reservas.anden[r] < 0, reservas.inicio[r]))
+        for row in rows:
+            dock = reservas.anden[row]
+            placed = schedule.occupy(reservas.inicio[row], reservas.slots[row], dock if dock >= 0 else None)
+            if placed is None:
+                schedule.conflicts.append(row)
+        return schedule
+
+    def _window(self, start, slots):
+        """Indexes of the slots a booking covers, or None if it leaves the grid"""
+        first = self._index.get(start)
+        if first is None or first + slots > len(self.starts):
+            return None
+        return range(first, first + slots)
+
+    def free_docks(self, start, slots):
+        """Bitset of docks free for the whole booking"""
+        window = self._window(start, slots)
+        if window is None:
+            return 0
+        mask = self.config.all_docks
+        for i in window:
+            mask &= self.free[i]
+        return mask
+
+    def free_dock(self, start, slots):
+        """Lowest dock free for the whole booking, or None"""
+        mask = self.free_docks(start, slots)
+        if not mask:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+    def occupy(self, start, slots, dock=None):
+        """Reserve ``dock`` (or the lowest free one); returns the dock or None"""
+        mask = self.free_docks(start, slots)
+        if dock is None:
+            if not mask:
+                return None
+            dock = (mask & -mask).bit_length() - 1
+        elif not (0 <= dock < self.config.docks) or not (mask >> dock) & 1:
+            return None
+        for i in self._window(start, slots):
+            self.free[i] &= ~(1 << dock)
+        return dock
+
+    def availability(self, slots):
+        """``(start, is_available)`` for every start where the booking fits in the grid"""
+        return [
+            (start, bool(self.free_docks(start, slots)))
+            for start in self.starts
+            if self._window(start, slots) is not None
+        ]
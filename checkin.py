@@ -0,0 +1,208 @@
+"""Warehouse check-in: arrival / start / finish stamps for ``proveedor_gestion``.
+
+Each click of the reception console becomes a small patch of one gestion
+row (the stamp plus the times derived from it). ``GestionWriteBehind``
+collects patches in memory and a background thread writes them in batches,
+so a click costs a dict update while the workbook round trip happens at
+most once every few seconds no matter how many stamps arrive.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# event -> gestion column stamped by it
+EVENTS = {
+    'llegada': 'Hora_llegada',
+    'inicio': 'Hora_inicio_atencion',
+    'fin': 'Hora_fin_atencion',
+}
+
+
+def _is_missing(value):
+    """None, NaN, NaT or NA (a gestion column with empty cells reads back with them)"""
+    import pandas as pd
+
+    if value is None:
+        return True
+    # pd.isna is element-wise on lists; only scalars can be missing here
+    return bool(pd.isna(value)) if pd.api.types.is_scalar(value) else False
+
+
+def _key_part(value):
+    # Checked first: NaT has a strftime that raises
+    if _is_missing(value):
+        return ''
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    text = str(value).strip()
+    return '' if text.lower() in ('nan', 'nat', 'none') else text
+
+
+def _identifier(value):
+    """Key form of a supplier or comma-joined order list.
+
+    Numeric parts lose their zero padding and float artifacts, so
+    ``'0000042'``, ``42`` and ``42.0`` (the same order, typed in or read
+    back as a number) give the same key.
+    """
+    parts = []
+    for part in _key_part(value).split(','):
+        part = part.strip()
+        if part.endswith('.0') and part[:-2].isdigit():
+            part = part[:-2]
+        if part.isdigit():
+            part = part.lstrip('0') or '0'
+        if part:
+            parts.append(part)
+    return ', '.join(parts)
+
+
+def gestion_key(row):
+    """Identity of a gestion row: supplier, purchase orders and reserved time"""
+    return (
+        _identifier(row.get('Proveedor')),
+        _identifier(row.get('Orden_de_compra')),
+        _key_part(row.get('hora_de_reserva')),
+    )
+
+
+def booking_row(record):
+    """Identifying gestion fields of a reservation record (``ReservationTable.record``)"""
+    start = record['Inicio_min']
+    reserva = datetime.combine(record['Fecha'], datetime.min.time()).replace(hour=start // 60, minute=start % 60)
+    return {
+        'Orden_de_compra': ', '.join(record['Orden_de_compra']),
+        'Proveedor': record['Proveedor'],
+        'Numero_de_bultos': record['Numero_de_bultos'],
+        'numero_de_semana': reserva.isocalendar()[1],
+        'hora_de_reserva': reserva,
+    }
+
+
+def _as_datetime(value):
+    if _is_missing(value):
+        return None
+    if isinstance(value, datetime):
+        return value
+    if hasattr(value, 'to_pydatetime'):
+        return value.to_pydatetime()
+    text = _key_part(value)
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+def is_stamped(row, event):
+    """Whether ``event`` has already been recorded on gestion ``row``"""
+    return bool(_key_part(row.get(EVENTS[event])))
+
+
+def _minutes(later, earlier):
+    if later is None or earlier is None:
+        return None
+    return round((later - earlier).total_seconds() / 60, 1)
+
+
+def stamp(row, event, when):
+    """Fields to write for ``event`` at ``when`` on gestion ``row``.
+
+    Tiempo_retraso is measured against hora_de_reserva, Tiempo_espera from
+    arrival to start, Tiempo_atencion from start to finish and Tiempo_total
+    from arrival to finish.
+    """
+    merged = dict(row)
+    merged[EVENTS[event]] = when
+    llegada = _as_datetime(merged.get('Hora_llegada'))
+    inicio = _as_datetime(merged.get('Hora_inicio_atencion'))
+    fin = _as_datetime(merged.get('Hora_fin_atencion'))
+    reserva = _as_datetime(merged.get('hora_de_reserva'))
+
+    fields = {EVENTS[event]: when}
+    if event == 'llegada':
+        fields['Tiempo_retraso'] = _minutes(llegada, reserva)
+        if inicio is not None:
+            fields['Tiempo_espera'] = _minutes(inicio, llegada)
+    elif event == 'inicio':
+        fields['Tiempo_espera'] = _minutes(inicio, llegada)
+    elif event == 'fin':
+        fields['Tiempo_atencion'] = _minutes(fin, inicio)
+        fields['Tiempo_total'] = _minutes(fin, llegada)
+    return fields
+
+
+class GestionWriteBehind:
+    """Coalescing write-behind buffer for gestion row patches.
+
+    ``flush(patches)`` receives ``{key: {column: value}}`` and must write them
+    in one go; on failure the batch is merged back and retried on the next
+    tick. ``view(key)`` returns everything submitted for a row, so the
+    console shows a click immediately, before it reaches the workbook.
+    """
+
+    def __init__(self, flush, interval=3.0):
+        self._flush = flush
+        self.interval = interval
+        self._pending = {}
+        self._submitted = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.last_error = None
+        self.last_flush = None
+        self.flushed_rows = 0
+
+    def submit(self, key, fields):
+        with self._lock:
+            self._pending.setdefault(key, {}).update(fields)
+            self._submitted.setdefault(key, {}).update(fields)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gestion-writer", daemon=True)
+                self._thread.start()
+
+    def view(self, key):
+        with self._lock:
+            return dict(self._submitted.get(key, {}))
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def forget_before(self, day):
+        """Drop the console overlay of rows reserved before ``day``"""
+        cutoff = day.strftime('%Y-%m-%d')
+        with self._lock:
+            for key in [k for k in self._submitted if k[2][:10] < cutoff and k not in self._pending]:
+                del self._submitted[key]
+
+    def flush_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                continue
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.warning("Gestion flush failed, retrying: %s", e)
+                self.last_error = str(e)
+                with self._lock:
+                    for key, fields in batch.items():
+                        # Newer submissions for the same row win
+                        self._pending[key] = {**fields, **self._pending.get(key, {})}
+                time.sleep(self.interval)
+            else:
+                self.last_error = None
+                self.last_flush = datetime.now()
+                self.flushed_rows += len(batch)
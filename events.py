@@ -0,0 +1,36 @@
+"""In-process change notifications between Streamlit sessions.
+
+Every session of a server process shares one ``ChangeFeed``. Writers
+``publish`` the topics they changed (e.g. the ordinal of a booked date);
+readers remember ``current()`` before loading data and later ask whether a
+topic they display ``changed_since`` that point. Both are dict lookups under
+a lock, so sessions can check every few seconds without touching SharePoint.
+"""
+import threading
+
+
+class ChangeFeed:
+    """Per-topic change counters drawn from one process-wide sequence"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._topics = {}
+
+    def current(self):
+        """Sequence number of the latest change; take it before reading data"""
+        with self._lock:
+            return self._sequence
+
+    def publish(self, *topics):
+        """Record a change of ``topics`` and return its sequence number"""
+        with self._lock:
+            self._sequence += 1
+            for topic in topics:
+                self._topics[topic] = self._sequence
+            return self._sequence
+
+    def changed_since(self, topic, seen):
+        """Whether ``topic`` changed after sequence number ``seen``"""
+        with self._lock:
+            return self._topics.get(topic, 0) > seen
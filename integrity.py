@@ -0,0 +1,178 @@
+"""Integrity scan of the reservations history.
+
+``scan`` expands every reservation into the 30-minute slots it occupies with
+numpy (one pass, no Python loop over rows) and reports:
+
+- slots booked by more reservations than the warehouse has docks,
+- two reservations assigned to the same dock in the same slot,
+- reservations outside the opening grid (closed day, before opening, after
+  closing or not aligned to a slot),
+- rows that could not be parsed at all (quarantined when the table was
+  loaded, see ``ReservationTable.invalid_rows``).
+
+``IntegrityMonitor`` re-runs the scan in the background whenever the shared
+workbook changes, at most once per ``interval`` seconds.
+"""
+import logging
+import threading
+import time
+from datetime import date, datetime
+
+from capacity import SLOT_MINUTES
+from reservas_schema import format_hora
+
+logger = logging.getLogger(__name__)
+
+# Issue kind -> description shown to admins
+ISSUES = {
+    'sobrecupo': "Más reservas que andenes en el mismo horario",
+    'anden_duplicado': "Dos reservas en el mismo andén y horario",
+    'fuera_de_horario': "Fuera del horario de atención",
+    'ilegible': "Fila que no se pudo interpretar",
+}
+
+
+class IntegrityReport:
+    """Result of one scan: flagged row positions per issue kind"""
+
+    def __init__(self, reservas, rows, elapsed):
+        self.reservas = reservas
+        self.version = reservas.version
+        self.rows = rows            # kind -> numpy array of row positions
+        self.elapsed = elapsed      # seconds
+        self.scanned = len(reservas)
+        self.finished = datetime.now()
+
+    @property
+    def counts(self):
+        counts = {kind: len(rows) for kind, rows in self.rows.items()}
+        counts['ilegible'] = len(self.reservas.invalid_rows)
+        return counts
+
+    @property
+    def ok(self):
+        return not any(self.counts.values())
+
+    def to_frame(self):
+        """One line per flagged reservation (a row may appear under several kinds)"""
+        import pandas as pd
+
+        reservas = self.reservas
+        lines = []
+        for kind, rows in self.rows.items():
+            for row in rows.tolist():
+                lines.append({
+                    'Problema': ISSUES[kind],
+                    'Reserva_id': reservas.reserva_id[row],
+                    'Fecha': date.fromordinal(reservas.fecha[row]),
+                    'Hora': format_hora(reservas.inicio[row], reservas.slots[row]),
+                    'Proveedor': reservas.proveedores[reservas.proveedor[row]],
+                    'Anden': reservas.anden[row] + 1 if reservas.anden[row] >= 0 else None,
+                    'Detalle': '',
+                })
+        for excel_row, reason, raw in reservas.invalid_rows:
+            lines.append({
+                'Problema': ISSUES['ilegible'],
+                'Reserva_id': None,
+                'Fecha': raw[0],
+                'Hora': raw[1],
+                'Proveedor': raw[2],
+                'Anden': None,
+                'Detalle': f"fila {excel_row}: {reason}",
+            })
+        return pd.DataFrame(lines, columns=['Problema', 'Reserva_id', 'Fecha', 'Hora', 'Proveedor', 'Anden', 'Detalle'])
+
+
+def scan(reservas, config):
+    """Check every reservation of ``reservas`` against ``config``"""
+    import numpy as np
+
+    started = time.perf_counter()
+    fecha = np.array(reservas.fecha, dtype=np.int64)
+    inicio = np.array(reservas.inicio, dtype=np.int64)
+    slots = np.array(reservas.slots, dtype=np.int64)
+    anden = np.array(reservas.anden, dtype=np.int64)
+
+    # ── Opening grid ──────────────────────────────────────────
+    # date.toordinal() is 1 for Monday 0001-01-01
+    weekday = (fecha - 1) % 7
+    opening = np.full(7, -1, dtype=np.int64)
+    closing = np.full(7, -1, dtype=np.int64)
+    for day, (start, end) in config.hours.items():
+        opening[day], closing[day] = start, end
+    day_open, day_close = opening[weekday], closing[weekday]
+    holiday = np.isin(fecha, np.fromiter(config.holidays, dtype=np.int64, count=len(config.holidays)))
+    outside = (
+        (day_open < 0) | holiday | (slots < 1)
+        | (inicio < day_open) | (inicio + slots * SLOT_MINUTES > day_close)
+        | ((inicio - day_open) % SLOT_MINUTES != 0)
+    )
+
+    # ── Slot occupancy ────────────────────────────────────────
+    # One entry per (reservation, slot it covers)
+    covered = np.maximum(slots, 0)
+    row_of = np.repeat(np.arange(len(fecha)), covered)
+    first = np.repeat(np.cumsum(covered) - covered, covered)
+    offset = np.arange(len(row_of)) - first
+    slot_key = fecha[row_of] * 1440 + inicio[row_of] + offset * SLOT_MINUTES
+
+    _, inverse, counts = np.unique(slot_key, return_inverse=True, return_counts=True)
+    overbooked = np.unique(row_of[counts[inverse] > config.docks])
+
+    # Same dock in the same slot, among reservations that have a dock
+    assigned = anden[row_of] >= 0
+    dock_key = slot_key[assigned] * 128 + anden[row_of][assigned]
+    _, dock_inverse, dock_counts = np.unique(dock_key, return_inverse=True, return_counts=True)
+    same_dock = np.unique(row_of[assigned][dock_counts[dock_inverse] > 1])
+
+    rows = {
+        'sobrecupo': overbooked,
+        'anden_duplicado': same_dock,
+        'fuera_de_horario': np.flatnonzero(outside),
+    }
+    return IntegrityReport(reservas, rows, time.perf_counter() - started)
+
+
+class IntegrityMonitor:
+    """Background scan of the shared reservations table.
+
+    ``load()`` returns the current ``ReservationTable``; the scan only runs
+    again when its ``version`` changed. The latest report is kept in
+    ``report``.
+    """
+
+    def __init__(self, load, config, interval=900):
+        self._load = load
+        self.config = config
+        self.interval = interval
+        self.report = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="integrity-scan", daemon=True)
+                self._thread.start()
+        return self
+
+    def run_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                reservas = self._load()
+                if self.report is None or reservas.version != self.report.version or self._wake.is_set():
+                    report = scan(reservas, self.config)
+                    self.report = report
+                    if not report.ok:
+                        logger.warning("Integrity scan found issues: %s", report.counts)
+                self.last_error = None
+            except Exception as e:
+                logger.warning("Integrity scan failed: %s", e)
+                self.last_error = str(e)
+            self._wake.clear()
+            self._wake.wait(self.interval)
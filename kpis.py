@@ -0,0 +1,278 @@
+"""Incremental wait / service / delay indicators over ``proveedor_gestion``.
+
+``KpiEngine`` keeps, for every supplier, ISO week and reservation slot, the
+count, sum and sum of squares of each metric plus a fixed-bin histogram from
+which percentiles are read. When a new workbook version arrives only the
+rows that were added or changed since the previous version are folded in:
+changed rows are first retracted with their previous values, so totals
+never have to be recomputed over the whole history.
+
+All per-row work is vectorized with pandas/numpy, imported lazily.
+"""
+import threading
+
+GESTION_COLUMNS = [
+    'Orden_de_compra', 'Proveedor', 'Numero_de_bultos',
+    'Hora_llegada', 'Hora_inicio_atencion', 'Hora_fin_atencion',
+    'Tiempo_espera', 'Tiempo_atencion', 'Tiempo_total', 'Tiempo_retraso',
+    'numero_de_semana', 'hora_de_reserva',
+]
+
+# metric name -> gestion column (minutes)
+METRICS = {
+    'espera': 'Tiempo_espera',
+    'atencion': 'Tiempo_atencion',
+    'retraso': 'Tiempo_retraso',
+}
+
+DIMENSIONS = ('proveedor', 'semana', 'horario')
+
+# 5-minute bins from -2 h (early arrivals) to +4 h; values outside are clamped
+BIN_WIDTH = 5
+BIN_MIN = -120
+BIN_MAX = 240
+N_BINS = (BIN_MAX - BIN_MIN) // BIN_WIDTH
+
+
+def to_minutes(series):
+    """Durations as float minutes: numbers are taken as minutes, strings such
+    as ``'00:12:30'`` or time objects as clock durations; unparseable -> NaN"""
+    import pandas as pd
+
+    minutes = pd.to_numeric(series, errors='coerce').astype(float)
+    rest = minutes.isna() & series.notna()
+    if rest.any():
+        parsed = pd.to_timedelta(series[rest].astype(str), errors='coerce')
+        minutes[rest] = parsed.dt.total_seconds() / 60
+    return minutes
+
+
+def to_datetime(series):
+    """Timestamps from Excel cells; mixed string formats are parsed one by one"""
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        parsed = pd.to_datetime(series, errors='coerce')
+    except (TypeError, ValueError):
+        # e.g. bare datetime.time cells
+        parsed = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+    missed = parsed.isna() & series.notna()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(series[missed].astype(str), errors='coerce', format='mixed')
+    return parsed
+
+
+def derive_times(gestion_df):
+    """Metric minutes per row; fills missing Tiempo_* from the Hora_* stamps"""
+    import pandas as pd
+
+    df = gestion_df.reindex(columns=GESTION_COLUMNS)
+    llegada = to_datetime(df['Hora_llegada'])
+    inicio = to_datetime(df['Hora_inicio_atencion'])
+    fin = to_datetime(df['Hora_fin_atencion'])
+    reserva = to_datetime(df['hora_de_reserva'])
+
+    derived = {
+        'espera': (inicio - llegada).dt.total_seconds() / 60,
+        'atencion': (fin - inicio).dt.total_seconds() / 60,
+        'retraso': (llegada - reserva).dt.total_seconds() / 60,
+    }
+    out = pd.DataFrame(index=df.index)
+    for metric, column in METRICS.items():
+        out[metric] = to_minutes(df[column]).fillna(derived[metric])
+    return out
+
+
+def _two_digits(numbers):
+    return numbers.astype(int).map('{:02d}'.format)
+
+
+def row_keys(gestion_df):
+    """Supplier, week and slot (minute of day, 30-minute buckets) per row.
+
+    Weeks are ISO weeks of ``hora_de_reserva`` labelled ``2025-W19``, so the
+    same week number of different years stays apart; a row without a
+    reservation time falls back to its ``numero_de_semana`` (``W19``), and
+    to ``-`` without either.
+    """
+    import pandas as pd
+
+    df = gestion_df.reindex(columns=GESTION_COLUMNS)
+    reserva = to_datetime(df['hora_de_reserva'])
+    dated = reserva.notna()
+    numero = pd.to_numeric(df['numero_de_semana'], errors='coerce')
+    undated = ~dated & numero.notna()
+
+    semana = pd.Series('-', index=df.index, dtype=object)
+    if dated.any():
+        iso = reserva[dated].dt.isocalendar()
+        semana[dated] = iso['year'].astype(int).astype(str) + '-W' + _two_digits(iso['week'])
+    if undated.any():
+        semana[undated] = 'W' + _two_digits(numero[undated])
+    horario = reserva.dt.hour * 60 + (reserva.dt.minute // 30) * 30
+    return pd.DataFrame({
+        'proveedor': df['Proveedor'].astype(str).str.strip().where(df['Proveedor'].notna(), ''),
+        'semana': semana,
+        'horario': horario.fillna(-1).astype(int),
+    })
+
+
+class _Aggregate:
+    """Moments and histograms for every key of one dimension"""
+
+    def __init__(self):
+        import numpy as np
+
+        self.keys = {}
+        self.labels = []
+        self.moments = np.zeros((0, len(METRICS), 3))  # count, sum, sum of squares
+        self.hist = np.zeros((0, len(METRICS), N_BINS))
+
+    def codes(self, labels):
+        import numpy as np
+
+        for label in set(labels) - self.keys.keys():
+            self.keys[label] = len(self.labels)
+            self.labels.append(label)
+        grow = len(self.labels) - self.moments.shape[0]
+        if grow > 0:
+            self.moments = np.concatenate([self.moments, np.zeros((grow,) + self.moments.shape[1:])])
+            self.hist = np.concatenate([self.hist, np.zeros((grow,) + self.hist.shape[1:])])
+        return np.fromiter((self.keys[label] for label in labels), dtype=np.int64, count=len(labels))
+
+    def add(self, codes, values, sign):
+        """Fold ``values`` (rows x metrics, NaN = missing) in with weight ``sign``"""
+        import numpy as np
+
+        for m in range(values.shape[1]):
+            column = values[:, m]
+            present = ~np.isnan(column)
+            keys, x = codes[present], column[present]
+            np.add.at(self.moments[:, m, 0], keys, sign)
+            np.add.at(self.moments[:, m, 1], keys, sign * x)
+            np.add.at(self.moments[:, m, 2], keys, sign * x * x)
+            bins = np.clip(((x - BIN_MIN) // BIN_WIDTH).astype(np.int64), 0, N_BINS - 1)
+            np.add.at(self.hist[:, m, :], (keys, bins), sign)
+
+
+class KpiEngine:
+    """Wait, service and delay distributions per supplier, week and slot"""
+
+    def __init__(self):
+        import numpy as np
+
+        self.version = None
+        self.aggregates = {dimension: _Aggregate() for dimension in DIMENSIONS}
+        # What each gestion row contributed last time, to retract it on change
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._codes = {dimension: np.zeros(0, dtype=np.int64) for dimension in DIMENSIONS}
+        self._values = np.zeros((0, len(METRICS)))
+        self._lock = threading.Lock()
+
+    def update(self, gestion_df, version=None):
+        """Bring the aggregates up to date with ``gestion_df``.
+
+        Cheap when ``version`` has not changed; otherwise only new or changed
+        rows are processed. Returns the number of rows folded in.
+        """
+        with self._lock:
+            if version is not None and version == self.version:
+                return 0
+            processed = self._update(gestion_df)
+            self.version = version
+            return processed
+
+    def _update(self, gestion_df):
+        import numpy as np
+        import pandas as pd
+
+        df = gestion_df.reindex(columns=GESTION_COLUMNS).reset_index(drop=True)
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        n_old, n_new = len(self._hashes), len(hashes)
+        common = min(n_old, n_new)
+
+        changed = np.flatnonzero(self._hashes[:common] != hashes[:common])
+        removed = np.arange(n_new, n_old)
+        retract = np.concatenate([changed, removed])
+        fresh = np.concatenate([changed, np.arange(n_old, n_new)])
+
+        if len(retract):
+            for dimension in DIMENSIONS:
+                self.aggregates[dimension].add(self._codes[dimension][retract], self._values[retract], -1)
+
+        # Resize the per-row memory to the new sheet length
+        if n_new != n_old:
+            keep = min(n_old, n_new)
+            self._values = np.concatenate([self._values[:keep], np.full((max(n_new - keep, 0), len(METRICS)), np.nan)])
+            for dimension in DIMENSIONS:
+                self._codes[dimension] = np.concatenate(
+                    [self._codes[dimension][:keep], np.zeros(max(n_new - keep, 0), dtype=np.int64)])
+        self._hashes = hashes
+
+        if len(fresh):
+            subset = df.iloc[fresh]
+            values = derive_times(subset)[list(METRICS)].to_numpy(dtype=float)
+            keys = row_keys(subset)
+            self._values[fresh] = values
+            for dimension in DIMENSIONS:
+                codes = self.aggregates[dimension].codes(keys[dimension].tolist())
+                self._codes[dimension][fresh] = codes
+                self.aggregates[dimension].add(codes, values, 1)
+        return len(fresh)
+
+    # ── Queries ───────────────────────────────────────────────
+    def summary(self, dimension, metric):
+        """One row per key: n, mean, std, p50, p90 (percentiles at 5-minute resolution)"""
+        import numpy as np
+        import pandas as pd
+
+        m = list(METRICS).index(metric)
+        with self._lock:
+            aggregate = self.aggregates[dimension]
+            moments = aggregate.moments[:, m, :].copy()
+            hist = aggregate.hist[:, m, :].copy()
+            labels = list(aggregate.labels)
+
+        count, total, squares = moments[:, 0], moments[:, 1], moments[:, 2]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+        result = pd.DataFrame({
+            dimension: labels,
+            'n': count.astype(int),
+            'media': mean,
+            'desv': std,
+            'p50': _percentile(hist, 0.5),
+            'p90': _percentile(hist, 0.9),
+        })
+        return result[result['n'] > 0].sort_values(dimension).reset_index(drop=True)
+
+    def histogram(self, metric, dimension='proveedor', key=None):
+        """Counts per 5-minute bin for one key (or all keys) of a dimension"""
+        import pandas as pd
+
+        m = list(METRICS).index(metric)
+        with self._lock:
+            aggregate = self.aggregates[dimension]
+            if key is None:
+                counts = aggregate.hist[:, m, :].sum(axis=0)
+            elif key in aggregate.keys:
+                counts = aggregate.hist[aggregate.keys[key], m, :].copy()
+            else:
+                counts = aggregate.hist[:0, m, :].sum(axis=0)
+        edges = [BIN_MIN + i * BIN_WIDTH for i in range(N_BINS)]
+        return pd.Series(counts, index=pd.Index(edges, name='minutos'), name=metric)
+
+
+def _percentile(hist, q):
+    """Upper edge of the bin holding quantile ``q``, per row of ``hist``"""
+    import numpy as np
+
+    totals = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    target = (totals * q)[:, None]
+    idx = (cumulative < target).sum(axis=1)
+    upper = BIN_MIN + (np.minimum(idx, N_BINS - 1) + 1) * BIN_WIDTH
+    return np.where(totals > 0, upper, np.nan)
@@ -0,0 +1,156 @@
+"""Sampling profiler for single Streamlit reruns.
+
+While a ``Profile`` runs, a background thread looks at the stack of the
+script thread every ``interval`` seconds (``sys._current_frames``) and
+counts each distinct stack. Nothing is hooked into the interpreter, so code
+runs at full speed between samples, and when no profile is running there is
+no cost at all beyond the check that decides whether to start one.
+
+``save`` writes two files per rerun into a directory:
+
+- ``<stem>.folded``: one ``frame;frame;... count`` line per stack, the input
+  format of flamegraph.pl and speedscope (a flame graph of the rerun),
+- ``<stem>.json``: the interaction tags, timing and a top-functions table,
+  read back by ``load_profiles`` to compare reruns.
+
+``mark`` tags the rerun being profiled with the interaction that triggered
+it (login, slot click, confirmation...).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Seconds between two samples
+INTERVAL = 0.005
+
+_local = threading.local()
+
+
+def mark(interaction):
+    """Tag the rerun profiled on this thread with ``interaction``; no-op when none is"""
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and interaction not in profile.tags:
+        profile.tags.append(interaction)
+
+
+def _safe(text):
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(text))
+
+
+class Profile:
+    """Stack samples of the thread that called ``start``, until ``stop``"""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()     # "outer;...;inner" -> samples
+        self.samples = 0
+        self.tags = []
+        self.started = None
+        self.elapsed = 0.0          # seconds
+        self._labels = {}           # code object -> frame label
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+        self._t0 = None
+
+    @property
+    def tag(self):
+        return '+'.join(self.tags) or 'rerun'
+
+    def start(self):
+        self._target = threading.get_ident()
+        _local.profile = self
+        self.started = datetime.now()
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._t0
+        _local.profile = None
+        return self
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = \
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+        return label
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def top(self, limit=30):
+        """Functions by own time: ``funcion``, ``propio_ms``, ``total_ms`` and shares"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            # A recursive function counts once per sample
+            for frame in set(frames):
+                total[frame] += count
+        samples = self.samples or 1
+        # Samples slip when the script thread holds the GIL; spreading the
+        # measured wall time over them keeps the milliseconds honest
+        ms = self.elapsed * 1000 / samples if self.samples else self.interval * 1000
+        return [
+            {
+                'funcion': function,
+                'propio_ms': round(own[function] * ms, 1),
+                'total_ms': round(total[function] * ms, 1),
+                'propio_pct': round(100 * own[function] / samples, 1),
+                'total_pct': round(100 * total[function] / samples, 1),
+            }
+            for function, _ in sorted(total.items(), key=lambda item: (-own[item[0]], -item[1]))[:limit]
+        ]
+
+    def save(self, directory, usuario=None):
+        """Write ``<stem>.folded`` and ``<stem>.json`` into ``directory``; returns the stem"""
+        os.makedirs(directory, exist_ok=True)
+        stem = f"{self.started:%Y%m%d-%H%M%S-%f}_{_safe(self.tag)}"
+        with open(os.path.join(directory, stem + '.folded'), 'w', encoding='utf-8') as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+        meta = {
+            'archivo': stem,
+            'interaccion': self.tag,
+            'usuario': usuario,
+            'inicio': self.started.isoformat(timespec='seconds'),
+            'duracion_s': round(self.elapsed, 3),
+            'muestras': self.samples,
+            'intervalo_ms': self.interval * 1000,
+            'top': self.top(),
+        }
+        with open(os.path.join(directory, stem + '.json'), 'w', encoding='utf-8') as out:
+            json.dump(meta, out, ensure_ascii=False, indent=1)
+        return stem
+
+
+def load_profiles(directory, limit=200):
+    """Saved profiles (the ``.json`` contents), newest first"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
@@ -0,0 +1,587 @@
+"""Canonical, column-oriented storage for delivery reservations.
+
+The workbook historically stored reservations as free-form strings:
+``Fecha`` as ``'YYYY-MM-DD 00:00:00'``, ``Hora`` as ``'09:00:00, 09:30:00'``
+for one-hour bookings and ``Orden_de_compra`` comma-joined. The canonical
+schema keeps one typed value per field instead:
+
+    proveedor_reservas     Reserva_id, Fecha_ordinal, Inicio_min, Slots,
+                           Proveedor, Numero_de_bultos, Anden
+    proveedor_reservas_oc  Reserva_id, Orden_de_compra
+
+Legacy rows that cannot be expressed canonically are never dropped: they are
+kept verbatim, with the reason, in ``proveedor_reservas_invalidas``. So are
+canonical rows with a blank or malformed number (edited by hand), in the
+same legacy columns, rather than being skipped or coerced to 0.
+
+A workbook only changes schema through ``tools/migrate_reservas.py``, which
+verifies the conversion. Until then a table loaded from a legacy sheet
+remembers it (``layout``) and is written back in the legacy format, with
+unparseable rows left in place and an extra ``Anden`` column.
+
+In memory a ``ReservationTable`` holds each column as a compact ``array``,
+suppliers as integer codes into a category list and purchase orders as a
+child table, so consumers never re-parse strings.
+
+This module only imports pandas/numpy inside the functions that need them.
+"""
+from array import array
+from itertools import accumulate
+from datetime import date, datetime
+
+SLOT_MINUTES = 30
+
+# Sheet and column names of the canonical schema
+RESERVAS_SHEET = "proveedor_reservas"
+ORDENES_SHEET = "proveedor_reservas_oc"
+INVALIDAS_SHEET = "proveedor_reservas_invalidas"
+CANONICAL_COLUMNS = ['Reserva_id', 'Fecha_ordinal', 'Inicio_min', 'Slots', 'Proveedor', 'Numero_de_bultos', 'Anden']
+ORDENES_COLUMNS = ['Reserva_id', 'Orden_de_compra']
+LEGACY_COLUMNS = ['Fecha', 'Hora', 'Proveedor', 'Numero_de_bultos', 'Orden_de_compra']
+LEGACY_ANDEN = 'Anden'
+INVALIDAS_COLUMNS = ['Fila_original', 'Motivo'] + LEGACY_COLUMNS
+
+# read_excel dtypes that keep identifiers verbatim ('00123' must not become 123);
+# the invalidas sheet is read entirely as text
+RESERVAS_DTYPES = {'Proveedor': str, 'Orden_de_compra': str}
+ORDENES_DTYPES = {'Orden_de_compra': str}
+
+
+class InvalidReservation(ValueError):
+    """A legacy reservation row that cannot be expressed in the canonical schema"""
+
+
+# ─────────────────────────────────────────────────────────────
+# Legacy string parsing (only used when loading old workbooks)
+# ─────────────────────────────────────────────────────────────
+def _is_blank(value):
+    return value is None or str(value).strip().lower() in ('', 'nan', 'nat', 'none')
+
+def parse_fecha(value):
+    """Legacy ``Fecha`` cell (string, date or datetime) -> date ordinal"""
+    if _is_blank(value):
+        raise InvalidReservation("Fecha vacía")
+    if hasattr(value, 'toordinal'):
+        return value.toordinal()
+    text = str(value).strip()
+    try:
+        return datetime.strptime(text[:10], '%Y-%m-%d').toordinal()
+    except ValueError:
+        raise InvalidReservation(f"Fecha no reconocida: {text!r}")
+
+def parse_minute(value):
+    """Single time value (``'09:30'``, ``'09:30:00'`` or a time object) -> minutes"""
+    if hasattr(value, 'hour') and hasattr(value, 'minute'):
+        return value.hour * 60 + value.minute
+    parts = str(value).strip().split(':')
+    if len(parts) < 2:
+        raise InvalidReservation(f"Hora no reconocida: {value!r}")
+    try:
+        hour, minute = int(parts[0]), int(parts[1])
+    except ValueError:
+        raise InvalidReservation(f"Hora no reconocida: {value!r}")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise InvalidReservation(f"Hora fuera de rango: {value!r}")
+    return hour * 60 + minute
+
+def parse_hora(value):
+    """Legacy ``Hora`` cell -> ``(start_minute, slot_count)``.
+
+    Combined cells must list consecutive 30-minute slots.
+    """
+    if _is_blank(value):
+        raise InvalidReservation("Hora vacía")
+    if hasattr(value, 'hour'):
+        return parse_minute(value), 1
+    minutes = [parse_minute(part) for part in str(value).split(',') if part.strip()]
+    if not minutes:
+        raise InvalidReservation(f"Hora no reconocida: {value!r}")
+    for previous, current in zip(minutes, minutes[1:]):
+        if current - previous != SLOT_MINUTES:
+            raise InvalidReservation(f"Horarios no contiguos: {value!r}")
+    return minutes[0], len(minutes)
+
+def parse_ordenes(value):
+    """Legacy comma-joined ``Orden_de_compra`` -> list of order numbers"""
+    if _is_blank(value):
+        return []
+    return [orden.strip() for orden in str(value).split(',') if orden.strip()]
+
+
+def _whole_number(value, field, blank):
+    """Integral cell (``3``, ``3.0``, ``'3'``) -> int; ``blank`` when empty"""
+    if _is_blank(value):
+        return blank
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidReservation(f"{field} no reconocido: {value!r}")
+    if not number.is_integer():
+        raise InvalidReservation(f"{field} no entero: {value!r}")
+    return int(number)
+
+def parse_bultos(value):
+    """Legacy ``Numero_de_bultos`` cell -> int; empty counts as 0"""
+    bultos = _whole_number(value, "Numero_de_bultos", 0)
+    if bultos < 0:
+        raise InvalidReservation(f"Numero_de_bultos negativo: {value!r}")
+    return bultos
+
+def parse_anden(value):
+    """``Anden`` cell -> dock number; empty means not assigned (-1)"""
+    anden = _whole_number(value, "Anden", -1)
+    if not -1 <= anden < 127:
+        raise InvalidReservation(f"Anden fuera de rango: {value!r}")
+    return anden
+
+
+def _excel_row(value):
+    """``Fila_original`` read back as text -> int (kept as is if not a number)"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return value
+
+
+# ─────────────────────────────────────────────────────────────
+# Display / legacy formatting
+# ─────────────────────────────────────────────────────────────
+def format_minute(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def format_fecha(ordinal):
+    """Date ordinal -> legacy ``'YYYY-MM-DD 00:00:00'``"""
+    return date.fromordinal(ordinal).strftime('%Y-%m-%d') + ' 00:00:00'
+
+def format_hora(start, slots):
+    """Canonical start/slots -> legacy ``'09:00:00, 09:30:00'``"""
+    return ', '.join(f"{format_minute(start + i * SLOT_MINUTES)}:00" for i in range(slots))
+
+def format_time_range(start, slots):
+    """Canonical start/slots -> ``'09:00 - 10:00'`` for display"""
+    return f"{format_minute(start)} - {format_minute(start + slots * SLOT_MINUTES)}"
+
+
+class StringColumn:
+    """Strings packed into one UTF-8 buffer plus an offsets array.
+
+    Avoids one Python object per value for high-cardinality columns such as
+    purchase order numbers.
+    """
+
+    def __init__(self, values=()):
+        self._data = bytearray()
+        self._offsets = array('i', [0])
+        self.extend(values)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._data[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def append(self, value):
+        self._data += value.encode('utf-8')
+        self._offsets.append(len(self._data))
+
+    def extend(self, values):
+        encoded = [value.encode('utf-8') for value in values]
+        ends = accumulate(map(len, encoded), initial=len(self._data))
+        next(ends)  # the current end is already stored
+        self._data += b''.join(encoded)
+        self._offsets.extend(ends)
+
+    def tolist(self):
+        return list(self)
+
+    @property
+    def nbytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+# Canonical columns that must hold whole numbers, and their valid range
+_CANONICAL_RANGES = {
+    'Reserva_id': (1, 2**31 - 1),
+    'Fecha_ordinal': (1, date.max.toordinal()),
+    'Inicio_min': (0, 24 * 60 - 1),
+    'Slots': (1, 127),
+    'Numero_de_bultos': (0, 2**31 - 1),
+}
+
+def _canonical_valid(df):
+    """Boolean Series: rows of a canonical sheet that can be loaded as they are"""
+    import pandas as pd
+
+    valid = pd.Series(True, index=df.index)
+    for name, (low, high) in _CANONICAL_RANGES.items():
+        values = pd.to_numeric(df[name], errors='coerce')
+        valid &= values.notna() & (values == values.round()) & values.between(low, high)
+    if 'Anden' in df.columns:
+        anden = pd.to_numeric(df['Anden'], errors='coerce')
+        blank = df['Anden'].isna()
+        valid &= blank | (anden.notna() & (anden == anden.round()) & anden.between(-1, 126))
+    return valid
+
+def _canonical_problem(row):
+    """Why ``_canonical_valid`` rejected a row, for the Motivo column"""
+    for name, (low, high) in _CANONICAL_RANGES.items():
+        try:
+            value = _whole_number(row[name], name, None)
+        except InvalidReservation as e:
+            return str(e)
+        if value is None:
+            return f"{name} vacío"
+        if not low <= value <= high:
+            return f"{name} fuera de rango: {row[name]!r}"
+    try:
+        parse_anden(row.get('Anden'))
+    except InvalidReservation as e:
+        return str(e)
+    return "Fila no válida"
+
+def _canonical_raw(row, ordenes_df):
+    """A rejected canonical row in the legacy columns of the invalidas sheet.
+
+    Fecha and Hora are spelled out when their cells are readable and kept as
+    they were otherwise; the purchase orders are taken from the child sheet.
+    """
+    def cell(name):
+        return None if _is_blank(row.get(name)) else row.get(name)
+
+    try:
+        fecha = format_fecha(_whole_number(row['Fecha_ordinal'], 'Fecha_ordinal', None))
+    except (InvalidReservation, TypeError, ValueError):
+        fecha = cell('Fecha_ordinal')
+    try:
+        hora = format_hora(_whole_number(row['Inicio_min'], 'Inicio_min', None),
+                           _whole_number(row['Slots'], 'Slots', None))
+    except (InvalidReservation, TypeError):
+        hora = cell('Inicio_min')
+    ordenes = None
+    if ordenes_df is not None and not _is_blank(row['Reserva_id']):
+        ids = ordenes_df['Reserva_id'].astype(str).str.replace(r'\.0$', '', regex=True)
+        matched = ordenes_df.loc[ids == str(row['Reserva_id']).removesuffix('.0'), 'Orden_de_compra']
+        ordenes = ', '.join(matched.astype(str)) or None
+    return (fecha, hora, cell('Proveedor'), cell('Numero_de_bultos'), ordenes)
+
+
+class ReservationTable:
+    """Reservations held as typed, array-backed columns.
+
+    Row ``i`` of every column describes one reservation. Suppliers are stored
+    as codes into ``proveedores``; purchase orders live in the child columns
+    ``oc_reserva`` (row position) and ``oc_numero``.
+
+    A table loaded from the cache is shared between sessions and must be
+    treated as read-only; the save path works on a freshly loaded copy.
+    """
+
+    def __init__(self):
+        self.reserva_id = array('i')
+        self.fecha = array('i')      # date.toordinal()
+        self.inicio = array('h')     # minutes since midnight
+        self.slots = array('b')      # number of 30-minute slots
+        self.bultos = array('i')
+        self.proveedor = array('i')  # code into self.proveedores
+        self.anden = array('b')      # receiving dock, -1 when not assigned yet
+        self.proveedores = []
+        self._proveedor_codes = {}
+        self.oc_reserva = array('i')
+        self.oc_numero = StringColumn()
+        # Legacy rows that could not be parsed: (Excel row, reason, raw values)
+        self.invalid_rows = []
+        # Identifier of the workbook revision this table was loaded from
+        self.version = None
+        # Sheet format to write back: 'canonical' or 'legacy' (not migrated yet)
+        self.layout = 'canonical'
+        self._date_index = None
+        self._ordenes_index = None
+        self._supplier_index = None
+
+    def __len__(self):
+        return len(self.fecha)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # Indexes are rebuilt on demand
+        state['_date_index'] = None
+        state['_ordenes_index'] = None
+        state['_supplier_index'] = None
+        return state
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the columns"""
+        columns = (self.reserva_id, self.fecha, self.inicio, self.slots,
+                   self.bultos, self.proveedor, self.anden, self.oc_reserva)
+        fixed = sum(col.itemsize * len(col) for col in columns)
+        categories = sum(len(s) + 49 for s in self.proveedores)
+        return fixed + self.oc_numero.nbytes + categories
+
+    # ── Construction ──────────────────────────────────────────
+    def supplier_code(self, name):
+        name = str(name).strip()
+        code = self._proveedor_codes.get(name)
+        if code is None:
+            code = len(self.proveedores)
+            self.proveedores.append(name)
+            self._proveedor_codes[name] = code
+        return code
+
+    def append(self, fecha, inicio, slots, proveedor, bultos, ordenes, anden=-1, reserva_id=None):
+        """Add one reservation and return its row position"""
+        row = len(self.fecha)
+        if reserva_id is None:
+            reserva_id = (max(self.reserva_id) + 1) if self.reserva_id else 1
+        self.reserva_id.append(reserva_id)
+        self.fecha.append(fecha)
+        self.inicio.append(inicio)
+        self.slots.append(slots)
+        self.bultos.append(int(bultos))
+        self.proveedor.append(self.supplier_code(proveedor))
+        self.anden.append(anden)
+        for orden in ordenes:
+            self.oc_reserva.append(row)
+            self.oc_numero.append(orden)
+        self._date_index = None
+        self._ordenes_index = None
+        self._supplier_index = None
+        return row
+
+    @classmethod
+    def from_frame(cls, reservas_df, ordenes_df=None, invalidas_df=None):
+        """Build from either a canonical or a legacy ``proveedor_reservas`` sheet"""
+        if 'Inicio_min' in reservas_df.columns:
+            table = cls._from_canonical(reservas_df, ordenes_df)
+        else:
+            table = cls._from_legacy(reservas_df)
+            table.layout = 'legacy'
+        if invalidas_df is not None:
+            for values in invalidas_df.reindex(columns=INVALIDAS_COLUMNS).itertuples(index=False):
+                raw = tuple(None if _is_blank(value) else value for value in values[2:])
+                table.invalid_rows.append((_excel_row(values[0]), values[1], raw))
+        return table
+
+    @classmethod
+    def _from_canonical(cls, reservas_df, ordenes_df):
+        import numpy as np
+        import pandas as pd
+
+        table = cls()
+        # Blank lines are not reservations; any other row that does not hold
+        # whole numbers in range is quarantined, never dropped or coerced
+        df = reservas_df.dropna(how='all')
+        valid = _canonical_valid(df)
+        if not valid.all():
+            table.invalid_rows = [
+                (position + 2, _canonical_problem(row), _canonical_raw(row, ordenes_df))
+                for position, row in df[~valid].iterrows()
+            ]
+            df = df[valid]
+
+        def column(name, typecode, dtype):
+            col = array(typecode)
+            col.frombytes(pd.to_numeric(df[name]).to_numpy(dtype=dtype).tobytes())
+            return col
+
+        table.reserva_id = column('Reserva_id', 'i', np.int32)
+        table.fecha = column('Fecha_ordinal', 'i', np.int32)
+        table.inicio = column('Inicio_min', 'h', np.int16)
+        table.slots = column('Slots', 'b', np.int8)
+        table.bultos = column('Numero_de_bultos', 'i', np.int32)
+        if 'Anden' in df.columns:
+            table.anden.frombytes(pd.to_numeric(df['Anden']).fillna(-1).to_numpy(dtype=np.int8).tobytes())
+        else:
+            table.anden = array('b', [-1]) * len(df)
+
+        # Canonical sheets are written by us, so values are already stripped;
+        # only the (few) categories are normalized
+        proveedores = df['Proveedor'].fillna('').astype(str)
+        categories = proveedores.astype('category')
+        stripped = categories.cat.categories.str.strip()
+        if stripped.is_unique:
+            categories = categories.cat.rename_categories(stripped)
+        else:
+            categories = proveedores.str.strip().astype('category')
+        table.proveedores = list(categories.cat.categories)
+        table._proveedor_codes = {name: code for code, name in enumerate(table.proveedores)}
+        table.proveedor = array('i')
+        table.proveedor.frombytes(categories.cat.codes.to_numpy(dtype=np.int32).tobytes())
+
+        if ordenes_df is not None and len(ordenes_df) and len(table.reserva_id):
+            # Map Reserva_id -> row position
+            ids = np.frombuffer(table.reserva_id, dtype=np.int32)
+            order = np.argsort(ids, kind='stable')
+            sorted_ids = ids[order]
+            oc_ids = pd.to_numeric(ordenes_df['Reserva_id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int32)
+            pos = np.clip(np.searchsorted(sorted_ids, oc_ids), 0, len(ids) - 1)
+            found = sorted_ids[pos] == oc_ids
+            table.oc_reserva.frombytes(order[pos][found].astype(np.int32).tobytes())
+            table.oc_numero = StringColumn(ordenes_df['Orden_de_compra'].astype(str)[found].tolist())
+        return table
+
+    @classmethod
+    def _from_legacy(cls, reservas_df):
+        table = cls()
+        # Anden is only present once the app has written the sheet back
+        columns = [reservas_df.get(name) for name in LEGACY_COLUMNS + [LEGACY_ANDEN]]
+        rows = zip(*(col.tolist() if col is not None else [None] * len(reservas_df) for col in columns))
+        for position, (fecha, hora, proveedor, bultos, ordenes, anden) in enumerate(rows):
+            try:
+                ordinal = parse_fecha(fecha)
+                inicio, slots = parse_hora(hora)
+                # 2.5 bultos is not a number of packages: quarantined, not truncated
+                cantidad = parse_bultos(bultos)
+                dock = parse_anden(anden)
+            except InvalidReservation as e:
+                table.invalid_rows.append((position + 2, str(e), (fecha, hora, proveedor, bultos, ordenes)))
+                continue
+            table.append(ordinal, inicio, slots, '' if _is_blank(proveedor) else proveedor,
+                         cantidad, parse_ordenes(ordenes), reserva_id=len(table) + 1, anden=dock)
+        return table
+
+    # ── Queries ───────────────────────────────────────────────
+    def _index(self):
+        """Row positions sorted by date, plus the sorted dates (built once)"""
+        if self._date_index is None:
+            import numpy as np
+
+            fechas = np.array(self.fecha, dtype=np.int32)
+            order = np.argsort(fechas, kind='stable')
+            self._date_index = (order, fechas[order])
+        return self._date_index
+
+    def rows_for_date(self, day):
+        """Row positions of the reservations on ``day`` (a date or ordinal)"""
+        import numpy as np
+
+        ordinal = day if isinstance(day, int) else day.toordinal()
+        order, sorted_fechas = self._index()
+        # Query in the index dtype: a mismatched one would copy the index
+        lo, hi = np.searchsorted(sorted_fechas, np.array([ordinal, ordinal + 1], dtype=sorted_fechas.dtype))
+        return order[lo:hi].tolist()
+
+    def _by_supplier(self):
+        """Row positions sorted by supplier, then date and start (built once)"""
+        if self._supplier_index is None:
+            import numpy as np
+
+            codes = np.array(self.proveedor, dtype=np.int32)
+            when = np.array(self.fecha, dtype=np.int64) * 1440 + np.array(self.inicio, dtype=np.int64)
+            order = np.lexsort((when, codes))
+            self._supplier_index = (order, codes[order], when[order])
+        return self._supplier_index
+
+    def supplier_rows(self, proveedor, desde=None, hasta=None):
+        """Row positions of one supplier's reservations, oldest first.
+
+        ``desde`` / ``hasta`` (dates or ordinals, inclusive) narrow the range.
+        A lookup is a few binary searches whatever the table size; the result
+        is a numpy view into the index, so slice it (e.g. one page) before
+        converting to a list.
+        """
+        import numpy as np
+
+        order, codes, when = self._by_supplier()
+        code = self._proveedor_codes.get(str(proveedor).strip())
+        if code is None:
+            return order[:0]
+        lo, hi = np.searchsorted(codes, np.array([code, code + 1], dtype=codes.dtype))
+        if desde is not None:
+            ordinal = desde if isinstance(desde, int) else desde.toordinal()
+            lo += np.searchsorted(when[lo:hi], np.int64(ordinal * 1440))
+        if hasta is not None:
+            ordinal = hasta if isinstance(hasta, int) else hasta.toordinal()
+            hi = lo + np.searchsorted(when[lo:hi], np.int64((ordinal + 1) * 1440))
+        return order[lo:max(lo, hi)]
+
+    def booked_minutes(self, day):
+        """Set of slot start minutes occupied on ``day``"""
+        booked = set()
+        for row in self.rows_for_date(day):
+            start = self.inicio[row]
+            for i in range(self.slots[row]):
+                booked.add(start + i * SLOT_MINUTES)
+        return booked
+
+    def ordenes(self, row):
+        """Purchase orders of one reservation, in their original order"""
+        import numpy as np
+
+        if self._ordenes_index is None:
+            rows = np.array(self.oc_reserva, dtype=np.int32)
+            order = np.argsort(rows, kind='stable')
+            self._ordenes_index = (order, rows[order])
+        order, sorted_rows = self._ordenes_index
+        lo, hi = np.searchsorted(sorted_rows, np.array([row, row + 1], dtype=sorted_rows.dtype))
+        return [self.oc_numero[i] for i in order[lo:hi]]
+
+    def record(self, row):
+        """One reservation as a plain dict of canonical values"""
+        return {
+            'Reserva_id': self.reserva_id[row],
+            'Fecha': date.fromordinal(self.fecha[row]),
+            'Inicio_min': self.inicio[row],
+            'Slots': self.slots[row],
+            'Proveedor': self.proveedores[self.proveedor[row]],
+            'Numero_de_bultos': self.bultos[row],
+            'Anden': self.anden[row],
+            'Orden_de_compra': self.ordenes(row),
+        }
+
+    # ── Serialization ─────────────────────────────────────────
+    def to_frames(self):
+        """Canonical ``(reservas_df, ordenes_df)`` ready to write to the workbook"""
+        import numpy as np
+        import pandas as pd
+
+        codes = np.frombuffer(self.proveedor, dtype=np.int32) if len(self.proveedor) else np.zeros(0, np.int32)
+        reservas_df = pd.DataFrame({
+            'Reserva_id': np.array(self.reserva_id, dtype=np.int32),
+            'Fecha_ordinal': np.array(self.fecha, dtype=np.int32),
+            'Inicio_min': np.array(self.inicio, dtype=np.int16),
+            'Slots': np.array(self.slots, dtype=np.int8),
+            'Proveedor': np.array(self.proveedores, dtype=object)[codes] if len(codes) else [],
+            'Numero_de_bultos': np.array(self.bultos, dtype=np.int32),
+            'Anden': np.array(self.anden, dtype=np.int8),
+        }, columns=CANONICAL_COLUMNS)
+        rows = np.array(self.oc_reserva, dtype=np.int64)
+        ordenes_df = pd.DataFrame({
+            'Reserva_id': np.array(self.reserva_id, dtype=np.int32)[rows] if len(rows) else [],
+            'Orden_de_compra': self.oc_numero.tolist(),
+        }, columns=ORDENES_COLUMNS)
+        return reservas_df, ordenes_df
+
+    def invalid_frame(self):
+        """Quarantined legacy rows, verbatim, for the ``INVALIDAS_SHEET``"""
+        import pandas as pd
+
+        return pd.DataFrame(
+            [(row, reason) + tuple(raw) for row, reason, raw in self.invalid_rows],
+            columns=INVALIDAS_COLUMNS,
+        )
+
+    def to_legacy_frame(self):
+        """The same reservations in the historical string format, plus ``Anden``.
+
+        Unparseable rows go back verbatim to the position they were read
+        from, so a legacy sheet round-trips with only the new rows appended.
+        """
+        import pandas as pd
+
+        ordenes = [[] for _ in range(len(self))]
+        for row, numero in zip(self.oc_reserva, self.oc_numero):
+            ordenes[row].append(numero)
+        rows = [
+            (format_fecha(f), format_hora(s, n), self.proveedores[c], b, ', '.join(o), a if a >= 0 else None)
+            for f, s, n, c, b, o, a in zip(self.fecha, self.inicio, self.slots, self.proveedor,
+                                           self.bultos, ordenes, self.anden)
+        ]
+        # Excel row n held data row n - 2; rows of unknown position go last
+        for excel_row, _, raw in sorted(self.invalid_rows, key=lambda r: r[0] if isinstance(r[0], int) else float('inf')):
+            position = max(excel_row - 2, 0) if isinstance(excel_row, int) else len(rows)
+            rows.insert(position, tuple(raw) + (None,))
+        return pd.DataFrame(rows, columns=LEGACY_COLUMNS + [LEGACY_ANDEN])
@@ -0,0 +1,83 @@
+"""Booking length learned from how long unloading actually took.
+
+``SizingTable`` is a lookup table built from ``proveedor_gestion``: for each
+supplier and band of bultos it stores the number of 30-minute slots that
+covers the 75th percentile of the recorded service time (``Tiempo_atencion``,
+or ``Hora_fin_atencion - Hora_inicio_atencion``). Suppliers with too little
+history fall back to all suppliers in the same band, and bands without
+history to the configured bultos rule. Bookings are 1 to 3 slots
+(30/60/90 minutes).
+
+The table is rebuilt once per workbook version; lookups are dict hits.
+"""
+from bisect import bisect_right
+
+from kpis import derive_times
+
+SLOT_MINUTES = 30
+MAX_SLOTS = 3
+MIN_SAMPLES = 5
+QUANTILE = 0.75
+
+# Lower bound of each band of bultos: 1-4, 5-9, 10-19, 20+
+BULTOS_BANDS = (1, 5, 10, 20)
+
+
+def bultos_band(bultos):
+    return max(bisect_right(BULTOS_BANDS, bultos) - 1, 0)
+
+
+def minutes_to_slots(minutes):
+    return min(max(-(-int(round(minutes)) // SLOT_MINUTES), 1), MAX_SLOTS)
+
+
+class SizingTable:
+    """Predicted slots per (supplier, band of bultos), with fallbacks"""
+
+    def __init__(self, fallback, by_supplier=None, by_band=None, version=None):
+        # fallback(bultos) -> slots, used when there is no usable history
+        self.fallback = fallback
+        self.by_supplier = by_supplier or {}
+        self.by_band = by_band or {}
+        self.version = version
+
+    @classmethod
+    def build(cls, gestion_df, fallback, version=None):
+        import numpy as np
+        import pandas as pd
+
+        minutes = derive_times(gestion_df)['atencion']
+        bultos = pd.to_numeric(gestion_df.get('Numero_de_bultos'), errors='coerce')
+        proveedor = gestion_df.get('Proveedor')
+        if bultos is None or proveedor is None or not len(gestion_df):
+            return cls(fallback, version=version)
+
+        history = pd.DataFrame({
+            'proveedor': proveedor.astype(str).str.strip(),
+            'band': np.searchsorted(BULTOS_BANDS, bultos.fillna(0).to_numpy(), side='right') - 1,
+            'minutes': minutes,
+        })[(minutes > 0) & (bultos > 0)]
+
+        def table(keys):
+            grouped = history.groupby(keys)['minutes']
+            stats = pd.DataFrame({'n': grouped.size(), 'q': grouped.quantile(QUANTILE)})
+            stats = stats[stats['n'] >= MIN_SAMPLES]
+            return {key: minutes_to_slots(q) for key, q in stats['q'].items()}
+
+        return cls(
+            fallback,
+            by_supplier=table(['proveedor', 'band']),
+            by_band=table('band'),
+            version=version,
+        )
+
+    def slots_for(self, proveedor, bultos):
+        """Number of 30-minute slots to reserve for this delivery"""
+        band = bultos_band(bultos)
+        slots = self.by_supplier.get((str(proveedor).strip(), band))
+        if slots is None:
+            slots = self.by_band.get(band)
+        if slots is None:
+            # The configured rule may ask for longer bookings than the grid offers
+            slots = min(self.fallback(bultos), MAX_SLOTS)
+        return slots
@@ -0,0 +1,142 @@
+"""Token buckets, deadlines and shared fetches in front of SharePoint."""
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, Throttled
+
+
+class FakeClock:
+    """Stands in for the ``time`` module: sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission, 'time', fake)
+    return fake
+
+
+def _counters(controller, operation):
+    return next(m for m in controller.metrics() if m['operacion'] == operation)
+
+
+def test_rejection_does_not_consume_a_token(clock):
+    controller = AdmissionController(rate=1.0, burst=1, max_wait=0.5)
+    controller.admit("descarga")
+    for _ in range(3):
+        with pytest.raises(Throttled):
+            controller.admit("descarga")
+    # Had the rejections taken tokens, this one would wait 3 s more
+    clock.now += 1.0
+    controller.admit("descarga", timeout=0)
+    assert clock.slept == []
+    assert _counters(controller, "descarga")['rechazadas'] == 3
+
+
+def test_delayed_admits_queue_behind_each_other(clock):
+    controller = AdmissionController(rate=2.0, burst=1, max_wait=10)
+    controller.admit("guardar")
+    controller.admit("guardar")
+    controller.admit("guardar")
+    # The first waits half a second for the next token, the second then
+    # waits for the one after it
+    assert clock.slept == [0.5, 0.5]
+    counters = _counters(controller, "guardar")
+    assert (counters['admitidas'], counters['demoradas'], counters['espera_max_s']) == (3, 2, 0.5)
+
+
+def test_supplier_bucket_limits_one_supplier_only(clock):
+    controller = AdmissionController(rate=100, burst=100, supplier_rate=0.1, supplier_burst=2, max_wait=1)
+    controller.admit("guardar", "acme")
+    controller.admit("guardar", "acme")
+    with pytest.raises(Throttled):
+        controller.admit("guardar", "acme")
+    controller.admit("guardar", "beta")
+    # Shared work is charged to the global budget only
+    controller.admit("descarga")
+    assert clock.slept == []
+
+
+def _joined(controller, count):
+    """Wait until ``count`` callers joined the flight in progress"""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if any(m['agrupadas'] >= count for m in controller.metrics()):
+            return
+        time.sleep(0.01)
+    raise AssertionError("the callers did not join the flight")
+
+
+def _followers(controller, key, fn, count):
+    """Start ``fn`` as leader, then ``count`` callers that join its flight"""
+    results = [None] * (count + 1)
+
+    def call(i):
+        try:
+            results[i] = controller.coalesce(key, fn, "descarga", timeout=5)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count + 1)]
+    threads[0].start()
+    return threads, results
+
+
+def test_followers_share_the_leader_result():
+    controller = AdmissionController()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"hoja": 1}
+
+    threads, results = _followers(controller, ("workbook", "central"), fetch, 3)
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _joined(controller, 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1]
+    assert all(result is results[0] for result in results) and results[0] == {"hoja": 1}
+
+
+def test_followers_get_the_leader_exception():
+    controller = AdmissionController()
+    started, release = threading.Event(), threading.Event()
+    error = ConnectionError("SharePoint no responde")
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise error
+
+    threads, results = _followers(controller, ("workbook", "central"), fetch, 2)
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _joined(controller, 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(result is error for result in results)
+    # The flight is over: the next call runs again
+    assert controller.coalesce(("workbook", "central"), lambda: "otra vez") == "otra vez"
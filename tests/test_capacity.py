@@ -0,0 +1,88 @@
+"""Dock allocation on the slot grid of one day."""
+from datetime import date
+
+from capacity import CapacityConfig, DaySchedule
+from reservas_schema import ReservationTable
+
+MONDAY = date(2025, 5, 5)
+SATURDAY = date(2025, 5, 10)
+SUNDAY = date(2025, 5, 11)
+
+
+def _config(docks=2, **mapping):
+    return CapacityConfig.from_mapping({'andenes': docks, **mapping})
+
+
+def _table(*bookings):
+    """``(start minute, slots, dock)`` bookings on MONDAY, in sheet order"""
+    table = ReservationTable()
+    for start, slots, dock in bookings:
+        table.append(MONDAY.toordinal(), start, slots, 'acme', 1, [], anden=dock)
+    return table
+
+
+def test_lowest_free_dock_is_assigned():
+    schedule = DaySchedule(_config(docks=3), MONDAY)
+    assert [schedule.occupy(540, 2) for _ in range(3)] == [0, 1, 2]
+    assert schedule.occupy(540, 1) is None
+    # The half hour after a 30-minute booking frees dock 0 again
+    assert schedule.occupy(600, 1) == 0
+
+
+def test_explicit_dock_must_be_free_and_exist():
+    schedule = DaySchedule(_config(docks=2), MONDAY)
+    assert schedule.occupy(540, 1, dock=1) == 1
+    assert schedule.occupy(540, 1, dock=1) is None
+    assert schedule.occupy(540, 1, dock=2) is None
+    assert schedule.free_dock(540, 1) == 0
+
+
+def test_docked_bookings_are_placed_before_undocked_ones():
+    # The undocked 9:00 booking comes first in the sheet and earlier in the
+    # day, but the 9:30 booking already holds dock 0 for 9:30-10:30
+    table = _table((540, 2, -1), (570, 2, 0))
+    schedule = DaySchedule.from_table(_config(docks=2), table, MONDAY)
+    assert schedule.conflicts == []
+    assert schedule.free_docks(540, 1) == 0b01
+    assert schedule.free_docks(570, 1) == 0
+
+
+def test_overbooked_rows_are_reported_as_conflicts():
+    table = _table((540, 1, -1), (540, 1, -1), (540, 1, 0))
+    schedule = DaySchedule.from_table(_config(docks=2), table, MONDAY)
+    # Dock 0 goes to the row that carries it, dock 1 to the first undocked
+    assert schedule.conflicts == [1]
+
+
+def test_multi_slot_booking_cannot_leave_the_grid():
+    schedule = DaySchedule(_config(docks=1), SATURDAY)  # 9:00-12:00
+    starts = [start for start, _ in schedule.availability(2)]
+    assert starts[0] == 540 and starts[-1] == 660
+    assert schedule.occupy(690, 2) is None
+    assert schedule.occupy(690, 1) == 0
+    # Outside opening hours and off the 30-minute grid
+    assert schedule.occupy(720, 1) is None
+    assert schedule.occupy(545, 1) is None
+
+
+def test_bookings_outside_the_grid_are_conflicts():
+    table = _table((960, 1, -1), (540, 1, -1))
+    schedule = DaySchedule.from_table(_config(docks=1), table, MONDAY)
+    assert schedule.conflicts == [0]
+
+
+def test_closed_days_and_holidays_offer_no_slots():
+    config = _config(feriados=[MONDAY.isoformat()])
+    assert not config.is_open(SUNDAY) and not config.is_open(MONDAY)
+    assert config.is_open(SATURDAY)
+    for day in (SUNDAY, MONDAY):
+        schedule = DaySchedule(config, day)
+        assert schedule.availability(1) == []
+        assert schedule.occupy(540, 1) is None
+
+
+def test_configured_hours_replace_the_default_week():
+    config = _config(horarios={'sábado': '09:00-10:00', 'domingo': '10:00-11:00'})
+    assert not config.is_open(MONDAY)
+    assert config.grid(SATURDAY) == [540, 570]
+    assert config.grid(SUNDAY) == [600, 630]
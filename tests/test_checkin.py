@@ -0,0 +1,61 @@
+"""Reception stamps on a gestion sheet read back from Excel."""
+import io
+from datetime import datetime
+
+import pandas as pd
+
+from checkin import gestion_key, is_stamped, stamp
+
+
+def _mixed_sheet():
+    """A working day: one delivery finished, one waiting, one not arrived"""
+    df = pd.DataFrame({
+        'Orden_de_compra': ['0000041', '0000042', '0000043'],
+        'Proveedor': ['acme', 'acme', 'beta'],
+        'hora_de_reserva': [datetime(2025, 5, 5, 9, 0), datetime(2025, 5, 5, 9, 30), datetime(2025, 5, 5, 10, 0)],
+        'Hora_llegada': [datetime(2025, 5, 5, 8, 55), datetime(2025, 5, 5, 9, 40), None],
+        'Hora_inicio_atencion': [datetime(2025, 5, 5, 9, 0), None, None],
+        'Hora_fin_atencion': [datetime(2025, 5, 5, 9, 20), None, None],
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_excel(buffer, dtype={'Orden_de_compra': str, 'Proveedor': str})
+
+
+def test_mixed_sheet_reads_back_with_nat():
+    df = _mixed_sheet()
+    assert df['Hora_inicio_atencion'].isna().any()
+    assert str(df['Hora_inicio_atencion'].dtype).startswith('datetime64')
+
+
+def test_is_stamped_on_unstamped_rows():
+    done, waiting, expected = _mixed_sheet().to_dict('records')
+    assert [is_stamped(done, event) for event in ('llegada', 'inicio', 'fin')] == [True, True, True]
+    assert [is_stamped(waiting, event) for event in ('llegada', 'inicio', 'fin')] == [True, False, False]
+    assert [is_stamped(expected, event) for event in ('llegada', 'inicio', 'fin')] == [False, False, False]
+
+
+def test_gestion_key_ignores_missing_stamps():
+    rows = _mixed_sheet().to_dict('records')
+    keys = [gestion_key(row) for row in rows]
+    assert keys[1] == ('acme', '42', '2025-05-05 09:30:00')
+    assert len(set(keys)) == 3
+
+
+def test_gestion_key_matches_padded_and_numeric_orders():
+    reserved = datetime(2025, 5, 5, 9, 30)
+    typed = {'Proveedor': 'acme', 'Orden_de_compra': '0000042, 0000043', 'hora_de_reserva': reserved}
+    as_numbers = {'Proveedor': 'acme ', 'Orden_de_compra': 42.0, 'hora_de_reserva': reserved}
+    assert gestion_key(typed)[1] == '42, 43'
+    assert gestion_key(as_numbers) == gestion_key({**typed, 'Orden_de_compra': '0000042'})
+
+
+def test_stamp_next_event_on_row_with_nat():
+    waiting = _mixed_sheet().to_dict('records')[1]
+    fields = stamp(waiting, 'inicio', datetime(2025, 5, 5, 9, 50))
+    assert fields['Tiempo_espera'] == 10.0
+    # The finish stamp of a row without a start cannot compute a service time
+    fields = stamp(waiting, 'fin', datetime(2025, 5, 5, 10, 0))
+    assert fields['Tiempo_atencion'] is None
+    assert fields['Tiempo_total'] == 20.0
@@ -0,0 +1,33 @@
+"""Indicator keys and aggregates over a gestion sheet."""
+from datetime import datetime
+
+import pandas as pd
+
+from kpis import KpiEngine, row_keys
+
+
+def _sheet():
+    # Week 19 of two years, plus a row typed without a reservation time
+    return pd.DataFrame({
+        'Proveedor': ['acme', 'acme', 'beta', 'beta'],
+        'hora_de_reserva': [datetime(2024, 5, 7, 9, 0), datetime(2025, 5, 6, 9, 30), None, None],
+        'numero_de_semana': [19, 19, 19, None],
+        'Tiempo_espera': [10.0, 20.0, 30.0, 40.0],
+    })
+
+
+def test_weeks_are_keyed_by_iso_year():
+    assert row_keys(_sheet())['semana'].tolist() == ['2024-W19', '2025-W19', 'W19', '-']
+
+
+def test_week_summary_keeps_years_apart():
+    engine = KpiEngine()
+    engine.update(_sheet(), 'v1')
+    summary = engine.summary('semana', 'espera').set_index('semana')
+    assert summary['n'].to_dict() == {'-': 1, '2024-W19': 1, '2025-W19': 1, 'W19': 1}
+    assert summary.loc['2025-W19', 'media'] == 20.0
+
+
+def test_iso_year_differs_from_calendar_year_at_new_year():
+    sheet = pd.DataFrame({'hora_de_reserva': [datetime(2024, 12, 30, 9, 0), datetime(2027, 1, 1, 9, 0)]})
+    assert row_keys(sheet)['semana'].tolist() == ['2025-W01', '2026-W53']
@@ -0,0 +1,82 @@
+"""Loading reservations: nothing is dropped, truncated or coerced."""
+import io
+
+import pandas as pd
+
+from reservas_schema import INVALIDAS_SHEET, ReservationTable
+from tools.migrate_reservas import verify
+from workbook_io import read_workbook, write_workbook
+
+
+def _canonical_sheet():
+    return pd.DataFrame({
+        'Reserva_id': [1, 2, 3, 4],
+        'Fecha_ordinal': [739376, None, 739376, 739377],
+        'Inicio_min': [540, 600, 660, 540],
+        'Slots': [1, 2, None, 2],
+        'Proveedor': ['acme', 'beta', 'gama', 'acme'],
+        'Numero_de_bultos': [3, 4, 5, 2.5],
+        'Anden': [0, None, None, 1],
+    })
+
+
+def test_canonical_rows_with_blank_numbers_are_quarantined():
+    ordenes = pd.DataFrame({'Reserva_id': [2, 2, 3], 'Orden_de_compra': ['0000042', '0000043', '0000044']})
+    table = ReservationTable.from_frame(_canonical_sheet(), ordenes)
+    assert list(table.reserva_id) == [1]
+    assert [(row, reason) for row, reason, _ in table.invalid_rows] == [
+        (3, "Fecha_ordinal vacío"), (4, "Slots vacío"), (5, "Numero_de_bultos no entero: 2.5"),
+    ]
+    # Orders and the readable fields travel with the quarantined row
+    assert table.invalid_rows[0][2] == (None, '10:00:00, 10:30:00', 'beta', 4, '0000042, 0000043')
+
+
+def test_quarantined_canonical_rows_survive_the_next_save():
+    table = ReservationTable.from_frame(_canonical_sheet())
+    credentials = pd.DataFrame({'usuario': ['acme'], 'password': ['x']})
+    written = write_workbook(io.BytesIO(), credentials, table, pd.DataFrame())
+    assert len(pd.read_excel(written, sheet_name=INVALIDAS_SHEET)) == 3
+    written.seek(0)
+    _, reread, _ = read_workbook(written)
+    assert len(reread) == 1 and len(reread.invalid_rows) == 3
+
+
+def _legacy_sheet():
+    return pd.DataFrame({
+        'Fecha': ['2025-05-05 00:00:00', '2025-05-06 00:00:00'],
+        'Hora': ['09:00:00', '10:00:00, 10:30:00'],
+        'Proveedor': ['acme', 'beta'],
+        'Numero_de_bultos': [3, 2.5],
+        'Orden_de_compra': ['0000042', '0000043'],
+    })
+
+
+def test_legacy_fractional_bultos_are_quarantined_not_truncated():
+    table = ReservationTable.from_frame(_legacy_sheet())
+    assert list(table.bultos) == [3]
+    assert table.invalid_rows[0][:2] == (3, "Numero_de_bultos no entero: 2.5")
+
+
+def _migrated(table):
+    reservas_df, ordenes_df = table.to_frames()
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        reservas_df.to_excel(writer, sheet_name='proveedor_reservas', index=False)
+        ordenes_df.to_excel(writer, sheet_name='proveedor_reservas_oc', index=False)
+        table.invalid_frame().to_excel(writer, sheet_name=INVALIDAS_SHEET, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_verify_accepts_a_faithful_migration():
+    table = ReservationTable.from_frame(_legacy_sheet())
+    assert verify(_legacy_sheet(), table, _migrated(table)) == []
+
+
+def test_verify_compares_bultos_and_dock():
+    legacy = _legacy_sheet().assign(Numero_de_bultos=[3, 4], Anden=[None, 1])
+    table = ReservationTable.from_frame(legacy)
+    table.bultos[1] = 3
+    table.anden[0] = 0
+    problems = verify(legacy, table, _migrated(table))
+    assert [problem.split(':')[0] for problem in problems] == ['fila 2', 'fila 3']
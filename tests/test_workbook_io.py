@@ -0,0 +1,115 @@
+"""Workbook round trips: what is written must read back the same."""
+import io
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+from checkin import booking_row, gestion_key
+from kpis import GESTION_COLUMNS
+from reservas_schema import ReservationTable
+from workbook_io import GESTION_SHEET, patch_frame, patch_sheet, read_workbook, write_workbook
+
+
+def _workbook(ordenes=('0000042',)):
+    reservas = ReservationTable()
+    reservas.append(datetime(2025, 5, 5).toordinal(), 540, 1, 'acme', 3, list(ordenes))
+    gestion = pd.DataFrame([booking_row(reservas.record(0))], columns=GESTION_COLUMNS)
+    credentials = pd.DataFrame({'usuario': ['acme'], 'password': ['x']})
+    return write_workbook(io.BytesIO(), credentials, reservas, gestion)
+
+
+def test_gestion_orders_keep_zero_padding():
+    _, reservas, gestion = read_workbook(_workbook())
+    assert gestion['Orden_de_compra'].tolist() == ['0000042']
+    # The console key of the booking finds the gestion row
+    console_key = gestion_key(booking_row(reservas.record(0)))
+    assert console_key in {gestion_key(row) for row in gestion.to_dict('records')}
+
+
+def test_patch_sheet_updates_row_instead_of_appending():
+    _, reservas, _ = read_workbook(_workbook())
+    base = booking_row(reservas.record(0))
+    patched = patch_sheet(_workbook(), GESTION_SHEET, GESTION_COLUMNS, gestion_key,
+                          {gestion_key(base): {**base, 'Hora_llegada': datetime(2025, 5, 5, 8, 55)}})
+    _, _, gestion = read_workbook(patched)
+    assert len(gestion) == 1
+    assert gestion['Hora_llegada'].iloc[0] == datetime(2025, 5, 5, 8, 55)
+
+
+def test_patch_sheet_copies_other_parts_as_they_are():
+    _, reservas, _ = read_workbook(_workbook())
+    base = booking_row(reservas.record(0))
+    source = _workbook()
+    original = io.BytesIO(source.getvalue())
+    patched = patch_sheet(source, GESTION_SHEET, GESTION_COLUMNS, gestion_key,
+                          {gestion_key(base): {'Hora_llegada': datetime(2025, 5, 5, 8, 55)}})
+    with zipfile.ZipFile(original) as before, zipfile.ZipFile(patched) as after:
+        changed = [name for name in before.namelist() if before.read(name) != after.read(name)]
+    assert changed == ['xl/worksheets/sheet4.xml']
+
+
+def test_patch_sheet_on_workbook_saved_by_excel():
+    # Shared strings and no date style yet, as in a workbook edited by hand
+    gestion = pd.DataFrame({'Orden_de_compra': ['0000041', '0000042'], 'Proveedor': ['acme', 'beta'],
+                            'hora_de_reserva': ['2025-05-05 09:00:00', '2025-05-05 09:30:00']})
+    source = io.BytesIO()
+    with pd.ExcelWriter(source) as writer:
+        pd.DataFrame({'usuario': ['acme'], 'password': ['x']}).to_excel(writer, sheet_name='proveedor_credencial', index=False)
+        ReservationTable().to_frames()[0].to_excel(writer, sheet_name='proveedor_reservas', index=False)
+        gestion.to_excel(writer, sheet_name=GESTION_SHEET, index=False)
+    arrival = datetime(2025, 5, 5, 9, 35)
+    patches = {
+        ('beta', '42', '2025-05-05 09:30:00'): {'Hora_llegada': arrival, 'Tiempo_retraso': 5.0},
+        ('gama', '43', '2025-05-05 10:00:00'): {'Proveedor': 'gama', 'Orden_de_compra': '0000043'},
+    }
+    source.seek(0)
+    _, _, back = read_workbook(patch_sheet(source, GESTION_SHEET, GESTION_COLUMNS, gestion_key, patches))
+    assert back['Proveedor'].tolist() == ['acme', 'beta', 'gama']
+    assert back['Orden_de_compra'].tolist() == ['0000041', '0000042', '0000043']
+    assert back['Hora_llegada'].iloc[1] == arrival and back['Tiempo_retraso'].iloc[1] == 5.0
+    assert pd.isna(back['Hora_llegada'].iloc[0])
+    # The snapshot kept in memory gets the same rows
+    expected = patch_frame(gestion, GESTION_COLUMNS, gestion_key, patches)
+    assert expected['Proveedor'].tolist() == ['acme', 'beta', 'gama']
+    assert expected['Hora_llegada'].iloc[1] == arrival
+
+
+def test_suppliers_and_quarantined_rows_round_trip_verbatim():
+    reservas = ReservationTable()
+    reservas.append(datetime(2025, 5, 5).toordinal(), 540, 1, '00123', 3, ['0000042'])
+    reservas.invalid_rows.append((7, "Fecha vacía", (None, '09:00:00', '0099', '2', '0000043')))
+    credentials = pd.DataFrame({'usuario': ['00123'], 'password': ['x']})
+    _, reread, _ = read_workbook(write_workbook(io.BytesIO(), credentials, reservas, pd.DataFrame()))
+    assert reread.proveedores == ['00123']
+    assert len(reread.supplier_rows('00123')) == 1
+    assert reread.invalid_rows == reservas.invalid_rows
+
+
+def test_legacy_workbook_is_written_back_in_legacy_layout():
+    legacy = pd.DataFrame({
+        'Fecha': ['2025-05-05 00:00:00', 'basura', '2025-05-06 00:00:00'],
+        'Hora': ['09:00:00', '09:00:00', '10:00:00, 10:30:00'],
+        'Proveedor': ['00123', 'beta', 'acme'],
+        'Numero_de_bultos': [3, 1, 6],
+        'Orden_de_compra': ['0000042', '7', '0000043, 0000044'],
+    })
+    source = io.BytesIO()
+    with pd.ExcelWriter(source) as writer:
+        pd.DataFrame({'usuario': ['acme'], 'password': ['x']}).to_excel(writer, sheet_name='proveedor_credencial', index=False)
+        legacy.to_excel(writer, sheet_name='proveedor_reservas', index=False)
+    source.seek(0)
+    credentials, reservas, gestion = read_workbook(source)
+    assert reservas.layout == 'legacy'
+    reservas.append(datetime(2025, 5, 7).toordinal(), 540, 1, 'acme', 2, ['0000045'], anden=1)
+
+    written = write_workbook(io.BytesIO(), credentials, reservas, gestion)
+    sheets = pd.read_excel(written, sheet_name=None, dtype=str)
+    assert 'proveedor_reservas_oc' not in sheets
+    back = sheets['proveedor_reservas']
+    # The original rows, the unparseable one in place, then the new booking
+    assert back[list(legacy.columns)].iloc[:3].equals(legacy.astype(str))
+    assert back.iloc[3].tolist() == ['2025-05-07 00:00:00', '09:00:00', 'acme', '2', '0000045', '1']
+    written.seek(0)
+    _, reread, _ = read_workbook(written)
+    assert reread.record(2)['Anden'] == 1 and reread.layout == 'legacy'
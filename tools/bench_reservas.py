@@ -0,0 +1,90 @@
+"""Compare memory and parse cost of legacy vs canonical reservations.
+
+Generates a synthetic history, then reports for both representations:
+memory held in the process, the cost of answering "which slots are booked
+on this date" the way the app does on every rerun, and the cost of one page
+of a supplier's booking history.
+
+    python tools/bench_reservas.py --rows 100000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reservas_schema import ReservationTable, format_fecha, format_hora  # noqa: E402
+
+
+def synthetic_legacy(rows, seed=0):
+    import pandas as pd
+
+    rng = random.Random(seed)
+    start = date(2023, 1, 2)
+    suppliers = [f"proveedor_{i:03d}" for i in range(300)]
+    data = {'Fecha': [], 'Hora': [], 'Proveedor': [], 'Numero_de_bultos': [], 'Orden_de_compra': []}
+    for _ in range(rows):
+        slots = rng.choice((1, 2))
+        data['Fecha'].append(format_fecha((start + timedelta(days=rng.randrange(1000))).toordinal()))
+        data['Hora'].append(format_hora(540 + 30 * rng.randrange(13), slots))
+        data['Proveedor'].append(rng.choice(suppliers))
+        data['Numero_de_bultos'].append(rng.randrange(1, 10))
+        data['Orden_de_compra'].append(', '.join(str(rng.randrange(10**6)) for _ in range(rng.randrange(1, 3))))
+    return pd.DataFrame(data)
+
+
+def legacy_booked(reservas_df, day):
+    """The per-rerun lookup of the string format (str.contains + split)"""
+    target = day.strftime('%Y-%m-%d')
+    mask = reservas_df['Fecha'].astype(str).str.contains(target, na=False)
+    booked = set()
+    for hora in reservas_df[mask]['Hora'].tolist():
+        for part in str(hora).split(','):
+            hour, minute = part.strip().split(':')[:2]
+            booked.add(f"{int(hour):02d}:{int(minute):02d}")
+    return booked
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) / repeat, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    legacy_df = synthetic_legacy(args.rows)
+    table = ReservationTable.from_frame(legacy_df)
+    canonical_df, ordenes_df = table.to_frames()
+    day = date.fromordinal(table.fecha[0])
+
+    legacy_bytes = legacy_df.memory_usage(deep=True).sum()
+    parse_s, _ = timed(lambda: ReservationTable.from_frame(canonical_df, ordenes_df), 3)
+    legacy_query_s, _ = timed(lambda: legacy_booked(legacy_df, day), args.queries)
+    table.rows_for_date(day)  # build the index once, as a cached table would
+    table_query_s, _ = timed(lambda: table.booked_minutes(day), args.queries)
+    supplier = table.proveedores[0]
+    table.record(int(table.supplier_rows(supplier)[0]))  # build the indexes once
+    history_s, _ = timed(
+        lambda: [table.record(r) for r in table.supplier_rows(supplier, day)[::-1][:20].tolist()], args.queries)
+
+    per_100k = 100_000 / args.rows
+    print(f"rows: {args.rows}")
+    print(f"memory legacy DataFrame:  {legacy_bytes * per_100k / 2**20:8.1f} MiB / 100k")
+    print(f"memory ReservationTable:  {table.nbytes * per_100k / 2**20:8.1f} MiB / 100k")
+    print(f"load canonical sheet:     {parse_s * 1000:8.1f} ms")
+    print(f"booked slots, legacy:     {legacy_query_s * 1000:8.2f} ms / query")
+    print(f"booked slots, table:      {table_query_s * 1000:8.2f} ms / query")
+    print(f"history page, table:      {history_s * 1000:8.2f} ms / page")
+
+
+if __name__ == "__main__":
+    main()
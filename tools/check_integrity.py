@@ -0,0 +1,136 @@
+"""Scan a reservations workbook for double bookings and malformed rows.
+
+Reports slots booked beyond the number of docks, two bookings on the same
+dock and slot, bookings outside opening hours and rows that could not be
+parsed, across the whole history. Exits with status 1 when anything is
+found.
+
+Docks, opening hours and holidays are read from the same ``[capacidad]``
+section the app uses (``[almacenes.<clave>.capacidad]`` for a warehouse
+that declares its own), in ``.streamlit/secrets.toml`` or the file given
+with ``--config``; ``--andenes`` overrides the number of docks.
+
+    python tools/check_integrity.py reservas.xlsx --almacen central
+    python tools/check_integrity.py reservas.xlsx --config secrets.toml --andenes 2
+    python tools/check_integrity.py reservas.xlsx --csv problemas.csv
+    python tools/check_integrity.py --synthetic 1000000
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from capacity import CapacityConfig  # noqa: E402
+from integrity import ISSUES, scan  # noqa: E402
+from reservas_schema import (  # noqa: E402
+    ReservationTable, RESERVAS_SHEET, ORDENES_SHEET, INVALIDAS_SHEET, RESERVAS_DTYPES, ORDENES_DTYPES,
+)
+
+
+DEFAULT_CONFIG = os.path.join('.streamlit', 'secrets.toml')
+
+
+def load_config(path):
+    """Contents of a secrets.toml file"""
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        # Python < 3.11: the toml package streamlit itself reads secrets with
+        import toml
+        return toml.load(path)
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def capacity_mapping(config, almacen=None):
+    """The ``[capacidad]`` mapping the app uses for ``almacen``.
+
+    A warehouse's own ``capacidad`` wins over the global section; ``almacen``
+    can be left out when at most one warehouse is declared.
+    """
+    almacenes = config.get('almacenes') or {}
+    if almacen is None and len(almacenes) == 1:
+        almacen = next(iter(almacenes))
+    if almacen is None and almacenes:
+        raise ValueError(f"indique --almacen ({', '.join(almacenes)})")
+    if almacen is not None:
+        if almacen not in almacenes:
+            raise ValueError(f"almacén desconocido: {almacen}")
+        if 'capacidad' in almacenes[almacen]:
+            return almacenes[almacen]['capacidad']
+    return config.get('capacidad') or {}
+
+
+def load_table(path):
+    import pandas as pd
+
+    with pd.ExcelFile(path) as workbook:
+        def sheet(name, **kwargs):
+            return workbook.parse(name, **kwargs) if name in workbook.sheet_names else None
+
+        return ReservationTable.from_frame(
+            workbook.parse(RESERVAS_SHEET, dtype=RESERVAS_DTYPES),
+            sheet(ORDENES_SHEET, dtype=ORDENES_DTYPES),
+            sheet(INVALIDAS_SHEET, dtype=str),
+        )
+
+
+def synthetic_table(rows, seed=0):
+    """Canonical table of ``rows`` random bookings over about three years"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    start = 738000  # a Monday in 2021
+    fecha = start + rng.integers(0, 1100, rows)
+    fecha += (fecha - 1) % 7 == 6  # no Sundays
+    reservas_df = pd.DataFrame({
+        'Reserva_id': np.arange(1, rows + 1),
+        'Fecha_ordinal': fecha,
+        'Inicio_min': 540 + 30 * rng.integers(0, 6, rows),
+        'Slots': rng.integers(1, 3, rows),
+        'Proveedor': np.array([f"proveedor_{i:03d}" for i in range(300)])[rng.integers(0, 300, rows)],
+        'Numero_de_bultos': rng.integers(1, 10, rows),
+        'Anden': -1,
+    })
+    return ReservationTable.from_frame(reservas_df)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workbook", nargs='?', help="archivo .xlsx con la hoja proveedor_reservas")
+    parser.add_argument("--config", help=f"secrets.toml con la sección [capacidad] (por defecto {DEFAULT_CONFIG} si existe)")
+    parser.add_argument("--almacen", metavar="CLAVE", help="almacén de [almacenes.<clave>] cuya capacidad usar")
+    parser.add_argument("--andenes", type=int, help="número de andenes (reemplaza al de la configuración)")
+    parser.add_argument("--csv", help="escribir el detalle de los problemas en este archivo")
+    parser.add_argument("--synthetic", type=int, metavar="FILAS", help="escanear un historial aleatorio (medición)")
+    args = parser.parse_args(argv)
+    if not args.workbook and not args.synthetic:
+        parser.error("indique un archivo o --synthetic")
+
+    config_path = args.config or (DEFAULT_CONFIG if os.path.exists(DEFAULT_CONFIG) else None)
+    try:
+        mapping = capacity_mapping(load_config(config_path) if config_path else {}, args.almacen)
+        if args.andenes is not None:
+            mapping = {**mapping, 'andenes': args.andenes}
+        capacity = CapacityConfig.from_mapping(mapping)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    print(f"capacidad: {config_path or 'valores por defecto'}, {capacity.docks} andén(es)")
+
+    table = synthetic_table(args.synthetic) if args.synthetic else load_table(args.workbook)
+    report = scan(table, capacity)
+
+    print(f"{report.scanned} reservas escaneadas en {report.elapsed:.2f} s")
+    for kind, count in report.counts.items():
+        print(f"  {ISSUES[kind]}: {count}")
+    if args.csv:
+        report.to_frame().to_csv(args.csv, index=False)
+        print(f"detalle escrito en {args.csv}")
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
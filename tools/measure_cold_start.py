@@ -0,0 +1,124 @@
+"""Measure the import / cold-start cost of app.py.
+
+Runs ``import app`` in a fresh interpreter with ``-X importtime`` and reports
+the wall time, the cumulative import time of the heavy subsystems and whether
+they were loaded at all. With ``--network`` it also times the first
+authentication and workbook download using the real credentials.
+
+    python tools/measure_cold_start.py
+    python tools/measure_cold_start.py --runs 5 --record tools/cold_start_history.jsonl
+
+Each result is one JSON object, so recording runs before and after a change
+gives a history that tracks the improvement.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["pandas", "openpyxl", "office365", "smtplib", "email.mime.multipart"]
+
+# app.py reads these at import; dummy values keep the measurement offline
+DUMMY_ENV = {
+    "SP_SITE_URL": "https://example.sharepoint.com",
+    "SP_FILE_ID": "00000000-0000-0000-0000-000000000000",
+    "SP_USERNAME": "cold-start@example.com",
+    "SP_PASSWORD": "x",
+    "EMAIL_HOST": "localhost",
+    "EMAIL_PORT": "587",
+    "EMAIL_USER": "cold-start@example.com",
+    "EMAIL_PASSWORD": "x",
+}
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t0
+print(json.dumps({"import_s": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def _parse_importtime(stderr):
+    """Cumulative microseconds per top-level heavy module from -X importtime"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2]
+        if name in HEAVY_MODULES:
+            cumulative[name] = max(cumulative.get(name, 0), int(parts[1]))
+    return cumulative
+
+
+def measure_import():
+    env = dict(os.environ)
+    for key, value in DUMMY_ENV.items():
+        env.setdefault(key, value)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["heavy_import_us"] = _parse_importtime(proc.stderr)
+    return result
+
+
+def measure_network():
+    """Time first authentication, workbook download and PDF download"""
+    import time
+
+    sys.path.insert(0, str(ROOT))
+    import app
+
+    timings = {}
+    pool = app.SharePointContextPool()
+    t0 = time.perf_counter()
+    pool.prewarm()
+    timings["authenticate_s"] = time.perf_counter() - t0
+
+    app.get_sharepoint_pool = lambda: pool
+    t0 = time.perf_counter()
+    app._load_workbook(next(iter(app.WAREHOUSES.values())))
+    timings["workbook_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    app._fetch_pdf_attachment()
+    timings["pdf_s"] = time.perf_counter() - t0
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to average over")
+    parser.add_argument("--network", action="store_true", help="also time SharePoint authentication and downloads")
+    parser.add_argument("--record", type=Path, help="append the result as a JSON line to this file")
+    args = parser.parse_args(argv)
+
+    runs = [measure_import() for _ in range(args.runs)]
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "import_s": min(r["import_s"] for r in runs),
+        "loaded_at_import": runs[0]["loaded"],
+        "heavy_import_us": runs[0]["heavy_import_us"],
+    }
+    if args.network:
+        result["network"] = measure_network()
+
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+    if args.record:
+        with args.record.open("a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
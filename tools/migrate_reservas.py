@@ -0,0 +1,166 @@
+"""Rewrite a reservations workbook into the canonical schema.
+
+Reads a workbook whose ``proveedor_reservas`` sheet uses the legacy string
+format, converts it to the canonical columns described in
+``reservas_schema`` and writes the result, keeping every other sheet as is.
+Rows that cannot be converted are copied verbatim into
+``proveedor_reservas_invalidas`` so nothing is lost.
+
+Before writing, the conversion is verified: the written workbook is read
+back and must describe exactly the same reservations as the original.
+
+    python tools/migrate_reservas.py reservas.xlsx reservas_migrado.xlsx
+    python tools/migrate_reservas.py reservas.xlsx --in-place
+    python tools/migrate_reservas.py reservas.xlsx --dry-run
+"""
+import argparse
+import io
+import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reservas_schema import (  # noqa: E402
+    ReservationTable, RESERVAS_SHEET, ORDENES_SHEET, INVALIDAS_SHEET, RESERVAS_DTYPES, ORDENES_DTYPES,
+    parse_fecha, parse_hora, parse_ordenes,
+)
+from workbook_io import CREDENTIALS_SHEET, GESTION_SHEET, GESTION_DTYPES  # noqa: E402
+
+
+def _canonical_rows(table):
+    return [
+        (r['Reserva_id'], r['Fecha'].toordinal(), r['Inicio_min'], r['Slots'], r['Proveedor'],
+         r['Numero_de_bultos'], r['Anden'], tuple(r['Orden_de_compra']))
+        for r in map(table.record, range(len(table)))
+    ]
+
+
+def _blank(value):
+    import pandas as pd
+
+    return value is None or (pd.api.types.is_scalar(value) and bool(pd.isna(value))) or str(value).strip() == ''
+
+
+def _number(value, blank):
+    """A legacy numeric cell as it was written, without rounding"""
+    return blank if _blank(value) else float(value)
+
+
+def verify(original_df, table, written):
+    """Check the written workbook against the original legacy sheet.
+
+    Every canonical field of every converted row is compared with the
+    legacy cells it came from, and the written sheets must read back as
+    the same table, quarantined rows included.
+    """
+    import pandas as pd
+
+    reread = ReservationTable.from_frame(
+        pd.read_excel(written, sheet_name=RESERVAS_SHEET, dtype=RESERVAS_DTYPES),
+        pd.read_excel(written, sheet_name=ORDENES_SHEET, dtype=ORDENES_DTYPES),
+        pd.read_excel(written, sheet_name=INVALIDAS_SHEET, dtype=str) if table.invalid_rows else None,
+    )
+    problems = []
+    if _canonical_rows(reread) != _canonical_rows(table):
+        problems.append("la hoja canónica releída no coincide con la conversión")
+    if [row[:2] for row in reread.invalid_rows] != [row[:2] for row in table.invalid_rows]:
+        problems.append("la hoja de cuarentena releída no coincide con la conversión")
+    if len(table) + len(table.invalid_rows) != len(original_df):
+        problems.append(f"{len(original_df)} filas leídas, {len(table) + len(table.invalid_rows)} escritas")
+
+    # Every valid legacy row must map to the same values it had before
+    invalid = {row for row, _, _ in table.invalid_rows}
+    anden = original_df['Anden'] if 'Anden' in original_df.columns else pd.Series(None, index=original_df.index)
+    converted = iter(range(len(table)))
+    for position, (row, dock) in enumerate(zip(original_df.itertuples(index=False), anden)):
+        if position + 2 in invalid:
+            continue
+        record = table.record(next(converted))
+        expected = (
+            parse_fecha(row.Fecha), parse_hora(row.Hora),
+            '' if _blank(row.Proveedor) else str(row.Proveedor).strip(),
+            _number(row.Numero_de_bultos, 0), _number(dock, -1), parse_ordenes(row.Orden_de_compra),
+        )
+        actual = (
+            record['Fecha'].toordinal(), (record['Inicio_min'], record['Slots']), record['Proveedor'],
+            float(record['Numero_de_bultos']), float(record['Anden']), record['Orden_de_compra'],
+        )
+        if expected != actual:
+            problems.append(f"fila {position + 2}: {expected} != {actual}")
+    return problems
+
+
+def migrate(source, target, dry_run=False):
+    import pandas as pd
+
+    sheets = pd.read_excel(source, sheet_name=None)
+    # Text columns are re-read as text so identifiers keep their zero padding
+    sheets[CREDENTIALS_SHEET] = pd.read_excel(source, sheet_name=CREDENTIALS_SHEET, dtype=str)
+    if GESTION_SHEET in sheets:
+        sheets[GESTION_SHEET] = pd.read_excel(source, sheet_name=GESTION_SHEET, dtype=GESTION_DTYPES)
+    legacy_df = pd.read_excel(source, sheet_name=RESERVAS_SHEET, dtype=RESERVAS_DTYPES)
+    if 'Inicio_min' in legacy_df.columns:
+        print(f"{source}: ya usa el esquema canónico, nada que hacer")
+        return 0
+
+    table = ReservationTable.from_frame(legacy_df)
+    reservas_df, ordenes_df = table.to_frames()
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            if name == RESERVAS_SHEET:
+                reservas_df.to_excel(writer, sheet_name=RESERVAS_SHEET, index=False)
+                ordenes_df.to_excel(writer, sheet_name=ORDENES_SHEET, index=False)
+                if table.invalid_rows:
+                    table.invalid_frame().to_excel(writer, sheet_name=INVALIDAS_SHEET, index=False)
+            elif name not in (ORDENES_SHEET, INVALIDAS_SHEET):
+                df.to_excel(writer, sheet_name=name, index=False)
+
+    print(f"{len(legacy_df)} filas leídas, {len(table)} convertidas, {len(table.invalid_rows)} en cuarentena")
+    for row, reason, _ in table.invalid_rows:
+        print(f"  fila {row}: {reason}")
+
+    buffer.seek(0)
+    problems = verify(legacy_df, table, buffer)
+    if problems:
+        print("La verificación falló; no se escribió nada:", file=sys.stderr)
+        for problem in problems[:20]:
+            print(f"  {problem}", file=sys.stderr)
+        return 1
+
+    if dry_run:
+        print("Verificación correcta (--dry-run: no se escribió nada)")
+        return 0
+
+    if target == source:
+        backup = source.with_suffix(source.suffix + '.bak')
+        shutil.copy2(source, backup)
+        print(f"Copia de seguridad: {backup}")
+    target.write_bytes(buffer.getvalue())
+    print(f"Escrito {target}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", type=Path)
+    parser.add_argument("target", type=Path, nargs="?")
+    parser.add_argument("--in-place", action="store_true", help="overwrite the source (a .bak copy is kept)")
+    parser.add_argument("--dry-run", action="store_true", help="convert and verify without writing")
+    args = parser.parse_args(argv)
+
+    if args.in_place:
+        target = args.source
+    elif args.target is not None:
+        target = args.target
+    elif args.dry_run:
+        target = None
+    else:
+        parser.error("indique el archivo destino, --in-place o --dry-run")
+    return migrate(args.source, target, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
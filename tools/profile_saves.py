@@ -0,0 +1,140 @@
+"""Peak memory of concurrent saves: in-memory copies vs spooled streams.
+
+Each simulated save does what ``save_booking_to_excel`` does around the
+network calls: download the workbook, parse it, append one booking,
+serialize it and upload it. "SharePoint" is a local file, so only the
+memory behaviour of the two pipelines is compared:
+
+- ``memoria``: the previous path. ``response.content`` wrapped in a
+  ``BytesIO``, one ``read_excel`` per sheet, ``pandas.ExcelWriter`` into a
+  ``BytesIO`` and ``getvalue()`` as the upload body.
+- ``streaming``: the current path. Chunked copy into a spooled file,
+  ``read_workbook``/``write_workbook`` (write-only openpyxl) and an upload
+  read in ``CHUNK_BYTES`` pieces.
+
+Each mode runs in its own process and reports its peak RSS. The app also
+serializes commits behind a lock, so this is the worst case, e.g. several
+server processes on one host.
+
+    python tools/profile_saves.py --rows 100000 --concurrency 20
+"""
+import argparse
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from check_integrity import synthetic_table  # noqa: E402
+from workbook_io import (  # noqa: E402
+    CHUNK_BYTES, copy_stream, read_workbook, spooled, write_workbook,
+    CREDENTIALS_SHEET, GESTION_SHEET,
+)
+from reservas_schema import ReservationTable, RESERVAS_SHEET, ORDENES_SHEET  # noqa: E402
+
+
+def build_workbook(path, rows):
+    import pandas as pd
+
+    credentials_df = pd.DataFrame({'usuario': ['proveedor_000'], 'password': ['x'], 'Email': ['a@b.c']})
+    gestion_df = pd.DataFrame(columns=['Orden_de_compra', 'Proveedor'])
+    with open(path, 'wb') as target:
+        write_workbook(target, credentials_df, synthetic_table(rows), gestion_df)
+
+
+def save_in_memory(path):
+    import pandas as pd
+
+    with open(path, 'rb') as remote:
+        content = remote.read()                 # response.content
+    file_content = io.BytesIO(content)
+    credentials_df = pd.read_excel(file_content, sheet_name=CREDENTIALS_SHEET, dtype=str)
+    reservas = ReservationTable.from_frame(
+        pd.read_excel(file_content, sheet_name=RESERVAS_SHEET),
+        pd.read_excel(file_content, sheet_name=ORDENES_SHEET, dtype={'Orden_de_compra': str}),
+    )
+    gestion_df = pd.read_excel(file_content, sheet_name=GESTION_SHEET)
+    reservas.append(reservas.fecha[0], 540, 1, 'proveedor_000', 1, ['1'])
+    reservas_df, ordenes_df = reservas.to_frames()
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        credentials_df.to_excel(writer, sheet_name=CREDENTIALS_SHEET, index=False)
+        reservas_df.to_excel(writer, sheet_name=RESERVAS_SHEET, index=False)
+        ordenes_df.to_excel(writer, sheet_name=ORDENES_SHEET, index=False)
+        gestion_df.to_excel(writer, sheet_name=GESTION_SHEET, index=False)
+    body = excel_buffer.getvalue()              # files.add(name, body, True)
+    return len(body)
+
+
+def save_streaming(path):
+    with open(path, 'rb') as remote, spooled() as file_content:
+        copy_stream(remote, file_content)       # download session
+        file_content.seek(0)
+        credentials_df, reservas, gestion_df = read_workbook(file_content)
+    reservas.append(reservas.fecha[0], 540, 1, 'proveedor_000', 1, ['1'])
+    sent = 0
+    with write_workbook(spooled(), credentials_df, reservas, gestion_df) as excel_file:
+        while True:                             # upload session
+            chunk = excel_file.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            sent += len(chunk)
+    return sent
+
+
+def run_mode(mode, path, concurrency):
+    save = save_in_memory if mode == 'memoria' else save_streaming
+    barrier = threading.Barrier(concurrency)
+
+    def worker():
+        barrier.wait()
+        save(path)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'modo': mode,
+        'pico_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'segundos': time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mode", choices=['memoria', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument("--workbook", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.workbook, args.concurrency)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "reservas.xlsx"
+        build_workbook(path, args.rows)
+        print(f"workbook: {args.rows} reservas, {path.stat().st_size / 2**20:.1f} MiB, "
+              f"{args.concurrency} guardados simultáneos")
+        for mode in ('memoria', 'streaming'):
+            out = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--workbook", str(path),
+                 "--concurrency", str(args.concurrency)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f"{result['modo']:>10}: pico RSS {result['pico_rss_mib']:7.1f} MiB, {result['segundos']:6.1f} s")
+
+
+if __name__ == "__main__":
+    main()
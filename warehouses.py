@@ -0,0 +1,108 @@
+"""Receiving locations and their reservation workbooks.
+
+Each warehouse has its own SharePoint workbook, dock capacity grid and CC
+addresses for booking confirmations. They are declared in secrets as
+``[almacenes.<clave>]`` sections::
+
+    [almacenes.central]
+    nombre = "Almacén Central"
+    file_id = "..."
+    cc = ["recepcion.central@dismac.com.bo"]
+
+    [almacenes.central.capacidad]
+    andenes = 3
+
+A warehouse without ``capacidad`` uses the global ``[capacidad]`` grid and
+one without ``cc`` uses ``DEFAULT_CC``. Without any ``[almacenes]`` section
+the app runs a single warehouse on ``SP_FILE_ID``, as before.
+
+``load_all`` fetches the workbooks of several warehouses at the same time,
+so starting up takes about as long as the slowest one.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from capacity import CapacityConfig
+
+DEFAULT_KEY = "principal"
+DEFAULT_NAME = "Almacén Dismac"
+
+# Copied on every booking confirmation unless the warehouse sets its own
+DEFAULT_CC = ("ljbyon@dismac.com.bo",)
+
+# Workbooks downloaded at the same time by load_all
+MAX_PARALLEL_LOADS = 8
+
+
+def _email_list(value):
+    """``["a", "b"]`` or ``"a; b"`` -> ``("a", "b")``"""
+    if isinstance(value, str):
+        value = value.split(';')
+    return tuple(email.strip() for email in value if str(email).strip())
+
+
+class Warehouse:
+    """One receiving location: its workbook, dock grid and confirmation CCs"""
+
+    def __init__(self, key, nombre, file_id, capacity, cc=DEFAULT_CC):
+        self.key = key
+        self.nombre = nombre
+        self.file_id = file_id
+        self.capacity = capacity
+        self.cc = tuple(cc)
+
+    @classmethod
+    def from_mapping(cls, key, mapping, capacity=None):
+        """Build from an ``[almacenes.<key>]`` secrets section.
+
+        ``file_id`` is required; ``nombre``, ``cc`` (list or ``;``-separated)
+        and ``capacidad`` (same keys as the global section) are optional.
+        ``capacity`` is the grid used when ``capacidad`` is left out.
+        """
+        if not mapping.get('file_id'):
+            raise ValueError(f"almacenes.{key}: falta file_id")
+        if 'capacidad' in mapping:
+            try:
+                capacity = CapacityConfig.from_mapping(mapping['capacidad'])
+            except ValueError as e:
+                raise ValueError(f"almacenes.{key}.{e}")
+        return cls(
+            key=key,
+            nombre=mapping.get('nombre', key),
+            file_id=mapping['file_id'],
+            capacity=capacity or CapacityConfig(),
+            cc=_email_list(mapping.get('cc', DEFAULT_CC)),
+        )
+
+    def __repr__(self):
+        return f"Warehouse({self.key!r})"
+
+
+def load_registry(sections, file_id=None, capacity=None):
+    """Warehouses by key, in the order they are declared.
+
+    ``sections`` is the ``[almacenes]`` secrets table; when it is empty the
+    registry holds one warehouse on ``file_id`` (empty if that is not set
+    either). ``capacity`` is the default grid.
+    """
+    if sections:
+        return {
+            key: Warehouse.from_mapping(key, mapping, capacity)
+            for key, mapping in sections.items()
+        }
+    if not file_id:
+        return {}
+    return {DEFAULT_KEY: Warehouse(DEFAULT_KEY, DEFAULT_NAME, file_id, capacity or CapacityConfig())}
+
+
+def load_all(warehouses, load, max_workers=MAX_PARALLEL_LOADS):
+    """Run ``load(warehouse)`` for every warehouse at the same time.
+
+    Returns ``{key: result}``; a load that raised maps to its exception, so
+    one unreachable workbook does not keep the others from loading.
+    """
+    warehouses = list(warehouses)
+    if not warehouses:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(warehouses)), thread_name_prefix="almacen-carga") as pool:
+        futures = {warehouse.key: pool.submit(load, warehouse) for warehouse in warehouses}
+    return {key: future.exception() or future.result() for key, future in futures.items()}
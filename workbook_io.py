@@ -0,0 +1,472 @@
+"""Reading, writing and patching the reservations workbook.
+
+Workbooks travel through ``spooled()`` files: kept in memory while small and
+moved to a temporary file past ``SPOOL_MAX_BYTES``, so a large workbook
+never needs several full in-memory copies. ``read_workbook`` parses every
+sheet from one open workbook, ``write_workbook`` streams rows into the file
+with openpyxl's write-only mode (no cell objects are kept for the whole
+sheet), and ``patch_sheet`` rewrites only the changed rows in the XML of
+one sheet, copying every other part of the file (values, types and
+formatting of the other sheets) as it was, without loading the workbook.
+"""
+import re
+import shutil
+import tempfile
+from datetime import date, datetime
+from html import unescape
+from xml.sax.saxutils import escape
+
+from kpis import GESTION_COLUMNS
+from reservas_schema import (
+    ReservationTable, RESERVAS_SHEET, ORDENES_SHEET, INVALIDAS_SHEET, RESERVAS_DTYPES, ORDENES_DTYPES,
+)
+
+CREDENTIALS_SHEET = "proveedor_credencial"
+GESTION_SHEET = "proveedor_gestion"
+
+# Identifier columns of the gestion sheet are text: order numbers are zero-padded
+GESTION_DTYPES = {'Proveedor': str, 'Orden_de_compra': str}
+
+# Workbooks larger than this are spooled to disk
+SPOOL_MAX_BYTES = 8 * 2**20
+
+# Transfer chunk for uploads and downloads
+CHUNK_BYTES = 2 * 2**20
+
+
+def spooled():
+    """Empty binary stream for one workbook"""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+b')
+
+
+def stream_size(stream):
+    """Length of a seekable stream; leaves it rewound"""
+    size = stream.seek(0, 2)
+    stream.seek(0)
+    return size
+
+
+def copy_stream(source, target, chunk=CHUNK_BYTES):
+    """Copy ``source`` into ``target`` ``chunk`` bytes at a time"""
+    shutil.copyfileobj(source, target, chunk)
+
+
+def read_workbook(source):
+    """``(credentials_df, reservas, gestion_df)`` from a workbook stream.
+
+    The workbook is opened once and every sheet is parsed from it.
+    Reservations are parsed into a ``ReservationTable``; a missing gestion
+    sheet reads as an empty frame with the expected columns.
+    """
+    import pandas as pd
+
+    with pd.ExcelFile(source) as workbook:
+        sheets = set(workbook.sheet_names)
+
+        def sheet(name, **kwargs):
+            return workbook.parse(name, **kwargs) if name in sheets else None
+
+        credentials_df = workbook.parse(CREDENTIALS_SHEET, dtype=str)
+        reservas = ReservationTable.from_frame(
+            workbook.parse(RESERVAS_SHEET, dtype=RESERVAS_DTYPES),
+            # Child sheets of the canonical schema; absent in legacy workbooks
+            sheet(ORDENES_SHEET, dtype=ORDENES_DTYPES),
+            # Quarantined rows are kept verbatim
+            sheet(INVALIDAS_SHEET, dtype=str),
+        )
+        gestion_df = sheet(GESTION_SHEET, dtype=GESTION_DTYPES)
+    if gestion_df is None:
+        gestion_df = pd.DataFrame(columns=GESTION_COLUMNS)
+    return credentials_df, reservas, gestion_df
+
+
+def _append_frame(workbook, name, df):
+    sheet = workbook.create_sheet(name)
+    sheet.append([str(column) for column in df.columns])
+    # Missing values (NaN, NaT, NA) become empty cells, as with to_excel
+    for values in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        sheet.append(values)
+
+
+def write_workbook(target, credentials_df, reservas, gestion_df):
+    """Serialize all sheets into ``target`` and rewind it.
+
+    Reservations keep the layout they were read in (``reservas.layout``).
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    _append_frame(workbook, CREDENTIALS_SHEET, credentials_df)
+    if reservas.layout == 'legacy':
+        # Not migrated yet (tools/migrate_reservas.py): keep the readable
+        # Fecha / Hora sheet staff work with; bad rows stay where they were
+        _append_frame(workbook, RESERVAS_SHEET, reservas.to_legacy_frame())
+    else:
+        reservas_df, ordenes_df = reservas.to_frames()
+        _append_frame(workbook, RESERVAS_SHEET, reservas_df)
+        _append_frame(workbook, ORDENES_SHEET, ordenes_df)
+        if reservas.invalid_rows:
+            # Unparseable legacy rows are kept verbatim, never dropped
+            _append_frame(workbook, INVALIDAS_SHEET, reservas.invalid_frame())
+    _append_frame(workbook, GESTION_SHEET, gestion_df)
+    workbook.save(target)
+    target.seek(0)
+    return target
+
+
+def patch_sheet(source, sheet_name, columns, key_of, patches):
+    """Apply ``patches`` to ``sheet_name`` and return the new workbook as a stream.
+
+    ``patches`` maps a row key to ``{column: value}``; ``key_of`` computes
+    the key of an existing row from ``{column: value}``. Rows whose key is
+    not found are appended. The sheet (with ``columns`` as header) is
+    created if missing, and missing header columns are added at the end.
+
+    Only the XML of ``sheet_name`` is rewritten, and in it only the rows
+    that change: the other parts of the file are copied as they are, without
+    loading the workbook. openpyxl is used when the sheet does not exist yet.
+    """
+    import zipfile
+
+    with zipfile.ZipFile(source) as archive:
+        parts = _patch_parts(archive, sheet_name, columns, key_of, patches)
+        if parts is not None:
+            out = spooled()
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as target:
+                for info in archive.infolist():
+                    if info.filename in parts:
+                        target.writestr(info, parts[info.filename])
+                    else:
+                        with archive.open(info) as part, target.open(info, 'w') as copy:
+                            copy_stream(part, copy)
+            out.seek(0)
+            return out
+    source.seek(0)
+    return _patch_with_openpyxl(source, sheet_name, columns, key_of, patches)
+
+
+def _patch_with_openpyxl(source, sheet_name, columns, key_of, patches):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source)
+    if sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+    else:
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append(list(columns))
+
+    header = [cell.value for cell in sheet[1]]
+    for column in columns:
+        if column not in header:
+            header.append(column)
+            sheet.cell(row=1, column=len(header), value=column)
+    position = {name: i + 1 for i, name in enumerate(header) if name is not None}
+
+    # Key -> row number; a later duplicate wins, as it would when read back
+    rows = {}
+    for number, values in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+        if any(value is not None for value in values):
+            rows[key_of(dict(zip(header, values)))] = number
+
+    next_row = sheet.max_row + 1
+    for key, fields in patches.items():
+        number = rows.get(key)
+        if number is None:
+            number = rows[key] = next_row
+            next_row += 1
+        for column, value in fields.items():
+            sheet.cell(row=number, column=position[column], value=value)
+
+    out = spooled()
+    workbook.save(out)
+    out.seek(0)
+    return out
+
+
+def patch_frame(df, columns, key_of, patches):
+    """What ``patch_sheet`` does to a sheet, on the frame read from it; returns a new frame"""
+    import pandas as pd
+
+    records = df.to_dict('records')
+    rows = {key_of(record): number for number, record in enumerate(records)}
+    for key, fields in patches.items():
+        number = rows.get(key)
+        if number is None:
+            number = rows[key] = len(records)
+            records.append({})
+        records[number] = {**records[number], **fields}
+    header = list(df.columns) + [column for column in columns if column not in df.columns]
+    return pd.DataFrame(records, columns=header)
+
+
+# ── XML parts of an .xlsx, patched as text ──────────────────────
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_DOC_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_ROW = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELL = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_ATTR = re.compile(r'([\w:]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_TEXT = re.compile(r'<t\b[^>]*?(?:/>|>(.*?)</t>)', re.S)
+_VALUE = re.compile(r'<v>(.*?)</v>', re.S)
+_REF = re.compile(r'([A-Z]+)(\d+)')
+
+
+def _attrs(text):
+    return {name: unescape(double if double or not single else single) for name, double, single in _ATTR.findall(text)}
+
+
+def _rels(archive, part):
+    """``{Id: (Type, part name)}`` of the relationships of ``part``"""
+    import posixpath
+    import xml.etree.ElementTree as ET
+
+    folder, name = posixpath.split(part)
+    rels = posixpath.join(folder, '_rels', name + '.rels')
+    if rels not in archive.namelist():
+        return {}
+    found = {}
+    for rel in ET.fromstring(archive.read(rels)).iter(f'{{{_PKG_REL_NS}}}Relationship'):
+        target = rel.get('Target')
+        target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(folder, target))
+        found[rel.get('Id')] = (rel.get('Type').rsplit('/', 1)[-1], target)
+    return found
+
+
+def _shared_strings(archive, part):
+    import xml.etree.ElementTree as ET
+
+    if part is None:
+        return []
+    strings = []
+    with archive.open(part) as content:
+        for _, item in ET.iterparse(content):
+            if item.tag == f'{{{_MAIN_NS}}}si':
+                # Plain <t> or rich-text runs <r><t>; phonetic hints are not text
+                strings.append(''.join(
+                    t.text or '' for t in item.iter(f'{{{_MAIN_NS}}}t')
+                    if t in item or any(t in run for run in item.iter(f'{{{_MAIN_NS}}}r'))
+                ))
+                item.clear()
+    return strings
+
+
+def _date_styles(styles_xml):
+    """Indexes of cell styles whose number format is a date, and the first one with a time"""
+    import xml.etree.ElementTree as ET
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+    styles = ET.fromstring(styles_xml)
+    formats = dict(BUILTIN_FORMATS)
+    for fmt in styles.iter(f'{{{_MAIN_NS}}}numFmt'):
+        formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+    dates, with_time = set(), None
+    cell_xfs = styles.find(f'{{{_MAIN_NS}}}cellXfs')
+    for index, xf in enumerate(cell_xfs if cell_xfs is not None else []):
+        code = formats.get(int(xf.get('numFmtId', 0)))
+        if code and is_date_format(code):
+            dates.add(index)
+            if with_time is None and 'h' in code.lower():
+                with_time = index
+    return dates, with_time
+
+
+def _add_date_style(styles_xml):
+    """``styles_xml`` with one more cell style (built-in date-time format 22), and its index"""
+    match = re.search(r'<cellXfs\b([^>]*)>', styles_xml)
+    count = len(re.findall(r'<xf\b', styles_xml[match.end():styles_xml.index('</cellXfs>')]))
+    opening = re.sub(r'\bcount="\d+"', f'count="{count + 1}"', match.group(0))
+    xf = '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    closing = styles_xml.index('</cellXfs>')
+    return styles_xml[:match.start()] + opening + styles_xml[match.end():closing] + xf + styles_xml[closing:], count
+
+
+def _is_blank(value):
+    if value is None:
+        return True
+    try:
+        # NaN and NaT are the only values not equal to themselves
+        return bool(value != value)
+    except TypeError:
+        # pd.NA
+        return True
+
+
+class _SheetXml:
+    """Reads and writes cell values of one worksheet part"""
+
+    def __init__(self, strings, date_styles, date_style, epoch):
+        self.strings = strings
+        self.date_styles = date_styles
+        self.date_style = date_style
+        self.epoch = epoch
+
+    def value(self, attrs, inner):
+        kind = attrs.get('t', 'n')
+        if kind == 'inlineStr':
+            texts = _TEXT.findall(inner or '')
+            return ''.join(unescape(text) for text in texts) if texts else None
+        match = _VALUE.search(inner or '')
+        if match is None:
+            return None
+        raw = unescape(match.group(1))
+        if kind == 's':
+            return self.strings[int(raw)]
+        if kind in ('str', 'e'):
+            return raw
+        if kind == 'b':
+            return raw == '1'
+        if kind == 'd':
+            return datetime.fromisoformat(raw)
+        number = int(raw) if raw.lstrip('-').isdigit() else float(raw)
+        if int(attrs.get('s', 0)) in self.date_styles:
+            from openpyxl.utils.datetime import from_excel
+            return from_excel(number, self.epoch)
+        return number
+
+    def cell(self, ref, value):
+        """``<c>`` element for ``value``; None for an empty cell"""
+        import numbers
+        from openpyxl.utils.datetime import to_excel
+
+        if _is_blank(value):
+            return None
+        if isinstance(value, bool):
+            return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, date):
+            if self.date_style is None:
+                raise ValueError("no date style")
+            return f'<c r="{ref}" s="{self.date_style}"><v>{to_excel(value, self.epoch)!r}</v></c>'
+        if isinstance(value, numbers.Integral):
+            return f'<c r="{ref}"><v>{int(value)}</v></c>'
+        if isinstance(value, numbers.Real):
+            return f'<c r="{ref}"><v>{float(value)!r}</v></c>'
+        text = str(value)
+        space = ' xml:space="preserve"' if text != text.strip() else ''
+        return f'<c r="{ref}" t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+    def cells(self, inner):
+        """``{column number: (attrs, inner, element)}`` of a ``<row>`` body"""
+        from openpyxl.utils import column_index_from_string
+
+        found, column = {}, 0
+        for match in _CELL.finditer(inner or ''):
+            attrs = _attrs(match.group(1))
+            ref = _REF.match(attrs.get('r', ''))
+            column = column_index_from_string(ref.group(1)) if ref else column + 1
+            found[column] = (attrs, match.group(2), match.group(0))
+        return found
+
+
+def _patch_parts(archive, sheet_name, columns, key_of, patches):
+    """``{part name: new content}`` for a patch of ``sheet_name``; None when the sheet is missing"""
+    import xml.etree.ElementTree as ET
+    from openpyxl.utils import get_column_letter
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+    package = _rels(archive, '')
+    workbook_part = next((part for kind, part in package.values() if kind == 'officeDocument'), None)
+    if workbook_part is None:
+        return None
+    workbook = ET.fromstring(archive.read(workbook_part))
+    rels = _rels(archive, workbook_part)
+    sheet_part = next((
+        rels[sheet.get(f'{{{_DOC_REL_NS}}}id')][1]
+        for sheet in workbook.iter(f'{{{_MAIN_NS}}}sheet') if sheet.get('name') == sheet_name
+    ), None)
+    styles_part = next((part for kind, part in rels.values() if kind == 'styles'), None)
+    if sheet_part is None or styles_part is None:
+        return None
+    sheet_xml = archive.read(sheet_part).decode('utf-8')
+    opening = re.search(r'<sheetData\b[^>]*?(/?)>', sheet_xml)
+    if opening is None:
+        return None
+
+    properties = workbook.find(f'{{{_MAIN_NS}}}workbookPr')
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+    styles_xml = archive.read(styles_part).decode('utf-8')
+    date_styles, date_style = _date_styles(styles_xml)
+    patched = {}
+    if date_style is None and any(isinstance(v, date) for fields in patches.values() for v in fields.values()):
+        styles_xml, date_style = _add_date_style(styles_xml)
+        patched[styles_part] = styles_xml.encode('utf-8')
+    sheet = _SheetXml(
+        _shared_strings(archive, next((part for kind, part in rels.values() if kind == 'sharedStrings'), None)),
+        date_styles, date_style, CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900,
+    )
+
+    if opening.group(1):
+        body_start = body_end = opening.end()
+    else:
+        body_start, body_end = opening.end(), sheet_xml.index('</sheetData>', opening.end())
+    body = sheet_xml[body_start:body_end]
+
+    # Every row, in order: [number, attributes, {column: cell}, start, end]
+    rows, number = [], 0
+    for match in _ROW.finditer(body):
+        attrs = _attrs(match.group(1))
+        number = int(attrs['r']) if 'r' in attrs else number + 1
+        rows.append([number, match.group(1), sheet.cells(match.group(2)), match.start(), match.end()])
+
+    header_row = rows[0] if rows and rows[0][0] == 1 else None
+    header = {}
+    if header_row is not None:
+        header = {column: sheet.value(attrs, inner) for column, (attrs, inner, _) in header_row[2].items()}
+    else:
+        header_row = [1, '', {}, 0, 0]
+        rows.insert(0, header_row)
+    position = {name: column for column, name in header.items() if name is not None}
+    changed = set()
+    for name in columns:
+        if name not in position:
+            column = max(header, default=0) + 1
+            header[column], position[name] = name, column
+            header_row[2][column] = (None, None, sheet.cell(f'{get_column_letter(column)}1', name))
+            changed.add(0)
+
+    # Key -> row index; a later duplicate wins, as it would when read back
+    index = {}
+    for i, (_, _, cells, _, _) in enumerate(rows[1:], start=1):
+        values = {header[column]: sheet.value(attrs, inner) for column, (attrs, inner, _) in cells.items() if column in header}
+        if any(value is not None for value in values.values()):
+            index[key_of(values)] = i
+
+    last = rows[-1][0]
+    appended = []
+    for key, fields in patches.items():
+        i = index.get(key)
+        if i is None:
+            last += 1
+            i = index[key] = len(rows)
+            rows.append([last, '', {}, len(body), len(body)])
+            appended.append(i)
+        number, _, cells, _, _ = rows[i]
+        for name, value in fields.items():
+            column = position[name]
+            element = sheet.cell(f'{get_column_letter(column)}{number}', value)
+            if element is None:
+                cells.pop(column, None)
+            else:
+                cells[column] = (None, None, element)
+        changed.add(i)
+
+    def row_xml(number, attributes, cells):
+        # Spans are an optional hint that the new cells may contradict
+        attributes = re.sub(r'\s(?:r|spans)\s*=\s*("[^"]*"|\'[^\']*\')', '', attributes)
+        return f'<row r="{number}"{attributes}>' + ''.join(cells[c][2] for c in sorted(cells)) + '</row>'
+
+    pieces, cursor = [], 0
+    for i in sorted(changed - set(appended)):
+        number, attributes, cells, start, end = rows[i]
+        pieces += [body[cursor:start], row_xml(number, attributes, cells)]
+        cursor = end
+    pieces.append(body[cursor:])
+    pieces += [row_xml(*rows[i][:3]) for i in appended]
+    body = ''.join(pieces)
+
+    head = sheet_xml[:opening.start()] + '<sheetData>'
+    tail = sheet_xml[body_end:] if not opening.group(1) else '</sheetData>' + sheet_xml[opening.end():]
+    last_column = get_column_letter(max(max(header, default=1), max((max(r[2], default=1) for r in rows), default=1)))
+    head = re.sub(r'<dimension\b[^>]*?/>', f'<dimension ref="A1:{last_column}{max(r[0] for r in rows)}"/>', head)
+    patched[sheet_part] = (head + body + tail).encode('utf-8')
+    return patched